@@ -0,0 +1,87 @@
+"""
+Parse time of the DAG files, as seen by the scheduler, with a regression threshold.
+
+Each DAG file is loaded --repeat times, every time in a fresh interpreter where Airflow is already
+imported, so the time reported is the DAG file's own: its imports and the construction of its DAG.
+DOOR2DOOR_RESOURCES_PATH points to a missing directory, so a file reading its resources at parse
+time fails. The check also fails if parsing imports one of HEAVY_MODULES, which only the workers
+need, or if the median parse time exceeds --max-seconds.
+
+Usage:
+    python benchmarks/bench_dag_parse.py [--repeat 5] [--max-seconds 0.2] [dags/door2door.py ...]
+"""
+
+import argparse
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+HEAVY_MODULES = ("minio", "jsonschema", "psycopg2", "numpy", "pyarrow", "urllib3", "dateutil")
+
+PARSE_SCRIPT = """
+import importlib.util, json, sys, time
+sys.path.insert(0, {plugins!r})
+import airflow.models
+import airflow.operators.python
+import airflow.utils.trigger_rule
+before = set(sys.modules)
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("parsed_dag", {path!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+elapsed = time.perf_counter() - start
+dags = [value.dag_id for value in vars(module).values() if isinstance(value, airflow.models.DAG)]
+imported = sorted({{name.split(".")[0] for name in set(sys.modules) - before}})
+print(json.dumps({{"seconds": elapsed, "dags": dags, "imported": imported}}))
+"""
+
+
+def parse_dag_file(path):
+    """Loads a DAG file in a fresh interpreter and returns the parse time, DAG ids and new top-level modules."""
+    env = dict(os.environ, DOOR2DOOR_RESOURCES_PATH=os.path.join(tempfile.gettempdir(), "door2door-missing-resources"))
+    script = PARSE_SCRIPT.format(plugins=os.path.join(ROOT, "plugins"), path=os.path.abspath(path))
+    result = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"parsing {path} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="DAG files. Defaults to every file in dags/.")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per DAG file, the median is reported.")
+    parser.add_argument("--max-seconds", type=float, default=0.2, help="Maximum median parse time of a DAG file.")
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(p for p in glob.glob(os.path.join(ROOT, "dags", "*.py")) if not p.endswith("__init__.py"))
+    failures = []
+    for path in paths:
+        runs = [parse_dag_file(path) for _ in range(args.repeat)]
+        seconds = statistics.median(run["seconds"] for run in runs)
+        heavy = sorted(set(runs[0]["imported"]) & set(HEAVY_MODULES))
+
+        print(f"{os.path.relpath(path, ROOT)}:")
+        print(f"  dags:          {runs[0]['dags']}")
+        print(f"  parse time:    {seconds * 1000:.1f} ms (median of {args.repeat})")
+        print(f"  new modules:   {runs[0]['imported']}")
+
+        if not runs[0]["dags"]:
+            failures.append(f"{path}: no DAG found")
+        if heavy:
+            failures.append(f"{path}: parsing imports {heavy}")
+        if seconds > args.max_seconds:
+            failures.append(f"{path}: parse time {seconds:.3f}s above {args.max_seconds}s")
+
+    if failures:
+        sys.exit("FAIL: " + "; ".join(failures))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
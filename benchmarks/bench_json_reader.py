@@ -0,0 +1,83 @@
+"""
+Compares the legacy whole-file JSON reader with the streaming `iter_json_file` reader.
+
+For each file layout a synthetic file is generated and both readers are timed while
+tracking peak Python memory with tracemalloc.
+
+Usage:
+    python benchmarks/bench_json_reader.py [--vehicles 200] [--updates 500]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plugins"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import LAYOUTS, generate_events, write_events
+from utils.json_utils import iter_json_file
+
+
+def legacy_read_json_file(file_path):
+    # The reader used before iter_json_file, kept here as the baseline
+    with open(file_path, "r") as f:
+        file_contents = f.read()
+    try:
+        return [json.loads(file_contents)]
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(f"[{file_contents}]")
+    except json.JSONDecodeError:
+        pass
+    lines = file_contents.strip().split("\n")
+    return [json.loads(line) for line in lines]
+
+
+def legacy_count(file_path):
+    data = legacy_read_json_file(file_path)
+    # a bracketed array comes back wrapped in a list
+    if len(data) == 1 and isinstance(data[0], list):
+        data = data[0]
+    return sum(1 for _ in data)
+
+
+def streaming_count(file_path):
+    return sum(1 for _ in iter_json_file(file_path))
+
+
+def measure(fn, file_path):
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = fn(file_path)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vehicles", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=500)
+    args = parser.parse_args()
+
+    events = generate_events(n_vehicles=args.vehicles, updates_per_vehicle=args.updates)
+    print(f"{'layout':<14}{'reader':<11}{'MB':>8}{'events':>10}{'seconds':>10}{'events/s':>12}{'peak MB':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for layout in LAYOUTS:
+            path = os.path.join(tmp_dir, f"events.{layout}.json")
+            write_events(path, events, layout)
+            size_mb = os.path.getsize(path) / 1e6
+            for name, fn in (("legacy", legacy_count), ("streaming", streaming_count)):
+                count, elapsed, peak = measure(fn, path)
+                print(f"{layout:<14}{name:<11}{size_mb:>8.1f}{count:>10}{elapsed:>10.2f}{count / elapsed:>12.0f}{peak / 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""
+Accuracy check and benchmark of the numpy metrics engine against the PostGIS one.
+
+Offline (--offline), the haversine distances of utils.distance_utils are compared with the WGS84
+geodesic distances of Vincenty's formula over points spread across all latitudes, and the engine's
+segment and period computation is timed on synthetic updates.
+
+Against a database, both engines compute the distance travelled of a loaded run inside a
+transaction that is rolled back: the run's stored segments are deleted first so that the PostGIS
+engine recomputes them. The check fails if a period differs by more than DISTANCE_TOLERANCE.
+
+Usage:
+    python benchmarks/bench_metrics_engine.py --offline [--vehicles 1000] [--updates 1000]
+    PSQL_CONNECTION_STRING=postgresql://... python benchmarks/bench_metrics_engine.py [--correlation-id ID]
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plugins"))
+
+from utils.distance_utils import DISTANCE_TOLERANCE, haversine, period_sums, segment_distances
+
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
+
+def vincenty(longitude1, latitude1, longitude2, latitude2):
+    """WGS84 geodesic distance in meters, Vincenty's inverse formula."""
+    b = WGS84_A * (1 - WGS84_F)
+    u1 = math.atan((1 - WGS84_F) * math.tan(math.radians(latitude1)))
+    u2 = math.atan((1 - WGS84_F) * math.tan(math.radians(latitude2)))
+    length = math.radians(longitude2 - longitude1)
+    lam = length
+    sin_u1, cos_u1, sin_u2, cos_u2 = math.sin(u1), math.cos(u1), math.sin(u2), math.cos(u2)
+    for _ in range(200):
+        sin_lam, cos_lam = math.sin(lam), math.cos(lam)
+        sin_sigma = math.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+        if sin_sigma == 0:
+            return 0.0
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+        sigma = math.atan2(sin_sigma, cos_sigma)
+        sin_alpha = cos_u1 * cos_u2 * sin_lam / sin_sigma
+        cos2_alpha = 1 - sin_alpha ** 2
+        cos_2sigma_m = cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha if cos2_alpha else 0.0
+        c = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+        previous, lam = lam, length + (1 - c) * WGS84_F * sin_alpha * (
+            sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+        )
+        if abs(lam - previous) < 1e-12:
+            break
+    u_squared = cos2_alpha * (WGS84_A ** 2 - b ** 2) / b ** 2
+    big_a = 1 + u_squared / 16384 * (4096 + u_squared * (-768 + u_squared * (320 - 175 * u_squared)))
+    big_b = u_squared / 1024 * (256 + u_squared * (-128 + u_squared * (74 - 47 * u_squared)))
+    delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+        - big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+    ))
+    return b * big_a * (sigma - delta_sigma)
+
+
+def check_tolerance(samples=20000, seed=0):
+    rng = random.Random(seed)
+    worst = 0.0
+    for _ in range(samples):
+        latitude = rng.uniform(-85, 85)
+        longitude = rng.uniform(-180, 180)
+        # Vehicle updates are a few seconds apart, so segments are short
+        step = rng.uniform(1, 500) / 111000
+        bearing = rng.uniform(0, 2 * math.pi)
+        latitude2 = latitude + step * math.cos(bearing)
+        longitude2 = longitude + step * math.sin(bearing) / max(math.cos(math.radians(latitude)), 0.01)
+        expected = vincenty(longitude, latitude, longitude2, latitude2)
+        if expected == 0:
+            continue
+        actual = float(haversine(np.array([longitude]), np.array([latitude]), np.array([longitude2]), np.array([latitude2]))[0])
+        worst = max(worst, abs(actual - expected) / expected)
+    print(f"haversine vs WGS84 geodesic: max relative error {worst:.4%} over {samples} segments (tolerance {DISTANCE_TOLERANCE:.2%})")
+    return worst <= DISTANCE_TOLERANCE
+
+
+def bench_offline(n_vehicles, updates_per_vehicle, seed=0):
+    rng = np.random.default_rng(seed)
+    n = n_vehicles * updates_per_vehicle
+    vehicles = np.repeat(np.arange(n_vehicles), updates_per_vehicle)
+    times = np.tile(np.arange(updates_per_vehicle, dtype=np.int64) * 3000000, n_vehicles)
+    longitudes = 13.40 + np.cumsum(rng.uniform(-0.0005, 0.0005, n))
+    latitudes = 52.52 + np.cumsum(rng.uniform(-0.0005, 0.0005, n))
+    # Ten periods per vehicle
+    period_vehicles = np.repeat(np.arange(n_vehicles), 10)
+    period_starts = np.tile(np.arange(10, dtype=np.int64) * updates_per_vehicle * 300000, n_vehicles)
+    period_finishes = period_starts + updates_per_vehicle * 300000
+
+    started_at = time.perf_counter()
+    distances = segment_distances(vehicles, longitudes, latitudes)
+    period_sums(vehicles, times, distances, period_vehicles, period_starts, period_finishes)
+    elapsed = time.perf_counter() - started_at
+    print(f"numpy engine: {n} updates, {len(period_vehicles)} periods in {elapsed:.3f}s ({n / elapsed:,.0f} updates/s)")
+
+
+def bench_database(correlation_id):
+    import psycopg2
+
+    from utils.psql_utils import InstrumentedConnection
+    from utils.utils import day_time_range
+    from tasks.calculate_operating_periods_metrics import (
+        DEFAULT_CARRY_OVER_WINDOW,
+        DISTANCE_TRAVELLED_QUERY,
+        SEGMENTS_QUERY,
+        numpy_distance_travelled,
+    )
+
+    connection = psycopg2.connect(os.environ.get("PSQL_CONNECTION_STRING"), connection_factory=InstrumentedConnection)
+    try:
+        with connection.cursor() as cursor:
+            if correlation_id is None:
+                cursor.execute("SELECT correlation_id FROM operating_period ORDER BY event_time DESC LIMIT 1")
+                row = cursor.fetchone()
+                if row is None:
+                    sys.exit("operating_period is empty, load a run first")
+                correlation_id = row[0]
+            params = {
+                "correlation_id": correlation_id,
+                "correlation_ids": [correlation_id],
+                "carry_over_window": DEFAULT_CARRY_OVER_WINDOW,
+            }
+            # the range of the run's dates, which the task gets from its target_date (see run_time_range)
+            cursor.execute(
+                "SELECT min(location_time), max(location_time) FROM vehicle_update WHERE correlation_id = %(correlation_id)s",
+                params,
+            )
+            first_time, last_time = cursor.fetchone()
+            params["run_start"], params["run_end"] = (
+                day_time_range(first_time.date(), last_time.date()) if first_time else (None, None)
+            )
+
+            cursor.execute("DELETE FROM vehicle_update_segment WHERE correlation_id = %(correlation_id)s", params)
+            started_at = time.perf_counter()
+            cursor.execute(SEGMENTS_QUERY, params)
+            cursor.execute(DISTANCE_TRAVELLED_QUERY, params)
+            postgis_elapsed = time.perf_counter() - started_at
+            cursor.execute(
+                "SELECT operating_period, distance_travelled FROM operating_period_metrics "
+                "WHERE correlation_id = %(correlation_id)s AND distance_travelled IS NOT NULL",
+                params,
+            )
+            expected = dict(cursor.fetchall())
+
+        started_at = time.perf_counter()
+        distances, _ = numpy_distance_travelled(connection, params)
+        actual = {period: distance for period, distance, _ in distances}
+        numpy_elapsed = time.perf_counter() - started_at
+    finally:
+        connection.rollback()
+        connection.close()
+
+    print(f"correlation_id: {correlation_id}")
+    print(f"postgis engine: {postgis_elapsed:.3f}s")
+    print(f"numpy engine:   {numpy_elapsed:.3f}s")
+
+    if expected.keys() != actual.keys():
+        print(f"periods differ: {len(expected.keys() ^ actual.keys())}")
+        return False
+    worst = max(
+        (abs(actual[period] - distance) / distance for period, distance in expected.items() if distance),
+        default=0.0,
+    )
+    print(f"{len(expected)} periods, max relative difference {worst:.4%} (tolerance {DISTANCE_TOLERANCE:.2%})")
+    return worst <= DISTANCE_TOLERANCE
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--offline", action="store_true", help="Check against Vincenty's formula instead of PostGIS.")
+    parser.add_argument("--vehicles", type=int, default=1000)
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--correlation-id", help="Run to compare. Defaults to the latest run with operating periods.")
+    args = parser.parse_args()
+
+    if args.offline:
+        ok = check_tolerance()
+        bench_offline(args.vehicles, args.updates)
+    else:
+        ok = bench_database(args.correlation_id)
+    if not ok:
+        sys.exit("FAIL: the numpy engine is out of tolerance")
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Measures the file size from which process-pool validation beats single-process validation.
+
+One synthetic NDJSON file is written per size and validated with the task's own functions: once
+in the task's process with `valid_file`, and once with `validate_file_in_pool` in a new pool from
+`validation_executor` for each worker count, the way `fetch_and_validate_bucket` does with
+`validation_workers`. Every pool run includes the start of its worker processes and their imports,
+which a task pays once per run, so the smallest size where the pool wins is the break-even file size.
+
+Usage:
+    python benchmarks/bench_parallel_validation.py [--sizes-mb 4 16 64 128] [--workers 2 4 8] [--chunk-size 4194304]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "plugins"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# the validators of the task read the repository's schemas
+os.environ.setdefault("DOOR2DOOR_RESOURCES_PATH", os.path.join(ROOT, "resources"))
+
+from synthetic import generate_events, write_events
+from tasks.fetch_and_validate_bucket import event_type, valid_file, validate_event
+from utils.parallel_validation import validate_file_in_pool, validation_executor
+
+VEHICLES = 50
+# Size of a synthetic vehicle update in NDJSON, to size the files
+EVENT_BYTES = 240
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[4, 16, 64, 128])
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--chunk-size", type=int, default=4 * 1024 * 1024)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, chunk size {args.chunk_size / 1e6:.1f} MB")
+    break_even = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size_mb in args.sizes_mb:
+            path = os.path.join(tmp_dir, f"2019-06-01-{size_mb:g}mb.json")
+            updates = max(1, int(size_mb * 1e6 / EVENT_BYTES / VEHICLES))
+            write_events(path, generate_events(VEHICLES, updates, seed=int(size_mb)), "ndjson")
+            file_mb = os.path.getsize(path) / 1e6
+
+            started = time.perf_counter()
+            assert valid_file(path)
+            serial = time.perf_counter() - started
+            print(f"{file_mb:>7.1f} MB  serial:     {serial:>7.2f}s")
+
+            for workers in args.workers:
+                started = time.perf_counter()
+                with validation_executor(workers) as executor:
+                    assert validate_file_in_pool(executor, path, validate_event, valid_file, args.chunk_size, event_type)
+                elapsed = time.perf_counter() - started
+                print(f"{file_mb:>7.1f} MB  {workers:>2} workers: {elapsed:>7.2f}s ({serial / elapsed:.2f}x)")
+                if elapsed < serial:
+                    break_even.setdefault(workers, file_mb)
+
+    for workers in args.workers:
+        if workers in break_even:
+            print(f"break-even with {workers} workers: files of {break_even[workers]:.1f} MB or more")
+        else:
+            print(f"break-even with {workers} workers: not reached up to {max(args.sizes_mb):g} MB, keep validation_workers off")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Latency of the fleet queries of the BI dashboards, computed from the raw tables against read from the
+rollup tables maintained by update_rollups.
+
+Each query is run --repeat times over the days from --start-date to --end-date (by default every day
+in organization_activity_daily) and the median wall time, including fetching the rows, is reported
+with the speedup of the rollup. The row counts of both versions are printed as a sanity check; see
+check_rollup_consistency.py for a full comparison of the values.
+
+Usage:
+    PSQL_CONNECTION_STRING=postgresql://... python benchmarks/bench_rollup_queries.py [--start-date 2019-06-01 --end-date 2019-06-07] [--repeat 5]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+import psycopg2
+
+# (query, raw version, rollup version), over the UTC days from %(start_day)s to %(end_day)s excluded
+QUERIES = [
+    (
+        "distance per vehicle and hour",
+        """
+        SELECT u.organization_id, u.vehicle_id, date_trunc('hour', u.location_time, 'UTC'), count(*), coalesce(sum(s.distance), 0)
+        FROM vehicle_update u LEFT JOIN vehicle_update_segment s ON s.update_uid = u.uid
+        WHERE u.location_time >= %(start_day)s::timestamp AT TIME ZONE 'UTC' AND u.location_time < %(end_day)s::timestamp AT TIME ZONE 'UTC'
+        GROUP BY 1, 2, 3
+        """,
+        """
+        SELECT organization_id, vehicle_id, hour, updates, distance
+        FROM vehicle_activity_hourly
+        WHERE hour >= %(start_day)s::timestamp AT TIME ZONE 'UTC' AND hour < %(end_day)s::timestamp AT TIME ZONE 'UTC'
+        """,
+    ),
+    (
+        "distance per vehicle and day",
+        """
+        SELECT u.organization_id, u.vehicle_id, (u.location_time AT TIME ZONE 'UTC')::date, count(*), coalesce(sum(s.distance), 0)
+        FROM vehicle_update u LEFT JOIN vehicle_update_segment s ON s.update_uid = u.uid
+        WHERE u.location_time >= %(start_day)s::timestamp AT TIME ZONE 'UTC' AND u.location_time < %(end_day)s::timestamp AT TIME ZONE 'UTC'
+        GROUP BY 1, 2, 3
+        """,
+        """
+        SELECT organization_id, vehicle_id, day, updates, distance
+        FROM vehicle_activity_daily
+        WHERE day >= %(start_day)s AND day < %(end_day)s
+        """,
+    ),
+    (
+        "active vehicles per organization and day",
+        """
+        SELECT organization_id, (location_time AT TIME ZONE 'UTC')::date, count(DISTINCT vehicle_id)
+        FROM vehicle_update
+        WHERE location_time >= %(start_day)s::timestamp AT TIME ZONE 'UTC' AND location_time < %(end_day)s::timestamp AT TIME ZONE 'UTC'
+        GROUP BY 1, 2
+        """,
+        """
+        SELECT organization_id, day, active_vehicles
+        FROM organization_activity_daily
+        WHERE day >= %(start_day)s AND day < %(end_day)s AND active_vehicles > 0
+        """,
+    ),
+    (
+        "utilisation per operating period",
+        """
+        SELECT
+            o.operating_period_id, o.organization_id, o.vehicle_id, extract(epoch FROM o.finish - o.start), m.distance_travelled,
+            (SELECT count(*) FROM vehicle_update u WHERE u.vehicle_id = o.vehicle_id AND u.location_time BETWEEN o.start AND o.finish)
+        FROM operating_period o LEFT JOIN operating_period_metrics m ON m.operating_period = o.operating_period_id
+        WHERE
+            o.vehicle_id IS NOT NULL
+            AND o.start >= %(start_day)s::timestamp AT TIME ZONE 'UTC' AND o.start < %(end_day)s::timestamp AT TIME ZONE 'UTC'
+        """,
+        """
+        SELECT operating_period_id, organization_id, vehicle_id, operating_seconds, distance_travelled, updates
+        FROM operating_period_utilisation
+        WHERE day >= %(start_day)s AND day < %(end_day)s
+        """,
+    ),
+]
+
+
+def time_query(cursor, query, params, repeat):
+    """Median wall time in seconds of running `query` and fetching its rows, and its row count."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--start-date", type=date.fromisoformat, help="First day queried.")
+    parser.add_argument("--end-date", type=date.fromisoformat, help="Last day queried, included.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each query, the median is reported.")
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(os.environ.get("PSQL_CONNECTION_STRING"))
+    try:
+        with connection.cursor() as cursor:
+            start_day, end_day = args.start_date, args.end_date
+            if start_day is None or end_day is None:
+                cursor.execute("SELECT min(day), max(day) FROM organization_activity_daily")
+                first_day, last_day = cursor.fetchone()
+                if first_day is None:
+                    sys.exit("organization_activity_daily is empty, run update_rollups first")
+                start_day, end_day = start_day or first_day, end_day or last_day
+            params = {"start_day": start_day, "end_day": end_day + timedelta(days=1)}
+            print(f"days: {start_day} to {end_day}, median of {args.repeat} runs")
+
+            for name, raw_query, rollup_query in QUERIES:
+                raw_seconds, raw_rows = time_query(cursor, raw_query, params, args.repeat)
+                rollup_seconds, rollup_rows = time_query(cursor, rollup_query, params, args.repeat)
+                print(f"{name}:")
+                print(f"  raw:     {raw_seconds * 1000:10.1f} ms  {raw_rows} rows")
+                print(f"  rollup:  {rollup_seconds * 1000:10.1f} ms  {rollup_rows} rows")
+                print(f"  speedup: {raw_seconds / rollup_seconds:10.1f}x")
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Conformance check and microbenchmark for the compiled schema validators.
+
+The conformance suite validates synthetic events and systematic mutations of them (every
+field removed or replaced by values of every JSON type) against each schema in
+resources/jsonschemas/, with both `jsonschema.Draft7Validator` and `CompiledValidator`,
+and fails on the first disagreement. The benchmark then reports events/sec for both.
+
+Usage:
+    python benchmarks/bench_schema_validation.py [--vehicles 100] [--updates 500]
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+import jsonschema
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "plugins"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import generate_events
+from utils.schema_compiler import CompiledValidator
+
+SCHEMA_DIR = os.path.join(ROOT, "resources", "jsonschemas")
+REPLACEMENTS = [None, True, False, 0, 1, -2, 1.5, 2.0, "", "text", [], [1], {}, {"x": 1}]
+
+
+def load_schemas():
+    schemas = {}
+    for name in sorted(os.listdir(SCHEMA_DIR)):
+        if name.endswith(".json"):
+            with open(os.path.join(SCHEMA_DIR, name)) as f:
+                schemas[name[:-5]] = json.load(f)
+    return schemas
+
+
+def paths(obj, prefix=()):
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            yield prefix + (key,)
+            yield from paths(value, prefix + (key,))
+
+
+def mutations(obj):
+    yield obj
+    for path in paths(obj):
+        removed = copy.deepcopy(obj)
+        parent = removed
+        for key in path[:-1]:
+            parent = parent[key]
+        del parent[path[-1]]
+        yield removed
+        for value in REPLACEMENTS:
+            replaced = copy.deepcopy(obj)
+            parent = replaced
+            for key in path[:-1]:
+                parent = parent[key]
+            parent[path[-1]] = value
+            yield replaced
+    yield from REPLACEMENTS
+
+
+def conformance(schemas, samples):
+    checked = 0
+    for name, schema in schemas.items():
+        reference = jsonschema.Draft7Validator(schema)
+        compiled = CompiledValidator(schema)
+        assert compiled.compiled, f"{name} fell back to jsonschema"
+        for sample in samples:
+            for instance in mutations(sample):
+                expected = reference.is_valid(instance)
+                actual = compiled.is_valid(instance)
+                if expected != actual:
+                    raise AssertionError(f"{name}: jsonschema={expected} compiled={actual} for {instance!r}")
+                checked += 1
+    return checked
+
+
+def throughput(is_valid_by_event, events):
+    started = time.perf_counter()
+    for event in events:
+        is_valid_by_event[(event["on"], event["event"])](event)
+    return len(events) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vehicles", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=500)
+    args = parser.parse_args()
+
+    schemas = load_schemas()
+    events = generate_events(n_vehicles=args.vehicles, updates_per_vehicle=args.updates)
+
+    # one sample of each event type is enough: mutations cover every field
+    samples = list({(e["on"], e["event"]): e for e in events}.values())
+    print(f"conformance: {conformance(schemas, samples)} cases identical")
+
+    dispatch = {
+        ("vehicle", "update"): "vehicle_update",
+        ("vehicle", "register"): "vehicle_registration",
+        ("vehicle", "deregister"): "vehicle_registration",
+        ("operating_period", "create"): "operating_period",
+        ("operating_period", "delete"): "operating_period",
+    }
+    reference = {key: jsonschema.Draft7Validator(schemas[name]).is_valid for key, name in dispatch.items()}
+    compiled = {key: CompiledValidator(schemas[name]).is_valid for key, name in dispatch.items()}
+
+    before = throughput(reference, events)
+    after = throughput(compiled, events)
+    print(f"jsonschema.Draft7Validator: {before:>12.0f} events/s")
+    print(f"CompiledValidator:          {after:>12.0f} events/s ({after / before:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Accuracy check and benchmark of the trajectory compression of utils.trajectory_utils.
+
+The vectorized Douglas-Peucker is first compared with the recursive algorithm on random walks: the
+check fails if they keep different points. Then the vehicle updates of a synthetic day are compressed
+file by file (one file per --file-minutes window, like the loader flushes them) for each tolerance,
+reporting the compression ratio, the error of the distance travelled over the kept points, and the
+points/sec of the compression next to the events/sec of parsing and mapping the same updates.
+
+Usage:
+    python benchmarks/bench_trajectory_compression.py [--vehicles 200] [--update-interval 3] [--tolerances 1 5 10 25]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plugins"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import generate_day
+from tasks.fetch_and_import_to_psql import event_to_row
+from utils.trajectory_utils import TrajectoryCompressor, point_segment_distances, simplify_trajectories
+
+
+def recursive_douglas_peucker(x, y, first, last, tolerance, keep):
+    """The textbook recursion, as the reference."""
+    if last - first < 2:
+        return
+    inner = np.arange(first + 1, last)
+    distances = point_segment_distances(x[inner], y[inner], x[first], y[first], x[last], y[last])
+    farthest = int(np.argmax(distances))
+    if distances[farthest] > tolerance:
+        split = inner[farthest]
+        keep[split] = True
+        recursive_douglas_peucker(x, y, first, split, tolerance, keep)
+        recursive_douglas_peucker(x, y, split, last, tolerance, keep)
+
+
+def check_against_recursive(trials=100, seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(trials):
+        sizes = rng.integers(1, 500, rng.integers(1, 20))
+        starts = np.cumsum(sizes) - sizes
+        ends = starts + sizes - 1
+        x = np.cumsum(rng.normal(0, 10, sizes.sum()))
+        y = np.cumsum(rng.normal(0, 10, sizes.sum()))
+        tolerance = rng.uniform(0.5, 50)
+
+        expected = np.zeros(len(x), dtype=bool)
+        expected[starts] = expected[ends] = True
+        for first, last in zip(starts, ends):
+            recursive_douglas_peucker(x, y, first, last, tolerance, expected)
+        if not np.array_equal(simplify_trajectories(starts, ends, x, y, tolerance), expected):
+            sys.exit("FAIL: the vectorized Douglas-Peucker differs from the recursive one")
+    print(f"vectorized Douglas-Peucker matches the recursive one on {trials} random fleets")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vehicles", type=int, default=200, help="Number of vehicles in the fleet.")
+    parser.add_argument("--update-interval", type=float, default=3.0, help="Mean seconds between two updates of a vehicle.")
+    parser.add_argument("--file-minutes", type=int, default=60, help="Time window of each source file.")
+    parser.add_argument("--tolerances", type=float, nargs="+", default=[1, 5, 10, 25], help="Tolerances in meters.")
+    args = parser.parse_args()
+
+    check_against_recursive()
+
+    files = {}
+    for at, event in generate_day(date(2019, 6, 1), n_vehicles=args.vehicles, update_interval=args.update_interval):
+        if event["event"] == "update":
+            window = (at.hour * 60 + at.minute) // args.file_minutes
+            files.setdefault(window, []).append(json.dumps(event))
+    lines = [line for window in sorted(files) for line in files[window]]
+
+    started_at = time.perf_counter()
+    files = {window: [event_to_row(json.loads(line), "benchmark") for line in file_lines] for window, file_lines in files.items()}
+    parse_seconds = time.perf_counter() - started_at
+    print(f"{len(lines)} vehicle updates in {len(files)} files, parsed and mapped at {len(lines) / parse_seconds:,.0f} events/s")
+
+    for tolerance in args.tolerances:
+        compressor = TrajectoryCompressor(tolerance)
+        started_at = time.perf_counter()
+        for rows in files.values():
+            for _, columns, row in rows:
+                compressor.add(columns, row)
+            compressor.drain()
+        seconds = time.perf_counter() - started_at
+        error = (compressor.raw_distance - compressor.kept_distance) / compressor.raw_distance
+        print(
+            f"tolerance {tolerance:g}m: kept {compressor.points_kept} of {compressor.points} points "
+            f"({compressor.points / compressor.points_kept:.1f}x), distance travelled {error:.3%} shorter, "
+            f"{compressor.points / seconds:,.0f} points/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
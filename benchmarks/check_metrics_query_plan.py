@@ -0,0 +1,174 @@
+"""
+EXPLAIN-based check that the distance queries of calculate_operating_periods_metrics can use the
+vehicle_update and vehicle_update_segment indexes and prune the daily vehicle_update partitions.
+
+The queries are run with EXPLAIN (ANALYZE, FORMAT JSON) inside a transaction that is rolled back,
+with the default planner settings, after the tables they read are analyzed, and with the location time
+range of the run's dates as the task passes it (see `run_time_range`). The check fails if a query reads
+no vehicle_update relation through an index, or if the scan of the run's own updates (the run_updates,
+run_spans and spans CTEs) reads every vehicle_update partition (unless --skip-pruning is given).
+
+The verdict is only meaningful on representative data: a planner rightly prefers sequential scans on
+small tables. The check refuses to run with fewer than --min-updates rows in vehicle_update, or with
+fewer than two daily partitions, e.g. on less than a few days of synthetic.py fleet data loaded with
+harness.py.
+
+Usage:
+    PSQL_CONNECTION_STRING=postgresql://... python benchmarks/check_metrics_query_plan.py [--correlation-id ID] [--min-updates 100000] [--skip-pruning]
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plugins"))
+
+from utils.utils import day_time_range
+from tasks.calculate_operating_periods_metrics import (
+    DEFAULT_CARRY_OVER_WINDOW,
+    DISTANCE_TRAVELLED_QUERY,
+    NEXT_SEGMENTS_QUERY,
+    PERIOD_POINTS_QUERY,
+    SEGMENTS_QUERY,
+)
+
+QUERIES = {
+    "segments": SEGMENTS_QUERY,
+    "next_segments": NEXT_SEGMENTS_QUERY,
+    "distance_travelled": DISTANCE_TRAVELLED_QUERY,
+    "period_points": PERIOD_POINTS_QUERY,
+}
+
+# The CTE of each query that looks the run's updates up by correlation ID and location time range
+RUN_POINTS_SCANS = {
+    "segments": "CTE run_updates",
+    "next_segments": "CTE run_spans",
+    "period_points": "CTE spans",
+}
+
+INDEX_NODES = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+ANALYZED_TABLES = ("vehicle_update", "vehicle_update_segment", "operating_period", "operating_period_metrics")
+
+
+def walk(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from walk(child)
+
+
+def find_subplan(node, name):
+    return next((n for n in walk(node) if n.get("Subplan Name") == name), None)
+
+
+def vehicle_update_relation(node):
+    relation = node.get("Relation Name") or ""
+    index = node.get("Index Name") or ""
+    return relation.startswith("vehicle_update") or index.startswith("vehicle_update")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--correlation-id", help="Run to explain. Defaults to the latest run with operating periods.")
+    parser.add_argument("--min-updates", type=int, default=100000, help="Minimum vehicle_update rows for the plans to be representative.")
+    parser.add_argument("--skip-pruning", action="store_true", help="Do not fail if no partition was pruned.")
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(os.environ.get("PSQL_CONNECTION_STRING"))
+    try:
+        with connection.cursor() as cursor:
+            correlation_id = args.correlation_id
+            if correlation_id is None:
+                cursor.execute("SELECT correlation_id FROM operating_period ORDER BY event_time DESC LIMIT 1")
+                row = cursor.fetchone()
+                if row is None:
+                    sys.exit("operating_period is empty, load a run first")
+                correlation_id = row[0]
+
+            cursor.execute("SELECT count(*) FROM (SELECT 1 FROM vehicle_update LIMIT %s) u", (args.min_updates,))
+            updates = cursor.fetchone()[0]
+            cursor.execute(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'vehicle_update'::regclass"
+            )
+            partition_names = {relname for relname, in cursor.fetchall()}
+            partitions = len(partition_names)
+            if updates < args.min_updates:
+                sys.exit(f"vehicle_update has {updates} rows, fewer than --min-updates {args.min_updates}: the plans would not be representative")
+            if partitions < 2 and not args.skip_pruning:
+                sys.exit(f"vehicle_update has {partitions} partitions, load several days to check pruning or pass --skip-pruning")
+
+            # the range of the run's dates, which the task gets from its target_date
+            cursor.execute(
+                "SELECT min(location_time), max(location_time) FROM vehicle_update WHERE correlation_id = %s",
+                (correlation_id,),
+            )
+            first_time, last_time = cursor.fetchone()
+            if first_time is None:
+                sys.exit(f"run {correlation_id} loaded no vehicle updates")
+            run_start, run_end = day_time_range(first_time.date(), last_time.date())
+
+            # fresh statistics, so the plans are the ones of the loaded data
+            for table in ANALYZED_TABLES:
+                cursor.execute(f"ANALYZE {table}")
+            plans = {}
+            for name, query in QUERIES.items():
+                cursor.execute(
+                    "EXPLAIN (ANALYZE, FORMAT JSON) " + query,
+                    {
+                        "correlation_ids": [correlation_id],
+                        "carry_over_window": DEFAULT_CARRY_OVER_WINDOW,
+                        "run_start": run_start,
+                        "run_end": run_end,
+                    },
+                )
+                plan = cursor.fetchone()[0]
+                plans[name] = json.loads(plan) if isinstance(plan, str) else plan
+    finally:
+        connection.rollback()
+        connection.close()
+
+    print(f"correlation_id: {correlation_id}")
+    print(f"run time range: {run_start} to {run_end}")
+    print(f"vehicle_update: {partitions} partitions, at least {updates} rows")
+    failures = []
+    for name, plan in plans.items():
+        nodes = list(walk(plan[0]["Plan"]))
+        index_nodes = [n for n in nodes if n["Node Type"] in INDEX_NODES and vehicle_update_relation(n)]
+        scanned = [n for n in nodes if vehicle_update_relation(n) and n["Node Type"] not in ("Bitmap Index Scan",)]
+        never_executed = [n for n in scanned if n.get("Actual Loops", 1) == 0]
+        subplans_removed = sum(n.get("Subplans Removed", 0) for n in nodes)
+
+        print(f"{name}:")
+        print(f"  index scans:        {[n.get('Index Name') for n in index_nodes]}")
+        print(f"  relations scanned:  {len(scanned) - len(never_executed)}")
+        print(f"  partitions pruned:  {subplans_removed + len(never_executed)}")
+
+        if not index_nodes:
+            failures.append(f"{name}: vehicle_update is not read through an index")
+
+        if name not in RUN_POINTS_SCANS:
+            continue
+        run_points = find_subplan(plan[0]["Plan"], RUN_POINTS_SCANS[name])
+        if run_points is None:
+            failures.append(f"{name}: the {RUN_POINTS_SCANS[name]} scan of the run's updates is not in the plan")
+            continue
+        # partitions pruned at plan time are left out of the plan, the ones pruned at run time are never executed
+        read = {
+            n["Relation Name"] for n in walk(run_points)
+            if n.get("Relation Name") in partition_names and n.get("Actual Loops", 1) > 0
+        }
+        print(f"  run's updates read from {len(read)} of {partitions} partitions: {sorted(read)}")
+        if not args.skip_pruning and len(read) == partitions:
+            failures.append(f"{name}: the scan of the run's updates prunes no vehicle_update partition")
+
+    if failures:
+        sys.exit("FAIL: " + "; ".join(failures))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
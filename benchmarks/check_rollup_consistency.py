@@ -0,0 +1,167 @@
+"""
+Consistency check of the rollup tables maintained incrementally by update_rollups against a full
+recomputation from vehicle_update, vehicle_update_segment, operating_period and operating_period_metrics.
+
+Every rollup is recomputed from scratch in a query and compared row by row with the stored table:
+the check reports the rows missing from the rollup, the rows it should not have, and the rows whose
+values differ (counts exactly, distances and durations within --tolerance, relative). It only reads
+the database, inside a transaction that is rolled back, and fails if any rollup differs.
+
+Usage:
+    PSQL_CONNECTION_STRING=postgresql://... python benchmarks/check_rollup_consistency.py [--tolerance 1e-9]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+
+# (rollup table, key columns, exact columns, approximate columns, full recomputation)
+ROLLUPS = [
+    (
+        "vehicle_activity_hourly",
+        ["organization_id", "vehicle_id", "hour"],
+        ["updates"],
+        ["distance"],
+        """
+        SELECT
+            u.organization_id,
+            u.vehicle_id,
+            date_trunc('hour', u.location_time, 'UTC') AS hour,
+            count(*) AS updates,
+            coalesce(sum(s.distance), 0) AS distance
+        FROM vehicle_update u LEFT JOIN vehicle_update_segment s ON s.update_uid = u.uid
+        GROUP BY 1, 2, 3
+        """,
+    ),
+    (
+        "vehicle_activity_daily",
+        ["organization_id", "day", "vehicle_id"],
+        ["updates", "active_hours"],
+        ["distance"],
+        """
+        SELECT
+            u.organization_id,
+            (u.location_time AT TIME ZONE 'UTC')::date AS day,
+            u.vehicle_id,
+            count(*) AS updates,
+            count(DISTINCT date_trunc('hour', u.location_time, 'UTC')) AS active_hours,
+            coalesce(sum(s.distance), 0) AS distance
+        FROM vehicle_update u LEFT JOIN vehicle_update_segment s ON s.update_uid = u.uid
+        GROUP BY 1, 2, 3
+        """,
+    ),
+    (
+        "operating_period_utilisation",
+        ["operating_period_id"],
+        ["organization_id", "vehicle_id", "day", "updates"],
+        ["operating_seconds", "distance_travelled"],
+        """
+        SELECT
+            o.operating_period_id,
+            o.organization_id,
+            o.vehicle_id,
+            (o.start AT TIME ZONE 'UTC')::date AS day,
+            (SELECT count(*) FROM vehicle_update u WHERE u.vehicle_id = o.vehicle_id AND u.location_time BETWEEN o.start AND o.finish) AS updates,
+            extract(epoch FROM o.finish - o.start) AS operating_seconds,
+            m.distance_travelled
+        FROM operating_period o LEFT JOIN operating_period_metrics m ON m.operating_period = o.operating_period_id
+        WHERE o.vehicle_id IS NOT NULL
+        """,
+    ),
+    (
+        "organization_activity_daily",
+        ["organization_id", "day"],
+        ["active_vehicles", "updates", "operating_periods"],
+        ["distance", "operating_seconds"],
+        """
+        SELECT
+            organization_id,
+            day,
+            coalesce(v.active_vehicles, 0) AS active_vehicles,
+            coalesce(v.updates, 0) AS updates,
+            coalesce(p.operating_periods, 0) AS operating_periods,
+            coalesce(v.distance, 0) AS distance,
+            coalesce(p.operating_seconds, 0) AS operating_seconds
+        FROM
+            (
+                SELECT
+                    u.organization_id,
+                    (u.location_time AT TIME ZONE 'UTC')::date AS day,
+                    count(DISTINCT u.vehicle_id) AS active_vehicles,
+                    count(*) AS updates,
+                    coalesce(sum(s.distance), 0) AS distance
+                FROM vehicle_update u LEFT JOIN vehicle_update_segment s ON s.update_uid = u.uid
+                GROUP BY 1, 2
+            ) v
+            FULL OUTER JOIN (
+                SELECT
+                    organization_id,
+                    (start AT TIME ZONE 'UTC')::date AS day,
+                    count(*) AS operating_periods,
+                    sum(extract(epoch FROM finish - start)) AS operating_seconds
+                FROM operating_period
+                WHERE vehicle_id IS NOT NULL
+                GROUP BY 1, 2
+            ) p USING (organization_id, day)
+        """,
+    ),
+]
+
+
+def comparison_query(table, keys, exact, approximate, expected):
+    """Full outer join of the recomputation with the rollup, counting each kind of difference."""
+    columns = ", ".join(keys + exact + approximate)
+    differs = [f"e.{column} IS DISTINCT FROM a.{column}" for column in exact] + [
+        f"coalesce(abs(e.{column} - a.{column}) > %(tolerance)s * greatest(1, abs(e.{column})), "
+        f"(e.{column} IS NULL) <> (a.{column} IS NULL))"
+        for column in approximate
+    ]
+    return f"""
+        WITH
+            expected AS (SELECT {columns}, true AS present FROM ({expected}) recomputed),
+            actual AS (SELECT {columns}, true AS present FROM {table})
+        SELECT
+            count(*) FILTER (WHERE e.present),
+            count(*) FILTER (WHERE a.present IS NULL),
+            count(*) FILTER (WHERE e.present IS NULL),
+            count(*) FILTER (WHERE e.present AND a.present AND ({" OR ".join(differs)}))
+        FROM expected e FULL OUTER JOIN actual a USING ({", ".join(keys)})
+    """
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tolerance", type=float, default=1e-9, help="Relative tolerance of distances and durations.")
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(os.environ.get("PSQL_CONNECTION_STRING"))
+    failures = []
+    try:
+        with connection.cursor() as cursor:
+            for table, keys, exact, approximate, expected in ROLLUPS:
+                start = time.perf_counter()
+                cursor.execute(comparison_query(table, keys, exact, approximate, expected), {"tolerance": args.tolerance})
+                rows, missing, unexpected, mismatched = cursor.fetchone()
+                elapsed = time.perf_counter() - start
+
+                print(f"{table}:")
+                print(f"  recomputed rows:  {rows} ({elapsed:.2f}s)")
+                print(f"  missing:          {missing}")
+                print(f"  unexpected:       {unexpected}")
+                print(f"  mismatched:       {mismatched}")
+                if missing or unexpected or mismatched:
+                    failures.append(f"{table}: {missing} missing, {unexpected} unexpected, {mismatched} mismatched rows")
+    finally:
+        connection.rollback()
+        connection.close()
+
+    if failures:
+        sys.exit("FAIL: " + "; ".join(failures))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
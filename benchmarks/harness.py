@@ -0,0 +1,254 @@
+"""
+End-to-end benchmark harness: runs the DAG's task callables in order against a filesystem
+stand-in for MinIO and a local PostgreSQL/PostGIS database.
+
+Buckets are directories: the source bucket is the directory written by synthetic.py, the datalake
+bucket a scratch directory. The stand-in client is installed as the process-wide MinIO client of
+utils.minio_utils, so the tasks run unchanged. Each task runs in a forked process, so the peak RSS
+reported for a task is its own. XComs are passed from one task to the next like Airflow does.
+
+For every task the harness reports wall time, events/sec and bytes/sec (relative to the events
+and bytes of the source files) and peak RSS, followed by the stage timers of its telemetry.
+
+The task modules read their resources from the repository's resources/ directory, unless
+DOOR2DOOR_RESOURCES_PATH is already set.
+
+Usage:
+    python benchmarks/synthetic.py --output /tmp/fleet --vehicles 500
+    PSQL_CONNECTION_STRING=postgresql://... python benchmarks/harness.py --source /tmp/fleet [--conf '{"ingestion_mode": "fused"}']
+    PSQL_CONNECTION_STRING=postgresql://... python benchmarks/harness.py --source /tmp/fleet --conf '{"start_date": "2019-06-01", "end_date": "2019-06-07"}'
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plugins"))
+
+SOURCE_BUCKET = "de-tech-assessment-2022"
+DATALAKE_BUCKET = "datalake"
+RESOURCES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "resources")
+
+# (task_id, module, target_date argument) in DAG order, per ingestion mode
+TASKS = {
+    "split": [
+        ("ensure_table_creation", "tasks.ensure_table_creation", True),
+        ("fetch_and_validate_bucket", "tasks.fetch_and_validate_bucket", True),
+        ("fetch_and_import_to_psql", "tasks.fetch_and_import_to_psql", False),
+        ("calculate_operating_periods", "tasks.calculate_operating_periods", False),
+        ("calculate_operating_periods_metrics", "tasks.calculate_operating_periods_metrics", True),
+        ("update_rollups", "tasks.update_rollups", False),
+    ],
+    "fused": [
+        ("ensure_table_creation", "tasks.ensure_table_creation", True),
+        ("fetch_validate_and_import", "tasks.fetch_validate_and_import", True),
+        ("calculate_operating_periods", "tasks.calculate_operating_periods", False),
+        ("calculate_operating_periods_metrics", "tasks.calculate_operating_periods_metrics", True),
+        ("update_rollups", "tasks.update_rollups", False),
+    ],
+    "backfill": [
+        ("ensure_table_creation", "tasks.ensure_table_creation", True),
+        ("backfill_date_range", "tasks.backfill_date_range", False),
+        ("calculate_operating_periods", "tasks.calculate_operating_periods", False),
+        ("calculate_operating_periods_metrics", "tasks.calculate_operating_periods_metrics", True),
+        ("update_rollups", "tasks.update_rollups", False),
+    ],
+}
+
+
+class FilesystemObject:
+    """The attributes of `minio.datatypes.Object` the tasks use."""
+
+    def __init__(self, bucket_name, object_name, path):
+        stat = os.stat(path)
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        self.size = stat.st_size
+        self.last_modified = datetime.fromtimestamp(stat.st_mtime)
+        self.etag = hashlib.md5(f"{object_name}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+
+
+class FilesystemResponse:
+    """The parts of the urllib3 response returned by `Minio.get_object` the tasks use."""
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.headers = {"Content-Length": str(os.path.getsize(path))}
+
+    def stream(self, amt):
+        while True:
+            chunk = self.file.read(amt)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+    def release_conn(self):
+        pass
+
+
+class FilesystemMinio:
+    """
+    Stand-in for the `Minio` client that maps each bucket to a directory.
+
+    Args:
+        buckets (dict): Directory of each bucket name.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    def _path(self, bucket_name, object_name):
+        return os.path.join(self.buckets[bucket_name], *object_name.split("/"))
+
+    def list_objects(self, bucket_name, prefix=None, recursive=False):
+        root = self.buckets[bucket_name]
+        names = []
+        for directory, _, files in os.walk(root):
+            for name in files:
+                object_name = os.path.relpath(os.path.join(directory, name), root).replace(os.sep, "/")
+                if object_name.startswith(prefix or ""):
+                    names.append(object_name)
+        for object_name in sorted(names):
+            yield FilesystemObject(bucket_name, object_name, self._path(bucket_name, object_name))
+
+    def fget_object(self, bucket_name, object_name, file_path):
+        shutil.copyfile(self._path(bucket_name, object_name), file_path)
+
+    def get_object(self, bucket_name, object_name):
+        return FilesystemResponse(self._path(bucket_name, object_name))
+
+    def put_object(self, bucket_name, object_name, data, length):
+        path = self._path(bucket_name, object_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            shutil.copyfileobj(data, f)
+        return FilesystemObject(bucket_name, object_name, path)
+
+
+class HarnessDagRun:
+    def __init__(self, run_id, conf):
+        self.run_id = run_id
+        self.conf = conf
+
+
+class HarnessTaskInstance:
+    """The identity and XCom interface of Airflow's TaskInstance, backed by a dict."""
+
+    dag_id = "door2door"
+    map_index = -1
+
+    def __init__(self, task_id, xcoms):
+        self.task_id = task_id
+        self.xcoms = xcoms
+
+    def xcom_push(self, key, value):
+        self.xcoms[(self.task_id, key)] = value
+
+    def xcom_pull(self, task_ids, key="return_value"):
+        return self.xcoms.get((task_ids, key))
+
+
+def run_task(task_id, module_name, with_target_date, buckets, run_id, conf, target_date, xcoms, connection):
+    """Runs one task in the current (forked) process and sends back its XComs and resource usage."""
+    try:
+        import importlib
+
+        from utils import minio_utils
+
+        minio_utils._client = FilesystemMinio(buckets)
+        task = getattr(importlib.import_module(module_name), task_id)
+        context = {"dag_run": HarnessDagRun(run_id, conf), "ti": HarnessTaskInstance(task_id, xcoms)}
+
+        started_at = time.perf_counter()
+        result = task(target_date, **context) if with_target_date else task(**context)
+        elapsed = time.perf_counter() - started_at
+
+        xcoms[(task_id, "return_value")] = result
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        connection.send((True, elapsed, peak_rss, xcoms))
+    except BaseException:
+        connection.send((False, traceback.format_exc(), 0, xcoms))
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", required=True, help="Directory of the source bucket, as written by synthetic.py.")
+    parser.add_argument("--date", default="2019-06-01", help="Target date of the run.")
+    parser.add_argument("--datalake", help="Directory of the datalake bucket. Defaults to a temporary directory.")
+    parser.add_argument("--conf", default="{}", help="DAG run config, as JSON.")
+    args = parser.parse_args()
+
+    resources = os.environ.setdefault("DOOR2DOOR_RESOURCES_PATH", RESOURCES_PATH)
+    if not os.path.isdir(os.path.join(resources, "jsonschemas")):
+        sys.exit(f"{resources} not found: set DOOR2DOOR_RESOURCES_PATH to the repository's resources/ directory")
+    if not os.environ.get("PSQL_CONNECTION_STRING"):
+        sys.exit("PSQL_CONNECTION_STRING is not set")
+
+    conf = json.loads(args.conf)
+    conf.setdefault("target_date", args.date)
+    # every harness run is a new DAG run, so the manifest does not skip the files
+    conf.setdefault("full_refresh", True)
+    from utils.utils import backfill_dates
+
+    dates = backfill_dates({"dag_run": HarnessDagRun(None, conf)})
+    mode = conf.get("ingestion_mode", "backfill" if dates else "split")
+    datalake = args.datalake or tempfile.mkdtemp(prefix="datalake-")
+    buckets = {SOURCE_BUCKET: args.source, DATALAKE_BUCKET: datalake}
+    run_id = f"harness__{datetime.now().isoformat()}"
+
+    source_objects = [
+        obj
+        for obj in FilesystemMinio(buckets).list_objects(SOURCE_BUCKET, prefix="data/", recursive=True)
+        if os.path.basename(obj.object_name)[:10] in (dates or [args.date])
+    ]
+    source_bytes = sum(obj.size for obj in source_objects)
+    print(f"{len(source_objects)} source files, {source_bytes / 1e6:.1f} MB, {mode} ingestion, run {run_id}")
+
+    context = multiprocessing.get_context("fork")
+    xcoms = {}
+    events = None
+    print(f"{'task':<38} {'seconds':>9} {'events/s':>12} {'MB/s':>8} {'peak RSS MB':>12}")
+    for task_id, module_name, with_target_date in TASKS[mode]:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(
+            target=run_task,
+            args=(task_id, module_name, with_target_date, buckets, run_id, conf, args.date, xcoms, sender),
+        )
+        process.start()
+        sender.close()
+        ok, elapsed, peak_rss, xcoms = receiver.recv()
+        process.join()
+        if not ok:
+            sys.exit(f"{task_id} failed:\n{elapsed}")
+
+        telemetry = xcoms.get((task_id, "telemetry")) or {}
+        counters = telemetry.get("counters", {})
+        if events is None and any(key.startswith("events{") for key in counters):
+            events = sum(value for key, value in counters.items() if key.startswith("events{"))
+        events_rate = f"{events / elapsed:,.0f}" if events else "-"
+        print(f"{task_id:<38} {elapsed:>9.3f} {events_rate:>12} {source_bytes / 1e6 / elapsed:>8.1f} {peak_rss / 1e6:>12.1f}")
+        for stage, seconds in sorted(telemetry.get("stages", {}).items(), key=lambda item: -item[1]):
+            print(f"    {stage:<34} {seconds:>9.3f}")
+
+    if events is not None:
+        print(f"{events} events")
+    if not args.datalake:
+        shutil.rmtree(datalake)
+
+
+if __name__ == "__main__":
+    main()
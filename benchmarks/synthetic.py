@@ -0,0 +1,267 @@
+"""
+Synthetic door2door event data for the benchmark scripts.
+
+The events follow the schemas in resources/jsonschemas/ and can be written in the three
+file layouts the pipeline accepts:
+
+    - ndjson: one JSON object per line
+    - array: a single JSON array of objects
+    - concatenated: comma-separated, pretty-printed objects without enclosing brackets
+
+Run as a script, it writes a day of fleet events as source bucket files, one file per time
+window, named like the files of the source bucket (`data/<date>-<HH>-<MM>-<SS>-events.json`):
+
+    python benchmarks/synthetic.py --output /tmp/fleet --date 2019-06-01 --vehicles 500 --update-interval 3
+"""
+
+import argparse
+import heapq
+import itertools
+import json
+import math
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+
+LAYOUTS = ("ndjson", "array", "concatenated")
+
+
+def _timestamp(value):
+    return value.strftime("%Y-%m-%dT%H:%M:%S.") + f"{value.microsecond // 1000:03d}Z"
+
+
+def generate_events(n_vehicles=10, updates_per_vehicle=100, start=datetime(2019, 6, 1, 8), seed=0):
+    """
+    Generates a day of events for a small fleet.
+
+    Each vehicle registers, sends `updates_per_vehicle` location updates along a random walk
+    and deregisters. One operating period covering the whole fleet's activity is created too.
+
+    Args:
+        n_vehicles (int): Number of vehicles in the fleet.
+        updates_per_vehicle (int): Number of location updates sent by each vehicle.
+        start (datetime.datetime): Time of the first event.
+        seed (int): Seed for the random generator.
+
+    Returns:
+        list: The events, ordered by vehicle.
+    """
+    rng = random.Random(seed)
+    organization_id = "org-id"
+    events = []
+    finish = start
+    for _ in range(n_vehicles):
+        vehicle_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        now = start + timedelta(seconds=rng.randint(0, 600))
+        lat, lng = 52.52 + rng.uniform(-0.05, 0.05), 13.40 + rng.uniform(-0.05, 0.05)
+        events.append({
+            "event": "register", "on": "vehicle", "at": _timestamp(now),
+            "data": {"id": vehicle_id}, "organization_id": organization_id,
+        })
+        for _ in range(updates_per_vehicle):
+            now += timedelta(seconds=3, milliseconds=rng.randint(0, 999))
+            lat += rng.uniform(-0.0005, 0.0005)
+            lng += rng.uniform(-0.0005, 0.0005)
+            events.append({
+                "event": "update", "on": "vehicle", "at": _timestamp(now),
+                "data": {"id": vehicle_id, "location": {"lat": round(lat, 6), "lng": round(lng, 6), "at": _timestamp(now)}},
+                "organization_id": organization_id,
+            })
+        now += timedelta(seconds=5)
+        events.append({
+            "event": "deregister", "on": "vehicle", "at": _timestamp(now),
+            "data": {"id": vehicle_id}, "organization_id": organization_id,
+        })
+        finish = max(finish, now)
+    events.append({
+        "event": "create", "on": "operating_period", "at": _timestamp(start),
+        "data": {"id": str(uuid.UUID(int=rng.getrandbits(128))), "start": _timestamp(start), "finish": _timestamp(finish)},
+        "organization_id": organization_id,
+    })
+    return events
+
+
+def write_events(path, events, layout="ndjson"):
+    """
+    Writes events to `path` using one of the supported `LAYOUTS`.
+
+    Args:
+        path (str): Destination file.
+        events (iterable): The events to write.
+        layout (str): One of "ndjson", "array" or "concatenated".
+
+    Returns:
+        None
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout {layout!r}, expected one of {LAYOUTS}")
+    with open(path, "w") as f:
+        if layout == "ndjson":
+            for event in events:
+                f.write(json.dumps(event))
+                f.write("\n")
+        elif layout == "array":
+            f.write("[")
+            for i, event in enumerate(events):
+                f.write(",\n" if i else "\n")
+                f.write(json.dumps(event))
+            f.write("\n]\n")
+        else:
+            for i, event in enumerate(events):
+                if i:
+                    f.write(",\n")
+                f.write(json.dumps(event, indent=2))
+
+
+def _vehicle_events(rng, vehicle_id, organization_id, day_start, day_end, update_interval, sessions):
+    """Time-ordered (time, sequence, event) tuples of one vehicle over a day, in `sessions` sessions."""
+    span = (day_end - day_start).total_seconds()
+    bounds = sorted(rng.uniform(0, span) for _ in range(2 * sessions))
+    lat, lng = 52.52 + rng.uniform(-0.1, 0.1), 13.40 + rng.uniform(-0.15, 0.15)
+    heading = rng.uniform(0, 2 * math.pi)
+    sequence = 0
+    for start, finish in zip(bounds[::2], bounds[1::2]):
+        now = day_start + timedelta(seconds=start)
+        end = day_start + timedelta(seconds=finish)
+        sequence += 1
+        yield now, sequence, {
+            "event": "register", "on": "vehicle", "at": _timestamp(now),
+            "data": {"id": vehicle_id}, "organization_id": organization_id,
+        }
+        while True:
+            now += timedelta(seconds=update_interval * rng.uniform(0.8, 1.2))
+            if now >= end:
+                break
+            # drive at up to ~50 km/h, turning slowly
+            heading += rng.gauss(0, 0.3)
+            distance = rng.uniform(0, 14) * update_interval / 111000
+            lat += distance * math.cos(heading)
+            lng += distance * math.sin(heading) / math.cos(math.radians(lat))
+            sequence += 1
+            yield now, sequence, {
+                "event": "update", "on": "vehicle", "at": _timestamp(now),
+                "data": {"id": vehicle_id, "location": {"lat": round(lat, 6), "lng": round(lng, 6), "at": _timestamp(now)}},
+                "organization_id": organization_id,
+            }
+        sequence += 1
+        yield end, sequence, {
+            "event": "deregister", "on": "vehicle", "at": _timestamp(end),
+            "data": {"id": vehicle_id}, "organization_id": organization_id,
+        }
+
+
+def generate_day(date, n_vehicles=100, n_organizations=1, update_interval=3.0, sessions_per_vehicle=2,
+                 start_hour=6, end_hour=22, seed=0):
+    """
+    Generates a day of events for a fleet, in time order, without holding the day in memory.
+
+    Each organization has one operating period from `start_hour` to `end_hour`. Vehicles are spread
+    over the organizations; each one registers and deregisters `sessions_per_vehicle` times at random
+    times within the period and sends a location update every `update_interval` seconds (±20%)
+    while registered, driving at city speeds.
+
+    Args:
+        date (datetime.date): The day.
+        n_vehicles (int): Number of vehicles in the fleet.
+        n_organizations (int): Number of organizations operating the fleet.
+        update_interval (float): Mean number of seconds between two location updates of a vehicle.
+        sessions_per_vehicle (int): Number of register/deregister sessions of each vehicle.
+        start_hour (int): Hour the operating periods start.
+        end_hour (int): Hour the operating periods finish.
+        seed (int): Seed for the random generator.
+
+    Returns:
+        generator: (datetime, event) tuples ordered by time.
+    """
+    rng = random.Random(seed)
+    day_start = datetime(date.year, date.month, date.day, start_hour)
+    day_end = datetime(date.year, date.month, date.day, end_hour)
+    organizations = [f"org-id-{i}" for i in range(n_organizations)]
+
+    streams = []
+    for organization_id in organizations:
+        period_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        streams.append(iter([(day_start, 0, {
+            "event": "create", "on": "operating_period", "at": _timestamp(day_start),
+            "data": {"id": period_id, "start": _timestamp(day_start), "finish": _timestamp(day_end)},
+            "organization_id": organization_id,
+        })]))
+    for i in range(n_vehicles):
+        vehicle_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        vehicle_rng = random.Random(rng.getrandbits(64))
+        streams.append(_vehicle_events(
+            vehicle_rng, vehicle_id, organizations[i % n_organizations], day_start, day_end,
+            update_interval, sessions_per_vehicle,
+        ))
+    # the stream index breaks ties, so events are never compared
+    merged = heapq.merge(*(_tag(index, stream) for index, stream in enumerate(streams)))
+    return ((at, event) for at, _, _, event in merged)
+
+
+def _tag(index, stream):
+    """Inserts the stream index after the time of each event, binding it when the stream is created."""
+    for at, sequence, event in stream:
+        yield at, index, sequence, event
+
+
+def write_day(output, date, events, layout="ndjson", file_minutes=60):
+    """
+    Writes a day of events as source bucket files, one file per `file_minutes` window.
+
+    Args:
+        output (str): Root directory, the files are written under `output/data/`.
+        date (datetime.date): The day, used in the file names.
+        events (iterable): (datetime, event) tuples ordered by time, e.g. from `generate_day`.
+        layout (str): One of "ndjson", "array" or "concatenated".
+        file_minutes (int): Length of the time window covered by each file.
+
+    Returns:
+        dict: Number of `files`, `events` and `bytes` written.
+    """
+    directory = os.path.join(output, "data")
+    os.makedirs(directory, exist_ok=True)
+    window = timedelta(minutes=file_minutes)
+    day_start = datetime(date.year, date.month, date.day)
+    stats = {"files": 0, "events": 0, "bytes": 0}
+
+    def counted(group):
+        for _, event in group:
+            stats["events"] += 1
+            yield event
+
+    for index, group in itertools.groupby(events, key=lambda item: (item[0] - day_start) // window):
+        opened_at = day_start + index * window
+        path = os.path.join(directory, f"{opened_at:%Y-%m-%d-%H-%M-%S}-events.json")
+        write_events(path, counted(group), layout)
+        stats["files"] += 1
+        stats["bytes"] += os.path.getsize(path)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes a day of synthetic fleet events as source bucket files.")
+    parser.add_argument("--output", required=True, help="Directory of the source bucket, files are written under data/.")
+    parser.add_argument("--date", default="2019-06-01", help="Day of the events, YYYY-MM-DD.")
+    parser.add_argument("--vehicles", type=int, default=100)
+    parser.add_argument("--organizations", type=int, default=1)
+    parser.add_argument("--update-interval", type=float, default=3.0, help="Mean seconds between two updates of a vehicle.")
+    parser.add_argument("--sessions", type=int, default=2, help="Register/deregister sessions per vehicle.")
+    parser.add_argument("--start-hour", type=int, default=6)
+    parser.add_argument("--end-hour", type=int, default=22)
+    parser.add_argument("--layout", choices=LAYOUTS, default="ndjson")
+    parser.add_argument("--file-minutes", type=int, default=60, help="Time window covered by each file.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    date = datetime.strptime(args.date, "%Y-%m-%d").date()
+    events = generate_day(
+        date, args.vehicles, args.organizations, args.update_interval, args.sessions,
+        args.start_hour, args.end_hour, args.seed,
+    )
+    stats = write_day(args.output, date, events, args.layout, args.file_minutes)
+    print(f"{stats['files']} files, {stats['events']} events, {stats['bytes'] / 1e6:.1f} MB written to {args.output}/data/")
+
+
+if __name__ == "__main__":
+    main()
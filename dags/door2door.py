@@ -4,33 +4,60 @@ operating periods and their metrics.
 
 The DAG is scheduled to run daily and has the following tasks:
 
-    - fetch_and_validate_bucket: Fetches and validates the bucket data
     - ensure_table_creation: Ensures table creation in the PSQL database
-    - fetch_and_import_to_psql: Fetches and imports the data to the PSQL database
+    - choose_ingestion_mode: Selects the split, fused, mapped or backfill ingestion branch from the `ingestion_mode` config
+    - fetch_and_validate_bucket: Fetches and validates the bucket data (split mode)
+    - fetch_and_import_to_psql: Fetches and imports the data to the PSQL database (split mode)
+    - fetch_validate_and_import: Fetches, validates and imports the bucket data in a single pass (fused mode)
+    - list_source_objects: Lists the bucket data once and splits it into batches (mapped mode)
+    - ingest_object_batch: Mapped over the batches, validates and imports each one in a single pass (mapped mode)
+    - gather_ingestion_results: Gathers the results of the mapped batches (mapped mode)
+    - backfill_date_range: Ingests every day from `start_date` to `end_date` in a single pass (backfill mode)
     - calculate_operating_periods: Calculates operating periods
     - calculate_operating_periods_metrics: Calculates metrics for the operating periods
+    - update_rollups: Updates the rollup tables from the run's rows
     
 Task Dependencies:
-    fetch_and_validate_bucket_data >> ensure_table_creation >> fetch_and_import_to_psql 
-    >> calculate_operating_periods >> calculate_operating_periods_metrics
+    ensure_table_creation >> choose_ingestion_mode
+    choose_ingestion_mode >> fetch_and_validate_bucket >> fetch_and_import_to_psql >> calculate_operating_periods
+    choose_ingestion_mode >> fetch_validate_and_import >> calculate_operating_periods
+    choose_ingestion_mode >> list_source_objects >> ingest_object_batch >> gather_ingestion_results >> calculate_operating_periods
+    choose_ingestion_mode >> backfill_date_range >> calculate_operating_periods
+    calculate_operating_periods >> calculate_operating_periods_metrics >> update_rollups
     
 DAG Parameters:
     default_args: A dictionary containing default arguments for the DAG.
     dag_id: The ID of the DAG.
     start_date: The start date of the DAG.
     schedule_interval: The interval at which the DAG is scheduled to run.
+    MAX_ACTIVE_MAPPED_TASKS: How many ingest_object_batch instances may run at once, from the
+        DOOR2DOOR_MAX_ACTIVE_MAPPED_TASKS environment variable (default 8).
 """
 
 
+import os
 from datetime import datetime, timedelta
 from airflow import DAG
-from airflow.operators.python import PythonOperator
-from tasks.calculate_operating_periods import calculate_operating_periods
-from tasks.calculate_operating_periods_metrics import calculate_operating_periods_metrics
+from airflow.operators.python import BranchPythonOperator, PythonOperator
+from airflow.utils.trigger_rule import TriggerRule
+from utils.utils import lazy_callable
 
-from tasks.fetch_and_validate_bucket import fetch_and_validate_bucket
-from tasks.ensure_table_creation import ensure_table_creation
-from tasks.fetch_and_import_to_psql import fetch_and_import_to_psql
+# The task modules are imported by the worker running the task, so that parsing this file stays fast
+calculate_operating_periods = lazy_callable("tasks.calculate_operating_periods")
+calculate_operating_periods_metrics = lazy_callable("tasks.calculate_operating_periods_metrics")
+
+fetch_and_validate_bucket = lazy_callable("tasks.fetch_and_validate_bucket")
+ensure_table_creation = lazy_callable("tasks.ensure_table_creation")
+fetch_and_import_to_psql = lazy_callable("tasks.fetch_and_import_to_psql")
+fetch_validate_and_import = lazy_callable("tasks.fetch_validate_and_import")
+choose_ingestion_mode = lazy_callable("tasks.choose_ingestion_mode")
+list_source_objects = lazy_callable("tasks.list_source_objects")
+ingest_object_batch = lazy_callable("tasks.ingest_object_batch")
+gather_ingestion_results = lazy_callable("tasks.gather_ingestion_results")
+backfill_date_range = lazy_callable("tasks.backfill_date_range")
+update_rollups = lazy_callable("tasks.update_rollups")
+
+MAX_ACTIVE_MAPPED_TASKS = int(os.environ.get("DOOR2DOOR_MAX_ACTIVE_MAPPED_TASKS", 8))
 
 ## Directed Acyclic Graph
 
@@ -60,6 +87,7 @@ with DAG(
     task_ensure_table_creation = PythonOperator(
         task_id='ensure_table_creation',
         python_callable=ensure_table_creation,
+        op_kwargs={'target_date': '{{ dag_run.conf.get("target_date", None) or dag.default_args.target_date }}'},
         provide_context=True
     )
     
@@ -70,10 +98,55 @@ with DAG(
         provide_context=True
     )
     
+    # Choose between the split, fused, mapped and backfill ingestion branches
+    task_choose_ingestion_mode = BranchPythonOperator(
+        task_id='choose_ingestion_mode',
+        python_callable=choose_ingestion_mode,
+        provide_context=True
+    )
+    
+    # Fetch, validate and import bucket data in a single pass
+    task_fetch_validate_and_import = PythonOperator(
+        task_id='fetch_validate_and_import',
+        python_callable=fetch_validate_and_import,
+        op_kwargs={'target_date': '{{ dag_run.conf.get("target_date", None) or dag.default_args.target_date }}'},
+        provide_context=True
+    )
+    
+    # List the bucket data once and split it into batches
+    task_list_source_objects = PythonOperator(
+        task_id='list_source_objects',
+        python_callable=list_source_objects,
+        op_kwargs={'target_date': '{{ dag_run.conf.get("target_date", None) or dag.default_args.target_date }}'},
+        provide_context=True
+    )
+    
+    # Validate and import each batch in its own mapped task instance
+    task_ingest_object_batch = PythonOperator.partial(
+        task_id='ingest_object_batch',
+        python_callable=ingest_object_batch,
+        max_active_tis_per_dag=MAX_ACTIVE_MAPPED_TASKS
+    ).expand(op_kwargs=task_list_source_objects.output)
+    
+    # Gather the results of the mapped batches
+    task_gather_ingestion_results = PythonOperator(
+        task_id='gather_ingestion_results',
+        python_callable=gather_ingestion_results,
+        provide_context=True
+    )
+    
+    # Ingest every day of a date range in a single pass
+    task_backfill_date_range = PythonOperator(
+        task_id='backfill_date_range',
+        python_callable=backfill_date_range,
+        provide_context=True
+    )
+    
     # Calculate operating periods
     task_calculate_operating_periods = PythonOperator(
         task_id='calculate_operating_periods',
         python_callable=calculate_operating_periods,
+        trigger_rule=TriggerRule.NONE_FAILED_MIN_ONE_SUCCESS,
         provide_context=True
     )
     
@@ -81,9 +154,23 @@ with DAG(
     task_calculate_operating_periods_metrics = PythonOperator(
         task_id='calculate_operating_periods_metrics',
         python_callable=calculate_operating_periods_metrics,
+        op_kwargs={'target_date': '{{ dag_run.conf.get("target_date", None) or dag.default_args.target_date }}'},
+        provide_context=True
+    )
+    
+    # Update the rollup tables
+    task_update_rollups = PythonOperator(
+        task_id='update_rollups',
+        python_callable=update_rollups,
         provide_context=True
     )
     
     # Set task dependencies
-    task_fetch_and_validate_bucket_data >> task_ensure_table_creation >> task_fetch_and_import_to_psql >> task_calculate_operating_periods >> task_calculate_operating_periods_metrics
+    task_ensure_table_creation >> task_choose_ingestion_mode
+    task_choose_ingestion_mode >> task_fetch_and_validate_bucket_data >> task_fetch_and_import_to_psql >> task_calculate_operating_periods
+    task_choose_ingestion_mode >> task_fetch_validate_and_import >> task_calculate_operating_periods
+    task_choose_ingestion_mode >> task_list_source_objects
+    task_ingest_object_batch >> task_gather_ingestion_results >> task_calculate_operating_periods
+    task_choose_ingestion_mode >> task_backfill_date_range >> task_calculate_operating_periods
+    task_calculate_operating_periods >> task_calculate_operating_periods_metrics >> task_update_rollups
     
\ No newline at end of file
@@ -0,0 +1,113 @@
+"""
+This DAG ingests the bucket data in micro-batches every few minutes, alongside the daily door2door DAG.
+Each run picks up the objects added since the previous one, then calculates the operating periods
+and metrics of just those objects.
+
+The DAG has the following tasks:
+
+    - ensure_partitions: Ensures the vehicle_update partitions of today and tomorrow, the tables being created by the daily DAG
+    - ingest_new_objects: Validates and imports the objects modified since the watermark, then moves the watermark
+    - calculate_operating_periods: Calculates operating periods
+    - calculate_operating_periods_metrics: Calculates metrics for the operating periods
+    - update_rollups: Updates the rollup tables from the batch's rows
+    - record_microbatch_latency: Records the latency of the batch as a metric
+    
+Task Dependencies:
+    ensure_partitions >> ingest_new_objects >> calculate_operating_periods
+    calculate_operating_periods >> calculate_operating_periods_metrics >> update_rollups >> record_microbatch_latency
+    
+DAG Parameters:
+    default_args: A dictionary containing default arguments for the DAG.
+    dag_id: The ID of the DAG.
+    start_date: The start date of the DAG.
+    schedule_interval: Every MICROBATCH_INTERVAL_MINUTES minutes, from the
+        DOOR2DOOR_MICROBATCH_INTERVAL_MINUTES environment variable (default 5).
+    max_active_runs: 1, so that batches never overlap and the watermark moves in order.
+"""
+
+
+import os
+from datetime import datetime, timedelta
+from airflow import DAG
+from airflow.operators.python import PythonOperator
+from utils.utils import lazy_callable
+
+# The task modules are imported by the worker running the task, so that parsing this file stays fast
+calculate_operating_periods = lazy_callable("tasks.calculate_operating_periods")
+calculate_operating_periods_metrics = lazy_callable("tasks.calculate_operating_periods_metrics")
+
+ensure_partitions = lazy_callable("tasks.ensure_partitions")
+ingest_new_objects = lazy_callable("tasks.ingest_new_objects")
+record_microbatch_latency = lazy_callable("tasks.record_microbatch_latency")
+update_rollups = lazy_callable("tasks.update_rollups")
+
+MICROBATCH_INTERVAL_MINUTES = int(os.environ.get("DOOR2DOOR_MICROBATCH_INTERVAL_MINUTES", 5))
+
+## Directed Acyclic Graph
+
+default_args = {
+    'owner': 'Pedro',
+    'retry': 5,
+    'retry_delay': timedelta(minutes=1)
+}
+
+with DAG(
+    default_args=default_args,
+    dag_id='door2door_microbatch',
+    start_date=datetime(2023,3,10),
+    schedule_interval=timedelta(minutes=MICROBATCH_INTERVAL_MINUTES),
+    catchup=False,
+    max_active_runs=1
+) as dag:
+    
+    # Ensure the partitions of today and tomorrow
+    task_ensure_partitions = PythonOperator(
+        task_id='ensure_partitions',
+        python_callable=ensure_partitions,
+        op_kwargs={'target_date': '{{ data_interval_end | ds }}'},
+        provide_context=True
+    )
+    
+    # Validate and import the objects added since the previous batch
+    task_ingest_new_objects = PythonOperator(
+        task_id='ingest_new_objects',
+        python_callable=ingest_new_objects,
+        provide_context=True
+    )
+    
+    # Calculate operating periods
+    task_calculate_operating_periods = PythonOperator(
+        task_id='calculate_operating_periods',
+        python_callable=calculate_operating_periods,
+        provide_context=True
+    )
+    
+    # Calculate operating periods metrics
+    task_calculate_operating_periods_metrics = PythonOperator(
+        task_id='calculate_operating_periods_metrics',
+        python_callable=calculate_operating_periods_metrics,
+        # the days listed by ingest_new_objects, whose default microbatch_lookback_days is 1
+        op_kwargs={
+            'target_date': '{{ data_interval_end | ds }}',
+            'lookback_days': '{{ dag_run.conf.get("microbatch_lookback_days", None) or 1 }}',
+        },
+        provide_context=True
+    )
+    
+    # Update the rollup tables
+    task_update_rollups = PythonOperator(
+        task_id='update_rollups',
+        python_callable=update_rollups,
+        provide_context=True
+    )
+    
+    # Record the latency of the batch
+    task_record_microbatch_latency = PythonOperator(
+        task_id='record_microbatch_latency',
+        python_callable=record_microbatch_latency,
+        provide_context=True
+    )
+    
+    # Set task dependencies
+    task_ensure_partitions >> task_ingest_new_objects >> task_calculate_operating_periods
+    task_calculate_operating_periods >> task_calculate_operating_periods_metrics >> task_update_rollups >> task_record_microbatch_latency
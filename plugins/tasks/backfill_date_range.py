@@ -0,0 +1,49 @@
+import logging
+
+from utils.minio_utils import get_minio_client
+from utils.telemetry import Telemetry
+from utils.utils import generate_correlation_id, get_conf, backfill_dates, day_correlation_id
+from tasks.fetch_and_validate_bucket import list_objects_for_dates, DEFAULT_SOURCE_PREFIX
+from tasks.fetch_validate_and_import import ingest_days
+
+def backfill_date_range(**context):
+    """
+    Backfills every day from `start_date` to `end_date` (both included) of the DAG run config in a single task.
+    
+    The source bucket is listed once for the whole range and the keys are grouped by date (see
+    `list_objects_for_dates`). The days are then validated and imported like in `fetch_validate_and_import`,
+    sharing the MinIO client, the database connection and the transfer pool. The rows of each day are tagged
+    with the correlation ID of that day (see `day_correlation_id`), and `calculate_operating_periods` and
+    `calculate_operating_periods_metrics` then process all the days of the run at once.
+    
+    Args:
+    - **context: Additional context that can be passed to the function.
+    
+    Returns:
+    - dict: The `dates` of the range, the number of `files` ingested, and how many of them were `valid` and `invalid`.
+    """
+    correlation_id = generate_correlation_id(context['dag_run'].run_id)
+    dates = backfill_dates(context)
+    if not dates:
+        raise ValueError("backfill_date_range needs start_date and end_date in the DAG run config")
+    logging.info(f"Running backfill_date_range from {dates[0]} to {dates[-1]} for {correlation_id=}")
+    with Telemetry.from_context(context, correlation_id) as telemetry:
+        client = get_minio_client()
+        
+        bucket_name = "de-tech-assessment-2022"
+        prefix_template = get_conf(context, "source_prefix", DEFAULT_SOURCE_PREFIX)
+        with telemetry.stage("list"):
+            objects_by_date = list_objects_for_dates(client, bucket_name, dates, prefix_template)
+        telemetry.count("days", len(dates))
+        
+        run_id = context['dag_run'].run_id
+        days = [
+            (date_str, day_correlation_id(run_id, date_str), objects)
+            for date_str, objects in objects_by_date.items()
+        ]
+        for date_str, day_id, objects in days:
+            logging.info(f"{len(objects)} objects for {date_str}, correlation_id={day_id}")
+        
+        results = ingest_days(days, bucket_name, telemetry, context)
+        logging.info(f"Backfilled {len(dates)} days: {results['files']} files, {results['valid']} valid, {results['invalid']} invalid")
+        return {"dates": dates, **results}
@@ -2,12 +2,82 @@ import logging
 import os
 
 from utils.psql_utils import PSQL_connect
-from utils.utils import generate_correlation_id
+from utils.telemetry import Telemetry
+from utils.utils import generate_correlation_id, run_correlation_ids
+
+# Pairs each register event with the next event of the same vehicle when it is a deregister, walking
+# each vehicle's events once in time order. The events are the run's registrations, plus the vehicle's
+# latest earlier event from another run when it is a register, so that a period left open by a previous
+# run (e.g. across midnight) is closed by this run's deregister. A register followed by another register
+# is never closed. Ids are derived from the vehicle and the start, so reruns update the same periods.
+# A run may cover several correlation IDs (one per day of a backfill): each period is tagged with the
+# correlation ID of the deregister that closes it, as if the days had been run one by one.
+OPERATING_PERIODS_QUERY = """
+    WITH run_events AS (
+        SELECT vehicle_id, event, event_time, organization_id, correlation_id
+        FROM vehicle_registration
+        WHERE correlation_id = ANY(%(correlation_ids)s)
+    ),
+    open_registrations AS (
+        SELECT f.vehicle_id, p.event, p.event_time, p.organization_id, p.correlation_id
+        FROM
+            (SELECT vehicle_id, min(event_time) AS first_time FROM run_events GROUP BY vehicle_id) f
+            CROSS JOIN LATERAL (
+                SELECT event, event_time, organization_id, correlation_id
+                FROM vehicle_registration p
+                WHERE
+                    p.vehicle_id = f.vehicle_id
+                    AND p.event_time < f.first_time
+                    AND p.correlation_id <> ALL(%(correlation_ids)s)
+                ORDER BY p.event_time DESC
+                LIMIT 1
+            ) p
+        WHERE p.event = 'register'
+    ),
+    paired AS (
+        SELECT
+            vehicle_id,
+            event,
+            event_time,
+            organization_id,
+            LEAD(event) OVER w AS next_event,
+            LEAD(event_time) OVER w AS next_event_time,
+            LEAD(correlation_id) OVER w AS next_correlation_id
+        FROM (
+            SELECT * FROM run_events
+            UNION ALL
+            SELECT * FROM open_registrations
+        ) events
+        WINDOW w AS (PARTITION BY vehicle_id ORDER BY event_time, event = 'register')
+    )
+    INSERT INTO operating_period (operating_period_id, vehicle_id, start, finish, event, event_time, organization_id, correlation_id)
+    SELECT
+        uuid_generate_v5(uuid_ns_oid(), 'operating_period:' || vehicle_id || ':' || extract(epoch FROM event_time))::text AS operating_period_id,
+        vehicle_id,
+        event_time AS start,
+        next_event_time AS finish,
+        'create' AS event,
+        event_time,
+        organization_id,
+        next_correlation_id
+    FROM
+        paired
+    WHERE
+        event = 'register' AND next_event = 'deregister'
+    ON CONFLICT (operating_period_id, event) DO UPDATE SET
+        finish = EXCLUDED.finish,
+        correlation_id = EXCLUDED.correlation_id;
+"""
+
 
 def calculate_operating_periods(**context):
     """
     Creates operating periods for registered vehicles based on registration and deregistration events in the database.
 
+    Each vehicle's events are paired in a single pass in time order, so the work grows linearly with
+    the number of registration events. Registrations left open by a previous run are closed by this one.
+    A backfill run processes the registrations of all its days at once (see `run_correlation_ids`).
+
     Args:
         context (dict): The context dictionary provided by Airflow.
 
@@ -18,22 +88,9 @@ def calculate_operating_periods(**context):
     correlation_id = generate_correlation_id(context['dag_run'].run_id)
     logging.info(f"Running calculate_operating_periods for {correlation_id=}")
     
-    with PSQL_connect() as (connect, cursor):
-        cursor.execute(f"""
-            CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
-            INSERT INTO operating_period (operating_period_id, vehicle_id, start, finish, event, event_time, organization_id, correlation_id)
-            SELECT 
-                uuid_generate_v4() AS operating_period_id,
-                r.vehicle_id,
-                r.event_time AS start,
-                d.event_time AS finish,
-                'create' AS event,
-                r.event_time,
-                r.organization_id,
-                r.correlation_id
-            FROM 
-                vehicle_registration r
-                INNER JOIN vehicle_registration d ON r.vehicle_id = d.vehicle_id AND d.event = 'deregister' AND d.event_time > r.event_time
-            WHERE 
-                r.event = 'register' AND r.correlation_id = '{correlation_id}';
-        """)
+    with Telemetry.from_context(context, correlation_id) as telemetry, PSQL_connect.from_context(context) as (connect, cursor):
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS "uuid-ossp";')
+        with telemetry.stage("compute"):
+            cursor.execute(OPERATING_PERIODS_QUERY, {"correlation_ids": run_correlation_ids(context)})
+        logging.info(f"Created {cursor.rowcount} operating periods")
+        telemetry.count("operating_periods", cursor.rowcount)
@@ -1,10 +1,490 @@
 import logging
 import os
 
+import psycopg2.extras
+
 from utils.psql_utils import PSQL_connect
-from utils.utils import generate_correlation_id
+from utils.telemetry import Telemetry
+from utils.utils import generate_correlation_id, get_conf, run_correlation_ids, run_time_range
+
+TIME_ELAPSED_QUERY = """
+    INSERT INTO public.operating_period_metrics (operating_period, time_elapsed, correlation_id)
+    SELECT
+        operating_period_id,
+        age(finish, start) AS time_elapsed,
+        correlation_id
+    FROM
+        operating_period
+    WHERE
+        correlation_id = ANY(%(correlation_ids)s) AND event = 'create'
+    ON CONFLICT (operating_period) DO UPDATE
+    SET
+        time_elapsed = EXCLUDED.time_elapsed;
+"""
+
+DEFAULT_CARRY_OVER_WINDOW = "1 day"
+
+METRICS_ENGINES = ("postgis", "numpy")
+DEFAULT_METRICS_CHUNK_SIZE = 100000
+
+# The points whose distances a run needs: the run's updates, plus one carry-over point per vehicle,
+# its latest earlier update from another run within the carry-over window, so that periods spanning
+# two runs are measured without a gap. A run may cover several correlation IDs (one per day of a
+# backfill), and each point keeps its own. The run's updates are only looked up between run_start and
+# run_end, the location time range of the run's dates (see `run_time_range`), so that the planner prunes
+# the other daily partitions of vehicle_update; without dates, every partition is read.
+RUN_POINTS_CTE = """
+    WITH run_updates AS (
+        SELECT uid, vehicle_id, location_time, longitude, latitude, correlation_id
+        FROM vehicle_update
+        WHERE
+            correlation_id = ANY(%(correlation_ids)s)
+            AND location_time >= coalesce(%(run_start)s::timestamptz, '-infinity')
+            AND location_time < coalesce(%(run_end)s::timestamptz, 'infinity')
+    ),
+    carry_over AS (
+        SELECT p.uid, f.vehicle_id, p.location_time, p.longitude, p.latitude, p.correlation_id
+        FROM
+            (SELECT vehicle_id, min(location_time) AS first_time FROM run_updates GROUP BY vehicle_id) f
+            CROSS JOIN LATERAL (
+                SELECT uid, location_time, longitude, latitude, correlation_id
+                FROM vehicle_update p
+                WHERE
+                    p.vehicle_id = f.vehicle_id
+                    AND p.location_time < f.first_time
+                    AND p.location_time >= f.first_time - %(carry_over_window)s::interval
+                    AND p.location_time >= coalesce(%(run_start)s::timestamptz, '-infinity') - %(carry_over_window)s::interval
+                    AND p.correlation_id <> ALL(%(correlation_ids)s)
+                ORDER BY p.location_time DESC
+                LIMIT 1
+            ) p
+    ),
+    points AS (
+        SELECT uid, vehicle_id, location_time, longitude, latitude, correlation_id, true AS in_run FROM run_updates
+        UNION ALL
+        SELECT uid, vehicle_id, location_time, longitude, latitude, correlation_id, false AS in_run FROM carry_over
+    )
+"""
+
+# Computes the distance from each of the run's updates to the previous point of the same vehicle and
+# stores it in vehicle_update_segment. Coordinates are lagged first and the geography distance is only
+# computed for updates that have no stored segment yet, so reruns reuse them.
+SEGMENTS_QUERY = RUN_POINTS_CTE + """,
+    lagged AS (
+        SELECT
+            uid,
+            vehicle_id,
+            location_time,
+            correlation_id,
+            in_run,
+            longitude,
+            latitude,
+            LAG(longitude) OVER w AS previous_longitude,
+            LAG(latitude) OVER w AS previous_latitude
+        FROM points
+        WINDOW w AS (PARTITION BY vehicle_id ORDER BY location_time)
+    )
+    INSERT INTO vehicle_update_segment (update_uid, vehicle_id, location_time, distance, correlation_id)
+    SELECT
+        l.uid,
+        l.vehicle_id,
+        l.location_time,
+        ST_Distance(
+            ST_Point(l.longitude, l.latitude)::geography,
+            ST_Point(l.previous_longitude, l.previous_latitude)::geography
+        ),
+        l.correlation_id
+    FROM
+        lagged l
+    WHERE
+        l.in_run
+        AND NOT EXISTS (SELECT 1 FROM vehicle_update_segment s WHERE s.update_uid = l.uid)
+    ON CONFLICT (update_uid) DO NOTHING;
+"""
+
+# Recomputes the stored segment of the updates from other runs that now follow one of the run's updates,
+# e.g. when a late file of a micro-batch fills a gap: their previous point changed, so their distance is
+# stale. Such an update lies within the run's time span of its vehicle, or is the first one after it.
+# Returns the vehicle and time of the segments whose distance changed, see COVERING_DISTANCE_TRAVELLED_QUERY.
+NEXT_SEGMENTS_QUERY = """
+    WITH run_spans AS (
+        SELECT vehicle_id, min(location_time) AS first_time, max(location_time) AS last_time
+        FROM vehicle_update
+        WHERE
+            correlation_id = ANY(%(correlation_ids)s)
+            AND location_time >= coalesce(%(run_start)s::timestamptz, '-infinity')
+            AND location_time < coalesce(%(run_end)s::timestamptz, 'infinity')
+        GROUP BY vehicle_id
+    ),
+    candidates AS (
+        SELECT u.uid, u.vehicle_id, u.location_time, u.longitude, u.latitude, u.correlation_id
+        FROM
+            run_spans r
+            JOIN vehicle_update u
+                ON u.vehicle_id = r.vehicle_id
+                AND u.location_time > r.first_time
+                AND u.location_time < r.last_time
+                AND u.location_time >= coalesce(%(run_start)s::timestamptz, '-infinity')
+                AND u.location_time < coalesce(%(run_end)s::timestamptz, 'infinity')
+        WHERE
+            u.correlation_id <> ALL(%(correlation_ids)s)
+        UNION ALL
+        SELECT n.uid, n.vehicle_id, n.location_time, n.longitude, n.latitude, n.correlation_id
+        FROM
+            run_spans r
+            CROSS JOIN LATERAL (
+                SELECT uid, vehicle_id, location_time, longitude, latitude, correlation_id
+                FROM vehicle_update n
+                WHERE n.vehicle_id = r.vehicle_id AND n.location_time > r.last_time
+                ORDER BY n.location_time
+                LIMIT 1
+            ) n
+    )
+    INSERT INTO vehicle_update_segment (update_uid, vehicle_id, location_time, distance, correlation_id)
+    SELECT
+        c.uid,
+        c.vehicle_id,
+        c.location_time,
+        ST_Distance(
+            ST_Point(c.longitude, c.latitude)::geography,
+            ST_Point(p.longitude, p.latitude)::geography
+        ),
+        c.correlation_id
+    FROM
+        candidates c
+        CROSS JOIN LATERAL (
+            SELECT longitude, latitude, correlation_id
+            FROM vehicle_update p
+            WHERE p.vehicle_id = c.vehicle_id AND p.location_time < c.location_time
+            ORDER BY p.location_time DESC
+            LIMIT 1
+        ) p
+    WHERE
+        p.correlation_id = ANY(%(correlation_ids)s)
+    ON CONFLICT (update_uid) DO UPDATE SET
+        distance = EXCLUDED.distance
+    WHERE
+        vehicle_update_segment.distance IS DISTINCT FROM EXCLUDED.distance
+    RETURNING vehicle_id, location_time;
+"""
+
+# Sums the stored segments of each of the run's operating periods, whatever run stored them, so that a
+# period spanning several runs (e.g. micro-batches) is measured in full
+DISTANCE_TRAVELLED_QUERY = """
+    INSERT INTO operating_period_metrics (operating_period, time_elapsed, distance_travelled, correlation_id)
+    SELECT
+        o.operating_period_id AS operating_period,
+        age(o.finish, o.start) AS time_elapsed,
+        sum(s.distance) AS distance_travelled,
+        o.correlation_id
+    FROM
+        operating_period o
+        JOIN vehicle_update_segment s
+            ON o.vehicle_id = s.vehicle_id AND s.location_time BETWEEN o.start AND o.finish
+    WHERE
+        o.correlation_id = ANY(%(correlation_ids)s)
+    GROUP BY
+        o.operating_period_id, o.start, o.finish, o.correlation_id
+    ON CONFLICT (operating_period) DO UPDATE SET
+        distance_travelled = EXCLUDED.distance_travelled;
+"""
+
+# Sums again the stored segments of the operating periods, of any run, covering the segments recomputed
+# by NEXT_SEGMENTS_QUERY
+COVERING_DISTANCE_TRAVELLED_QUERY = """
+    WITH covering AS (
+        SELECT DISTINCT o.operating_period_id
+        FROM
+            unnest(%(vehicle_ids)s::text[], %(location_times)s::timestamptz[]) AS c (vehicle_id, location_time)
+            JOIN operating_period o
+                ON o.vehicle_id = c.vehicle_id AND c.location_time BETWEEN o.start AND o.finish
+    )
+    INSERT INTO operating_period_metrics (operating_period, time_elapsed, distance_travelled, correlation_id)
+    SELECT
+        o.operating_period_id AS operating_period,
+        age(o.finish, o.start) AS time_elapsed,
+        sum(s.distance) AS distance_travelled,
+        o.correlation_id
+    FROM
+        covering c
+        JOIN operating_period o ON o.operating_period_id = c.operating_period_id
+        JOIN vehicle_update_segment s
+            ON o.vehicle_id = s.vehicle_id AND s.location_time BETWEEN o.start AND o.finish
+    GROUP BY
+        o.operating_period_id, o.start, o.finish, o.correlation_id
+    ON CONFLICT (operating_period) DO UPDATE SET
+        distance_travelled = EXCLUDED.distance_travelled;
+"""
+
+# The points the numpy engine needs, ordered for the segment computation: every update of each vehicle
+# from the first start of its periods in the run, or its first update in the run, to the last finish of
+# its periods or its last update in the run, whatever run loaded it. Plus the update before within the
+# carry-over window, the starting point of the first segment, and the update after, whose segment may
+# start at one of the run's updates (see NEXT_SEGMENTS_QUERY).
+PERIOD_POINTS_QUERY = """
+    WITH spans AS (
+        SELECT vehicle_id, min(first_time) AS first_time, max(last_time) AS last_time
+        FROM (
+            SELECT vehicle_id, min(start) AS first_time, max(finish) AS last_time
+            FROM operating_period
+            WHERE correlation_id = ANY(%(correlation_ids)s)
+            GROUP BY vehicle_id
+            UNION ALL
+            SELECT vehicle_id, min(location_time), max(location_time)
+            FROM vehicle_update
+            WHERE
+                correlation_id = ANY(%(correlation_ids)s)
+                AND location_time >= coalesce(%(run_start)s::timestamptz, '-infinity')
+                AND location_time < coalesce(%(run_end)s::timestamptz, 'infinity')
+            GROUP BY vehicle_id
+        ) s
+        GROUP BY vehicle_id
+    ),
+    points AS (
+        SELECT u.uid, u.vehicle_id, u.location_time, u.longitude, u.latitude, u.correlation_id
+        FROM
+            spans s
+            JOIN vehicle_update u
+                ON u.vehicle_id = s.vehicle_id AND u.location_time BETWEEN s.first_time AND s.last_time
+        UNION ALL
+        SELECT p.uid, s.vehicle_id, p.location_time, p.longitude, p.latitude, p.correlation_id
+        FROM
+            spans s
+            CROSS JOIN LATERAL (
+                SELECT uid, location_time, longitude, latitude, correlation_id
+                FROM vehicle_update p
+                WHERE
+                    p.vehicle_id = s.vehicle_id
+                    AND p.location_time < s.first_time
+                    AND p.location_time >= s.first_time - %(carry_over_window)s::interval
+                ORDER BY p.location_time DESC
+                LIMIT 1
+            ) p
+        UNION ALL
+        SELECT n.uid, s.vehicle_id, n.location_time, n.longitude, n.latitude, n.correlation_id
+        FROM
+            spans s
+            CROSS JOIN LATERAL (
+                SELECT uid, location_time, longitude, latitude, correlation_id
+                FROM vehicle_update n
+                WHERE n.vehicle_id = s.vehicle_id AND n.location_time > s.last_time
+                ORDER BY n.location_time
+                LIMIT 1
+            ) n
+    )
+    SELECT
+        uid,
+        vehicle_id,
+        (extract(epoch FROM location_time) * 1000000)::bigint AS location_time,
+        longitude,
+        latitude,
+        correlation_id,
+        correlation_id = ANY(%(correlation_ids)s) AS in_run
+    FROM points
+    ORDER BY vehicle_id, location_time;
+"""
+
+RUN_PERIODS_QUERY = """
+    SELECT
+        operating_period_id,
+        vehicle_id,
+        (extract(epoch FROM start) * 1000000)::bigint AS start,
+        (extract(epoch FROM finish) * 1000000)::bigint AS finish,
+        correlation_id
+    FROM operating_period
+    WHERE correlation_id = ANY(%(correlation_ids)s) AND event = 'create';
+"""
+
+# Stores the segments the numpy engine computed for the run's updates, like SEGMENTS_QUERY. The times
+# are in microseconds since the epoch, as read by PERIOD_POINTS_QUERY.
+WRITE_SEGMENTS_QUERY = """
+    INSERT INTO vehicle_update_segment (update_uid, vehicle_id, location_time, distance, correlation_id)
+    SELECT
+        s.uid,
+        s.vehicle_id,
+        to_timestamp(0) + s.location_time * interval '1 microsecond',
+        s.distance,
+        s.correlation_id
+    FROM (VALUES %s) AS s (uid, vehicle_id, location_time, distance, correlation_id)
+    ON CONFLICT (update_uid) DO NOTHING;
+"""
+
+# Stores the segments the numpy engine recomputed for the updates following the run's updates, like
+# NEXT_SEGMENTS_QUERY, and returns the ones whose distance changed
+WRITE_NEXT_SEGMENTS_QUERY = """
+    INSERT INTO vehicle_update_segment (update_uid, vehicle_id, location_time, distance, correlation_id)
+    SELECT
+        s.uid,
+        s.vehicle_id,
+        to_timestamp(0) + s.location_time * interval '1 microsecond',
+        s.distance,
+        s.correlation_id
+    FROM (VALUES %s) AS s (uid, vehicle_id, location_time, distance, correlation_id)
+    ON CONFLICT (update_uid) DO UPDATE SET
+        distance = EXCLUDED.distance
+    WHERE
+        vehicle_update_segment.distance IS DISTINCT FROM EXCLUDED.distance
+    RETURNING vehicle_id, location_time;
+"""
+
+SEGMENT_TEMPLATE = "(%s::bigint, %s, %s::bigint, %s::double precision, %s)"
 
-def calculate_operating_periods_metrics(**context):
+WRITE_DISTANCE_TRAVELLED_QUERY = """
+    INSERT INTO operating_period_metrics (operating_period, distance_travelled, correlation_id)
+    VALUES %s
+    ON CONFLICT (operating_period) DO UPDATE SET
+        distance_travelled = EXCLUDED.distance_travelled;
+"""
+
+
+def numpy_distance_travelled(connection, params, chunk_size=DEFAULT_METRICS_CHUNK_SIZE):
+    """
+    Computes the distance travelled in each of the run's operating periods with NumPy.
+
+    The points of the periods and of the run's updates (see `PERIOD_POINTS_QUERY`) are streamed
+    through a server-side cursor in chunks of `chunk_size` rows and converted to arrays. Segment
+    distances use the haversine formula, so they match the PostGIS engine within
+    `utils.distance_utils.DISTANCE_TOLERANCE`. The sums of each chunk are added up, the last point of
+    a chunk being carried to the next one.
+
+    The segments ending at one of the run's updates are stored in `vehicle_update_segment`, for the
+    rollups and later runs, and so are the segments of the updates from other runs that follow one of
+    them, like `NEXT_SEGMENTS_QUERY` does with PostGIS.
+
+    Parameters
+    ----------
+    connection : utils.psql_utils.InstrumentedConnection
+        Connection to the database.
+    params : dict
+        The query parameters, `correlation_ids` and `carry_over_window`.
+    chunk_size : int
+        Number of points fetched at a time.
+
+    Returns
+    -------
+    tuple
+        The (operating_period_id, distance_travelled, correlation_id) tuples of the periods, without
+        the periods that have no known segment, like in the PostGIS engine. And the (vehicle_id,
+        location_time) of the recomputed segments whose distance changed, see
+        `recompute_covering_periods`.
+    """
+    import numpy as np
+
+    from utils.distance_utils import period_sums, segment_distances
+
+    def segment_rows(rows, distances, mask):
+        return [
+            (rows[i][0], rows[i][1], rows[i][2], None if np.isnan(distances[i]) else float(distances[i]), rows[i][5])
+            for i in np.flatnonzero(mask)
+        ]
+
+    with connection.cursor() as cursor:
+        cursor.execute(RUN_PERIODS_QUERY, params)
+        periods = cursor.fetchall()
+
+    codes = {}
+    period_vehicles = np.array([codes.setdefault(period[1], len(codes)) for period in periods])
+    period_starts = np.array([period[2] for period in periods], dtype=np.int64)
+    period_finishes = np.array([period[3] for period in periods], dtype=np.int64)
+    totals = np.zeros(len(periods))
+    known = np.zeros(len(periods), dtype=np.int64)
+
+    segments = 0
+    recomputed = []
+    previous = None
+    points_cursor = connection.server_cursor("numpy_distance_travelled", itersize=chunk_size)
+    with points_cursor as cursor, connection.cursor() as writer:
+        cursor.execute(PERIOD_POINTS_QUERY, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            carried = previous is not None
+            if carried:
+                rows.insert(0, previous)
+            previous = rows[-1]
+
+            vehicles = np.array([codes.setdefault(row[1], len(codes)) for row in rows])
+            times = np.array([row[2] for row in rows], dtype=np.int64)
+            longitudes = np.array([row[3] for row in rows], dtype=np.float64)
+            latitudes = np.array([row[4] for row in rows], dtype=np.float64)
+            in_run = np.array([row[6] for row in rows], dtype=bool)
+
+            distances = segment_distances(vehicles, longitudes, latitudes)
+            # The segments ending at the run's updates, and at an update of another run that follows one of them
+            follows_run = np.concatenate([[False], (vehicles[1:] == vehicles[:-1]) & in_run[:-1]])
+            run_segments, next_segments = in_run.copy(), follows_run & ~in_run
+            # The carried point was counted and stored by the previous chunk
+            if carried:
+                distances[0] = np.nan
+                run_segments[0] = False
+            if run_segments.any():
+                psycopg2.extras.execute_values(
+                    writer, WRITE_SEGMENTS_QUERY, segment_rows(rows, distances, run_segments),
+                    template=SEGMENT_TEMPLATE, page_size=1000,
+                )
+                segments += int(run_segments.sum())
+            if next_segments.any():
+                recomputed += psycopg2.extras.execute_values(
+                    writer, WRITE_NEXT_SEGMENTS_QUERY, segment_rows(rows, distances, next_segments),
+                    template=SEGMENT_TEMPLATE, page_size=1000, fetch=True,
+                )
+
+            chunk_totals, chunk_known = period_sums(
+                vehicles, times, distances, period_vehicles, period_starts, period_finishes
+            )
+            totals += chunk_totals
+            known += chunk_known
+
+    logging.info(f"Stored {segments} segment distances computed with numpy")
+    distances = [(period[0], float(total), period[4]) for period, total, count in zip(periods, totals, known) if count]
+    return distances, recomputed
+
+
+def recompute_covering_periods(cursor, recomputed):
+    """
+    Sums again the stored segments of the operating periods covering recomputed segments, see
+    `COVERING_DISTANCE_TRAVELLED_QUERY`.
+
+    Parameters
+    ----------
+    cursor : psycopg2.extensions.cursor
+        Cursor to execute the query.
+    recomputed : list
+        (vehicle_id, location_time) tuples of the recomputed segments.
+    """
+    if not recomputed:
+        return
+    cursor.execute(COVERING_DISTANCE_TRAVELLED_QUERY, {
+        "vehicle_ids": [vehicle_id for vehicle_id, _ in recomputed],
+        "location_times": [location_time for _, location_time in recomputed],
+    })
+    logging.info(
+        f"Recomputed {len(recomputed)} segments following the run's updates "
+        f"and {cursor.rowcount} operating periods covering them"
+    )
+
+
+def write_distance_travelled(cursor, distances):
+    """
+    Upserts the distance travelled of operating periods into `operating_period_metrics`.
+
+    Parameters
+    ----------
+    cursor : psycopg2.extensions.cursor
+        Cursor to execute the query.
+    distances : list
+        (operating_period_id, distance_travelled, correlation_id) tuples.
+    """
+    psycopg2.extras.execute_values(
+        cursor,
+        WRITE_DISTANCE_TRAVELLED_QUERY,
+        distances,
+        page_size=1000,
+    )
+
+
+def calculate_operating_periods_metrics(target_date=None, lookback_days=0, **context):
     """
     Calculate metrics for operating periods.
 
@@ -13,8 +493,27 @@ def calculate_operating_periods_metrics(**context):
     operating period, as well as a correlation ID to link the data to the original
     run of the DAG.
 
+    Distances are computed incrementally: only the run's vehicle updates (plus one
+    carry-over point per vehicle from an earlier run) are read. With the default
+    `postgis` engine the distance of each segment is stored in `vehicle_update_segment`
+    to be reused by reruns and later runs: a period sums the stored segments of every
+    run it spans. When the run's updates fall between the updates of another run
+    (e.g. a late micro-batch file), the stored segment of the update following each
+    of them is recomputed too, with the distance travelled of the periods covering it
+    (see `NEXT_SEGMENTS_QUERY`). The `numpy` engine computes the distances in the
+    worker instead, from the updates of the periods, and stores the same segments,
+    see `numpy_distance_travelled`.
+    A backfill run computes the metrics of all its days at once (see
+    `run_correlation_ids`). The run's updates are only looked up around its dates
+    (see `run_time_range`), so the other daily partitions are pruned.
+
     Parameters
     ----------
+    target_date : str or datetime.datetime, optional
+        The date of the run, in the format "%Y-%m-%d" if a string. Without it, and
+        outside a backfill, the run's updates are looked up in every partition.
+    lookback_days : int, optional
+        Number of days before `target_date` the run also loaded, e.g. by a micro-batch.
     context : dict
         The context dictionary, which is provided by Airflow and contains information
         about the current DAG run.
@@ -26,47 +525,36 @@ def calculate_operating_periods_metrics(**context):
     correlation_id = generate_correlation_id(context['dag_run'].run_id)
     logging.info(f"Running calculate_operating_periods_metrics for {correlation_id=}")
     
-    with PSQL_connect() as (connect, cursor):
-        cursor.execute(f"""
-            INSERT INTO public.operating_period_metrics (operating_period, time_elapsed, correlation_id)
-            SELECT
-                operating_period_id,
-                age(finish, start) AS time_elapsed,
-                correlation_id
-            FROM
-                operating_period
-            WHERE
-                correlation_id = '{correlation_id}'
-            ON CONFLICT (operating_period) DO UPDATE
-            SET
-                time_elapsed = EXCLUDED.time_elapsed;
-        """)
+    params = {
+        "correlation_ids": run_correlation_ids(context),
+        "carry_over_window": get_conf(context, "carry_over_window", DEFAULT_CARRY_OVER_WINDOW),
+    }
+    params["run_start"], params["run_end"] = run_time_range(context, target_date, lookback_days)
+    
+    engine = get_conf(context, "metrics_engine", "postgis")
+    if engine not in METRICS_ENGINES:
+        raise ValueError(f"Unknown metrics_engine {engine!r}, expected one of {METRICS_ENGINES}")
+    
+    with Telemetry.from_context(context, correlation_id) as telemetry, PSQL_connect.from_context(context) as (connect, cursor):
+        with telemetry.stage("compute"):
+            cursor.execute(TIME_ELAPSED_QUERY, params)
+            telemetry.count("operating_periods", cursor.rowcount)
+            if engine == "numpy":
+                chunk_size = int(get_conf(context, "metrics_chunk_size", DEFAULT_METRICS_CHUNK_SIZE))
+                distances, recomputed = numpy_distance_travelled(connect, params, chunk_size)
+                telemetry.count("recomputed_segments", len(recomputed))
+            else:
+                cursor.execute(SEGMENTS_QUERY, params)
+                logging.info(f"Computed {cursor.rowcount} new segment distances")
+                telemetry.count("segments", cursor.rowcount)
+                cursor.execute(NEXT_SEGMENTS_QUERY, params)
+                recomputed = cursor.fetchall()
+                telemetry.count("recomputed_segments", len(recomputed))
+                cursor.execute(DISTANCE_TRAVELLED_QUERY, params)
+                recompute_covering_periods(cursor, recomputed)
         
-        cursor.execute(f"""
-            INSERT INTO operating_period_metrics (operating_period, time_elapsed, distance_travelled, correlation_id)
-            SELECT
-                o.operating_period_id AS operating_period,
-                age(o.finish, o.start) AS time_elapsed,
-                sum(v.distance) AS distance_travelled,
-                o.correlation_id
-            FROM
-                operating_period o
-                JOIN (
-                    SELECT
-                        vehicle_id,
-                        location_time,
-                        correlation_id,
-                        ST_Distance(
-                            ST_Point(longitude, latitude)::geography,
-                            LAG(ST_Point(longitude, latitude)) OVER (PARTITION BY vehicle_id, correlation_id ORDER BY location_time)::geography
-                        ) AS distance
-                    FROM
-                        vehicle_update
-                ) v ON o.vehicle_id = v.vehicle_id AND v.location_time BETWEEN o.start AND o.finish AND o.correlation_id = v.correlation_id
-            WHERE
-                o.correlation_id = '{correlation_id}'
-            GROUP BY
-                o.operating_period_id, o.start, o.finish, o.correlation_id
-            ON CONFLICT (operating_period) DO UPDATE SET
-                distance_travelled = EXCLUDED.distance_travelled;
-        """)
+        if engine == "numpy":
+            with telemetry.stage("load"):
+                write_distance_travelled(cursor, distances)
+                recompute_covering_periods(cursor, recomputed)
+            logging.info(f"Computed the distance travelled of {len(distances)} operating periods with numpy")
\ No newline at end of file
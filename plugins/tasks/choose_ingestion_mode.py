@@ -0,0 +1,35 @@
+import logging
+
+from utils.utils import generate_correlation_id, get_conf
+
+INGESTION_MODES = {
+    "split": "fetch_and_validate_bucket",
+    "fused": "fetch_validate_and_import",
+    "mapped": "list_source_objects",
+    "backfill": "backfill_date_range",
+}
+
+def choose_ingestion_mode(**context):
+    """
+    Selects the ingestion branch of the DAG from the `ingestion_mode` value of the DAG run config.
+    
+    "split" (the default) runs `fetch_and_validate_bucket` and then `fetch_and_import_to_psql`.
+    "fused" runs `fetch_validate_and_import`, which validates and loads each file in a single pass.
+    "mapped" runs `list_source_objects`, then one mapped `ingest_object_batch` task per batch of files
+    and `gather_ingestion_results`. "backfill" runs `backfill_date_range`, which ingests every day from
+    `start_date` to `end_date`; it is the default when `start_date` is set.
+    
+    Args:
+        context (dict): The context dictionary provided by Airflow.
+
+    Returns:
+        str: The task_id of the first task of the selected branch.
+    """
+    correlation_id = generate_correlation_id(context['dag_run'].run_id)
+    default_mode = "backfill" if get_conf(context, "start_date") is not None else "split"
+    ingestion_mode = get_conf(context, "ingestion_mode", default_mode)
+    logging.info(f"Running choose_ingestion_mode for {correlation_id=}: {ingestion_mode=}")
+    
+    if ingestion_mode not in INGESTION_MODES:
+        raise ValueError(f"Unknown ingestion_mode {ingestion_mode!r}, expected one of {list(INGESTION_MODES)}")
+    return INGESTION_MODES[ingestion_mode]
\ No newline at end of file
@@ -0,0 +1,32 @@
+import logging
+from datetime import timedelta
+from dateutil import parser
+
+from utils.psql_utils import PSQL_connect
+from utils.telemetry import Telemetry
+from utils.utils import generate_correlation_id
+
+def ensure_partitions(target_date, **context):
+    """
+    Create the daily `vehicle_update` partitions of `target_date` and of the day after.
+
+    The light counterpart of ensure_table_creation for door2door_microbatch, which runs every few
+    minutes: the migrations, the table definitions and the split of the default partition are left
+    to the daily DAG, which must have run once before the micro-batches.
+
+    Args:
+        target_date (str or datetime.datetime): The date of the run, in the format "%Y-%m-%d" if a string.
+        context (dict): The context dictionary provided by Airflow.
+
+    Returns:
+        None
+    """
+    correlation_id = generate_correlation_id(context['dag_run'].run_id)
+    logging.info(f"Running ensure_partitions for {target_date=} and {correlation_id=}")
+    if type(target_date) is str:
+        target_date = parser.parse(target_date)
+
+    with Telemetry.from_context(context, correlation_id) as telemetry, PSQL_connect.from_context(context) as (conn, cur):
+        with telemetry.stage("partitions"):
+            for day in (target_date.date(), target_date.date() + timedelta(days=1)):
+                cur.execute("SELECT ensure_vehicle_update_partition(%s)", (day,))
@@ -1,30 +1,71 @@
 import logging
 import os
+from datetime import timedelta
+from dateutil import parser
 
 from utils.psql_utils import PSQL_connect
-from utils.utils import generate_correlation_id
+from utils.telemetry import Telemetry
+from utils.utils import generate_correlation_id, backfill_dates, resources_path
 
-def ensure_table_creation(**context):
+def execute_sql_files(cur, directory):
+    """
+    Execute every SQL file of a directory, in file name order.
+    
+    Args:
+        cur (psycopg2.extensions.cursor): Cursor to the PostgreSQL database.
+        directory (str): Directory holding the `.sql` files. Missing directories are skipped.
+
+    Returns:
+        None
+    """
+    if not os.path.isdir(directory):
+        return
+    
+    # get a sorted list of all SQL files in the directory
+    sql_files = sorted(f for f in os.listdir(directory) if f.endswith('.sql'))
+    
+    # iterate over the files and execute their contents
+    for sql_file in sql_files:
+        # open the file and read its contents
+        with open(os.path.join(directory, sql_file), 'r') as f:
+            script = f.read()
+            cur.execute(script)
+
+def ensure_table_creation(target_date=None, **context):
     """
     Create necessary tables in PostgresSQL
     
+    Migrations from `resources/psql_migrations` run first, then the table definitions from
+    `resources/psql_tables`. Finally the daily partitions of `vehicle_update` around `target_date`
+    (or around every day from `start_date` to `end_date` for a backfill run) are created, and rows
+    left in its default partition (e.g. by the migration) are moved to daily partitions.
+    
     Args:
+        target_date (str or datetime.datetime): Optional. The date of the run, in the format "%Y-%m-%d" if a string.
         context (dict): The context dictionary provided by Airflow.
 
     Returns:
         None
     """
     correlation_id = generate_correlation_id(context['dag_run'].run_id)
-    logging.info(f"Running ensure_table_creation for {correlation_id=}")
+    logging.info(f"Running ensure_table_creation for {target_date=} and {correlation_id=}")
+    if type(target_date) is str:
+        target_date = parser.parse(target_date)
     
-    with PSQL_connect() as (conn, cur):
-        # get a list of all SQL files in the directory
-        sql_files = [f for f in os.listdir('/opt/airflow/resources/psql_tables') if f.endswith('.sql')]
+    with Telemetry.from_context(context, correlation_id) as telemetry, PSQL_connect.from_context(context) as (conn, cur):
+        with telemetry.stage("schema"):
+            execute_sql_files(cur, resources_path('psql_migrations'))
+            execute_sql_files(cur, resources_path('psql_tables'))
         
-        # iterate over the files and execute their contents
-        for sql_file in sql_files:
-            # open the file and read its contents
-            with open(os.path.join('/opt/airflow/resources/psql_tables', sql_file), 'r') as f:
-                script = f.read()
-                # Create  table
-                cur.execute(script)
+        with telemetry.stage("partitions"):
+            cur.execute("SELECT migrate_unpartitioned_vehicle_update()")
+            cur.execute("SELECT split_vehicle_update_default()")
+            dates = backfill_dates(context)
+            if dates:
+                run_days = [parser.parse(date_str) for date_str in dates]
+            else:
+                run_days = [target_date] if target_date else []
+            # events close to midnight may fall on the neighbouring days
+            days = sorted({(run_day + timedelta(days=offset)).date() for run_day in run_days for offset in (-1, 0, 1)})
+            for day in days:
+                cur.execute("SELECT ensure_vehicle_update_partition(%s)", (day,))
\ No newline at end of file
@@ -1,73 +1,162 @@
 import logging
-from minio import Minio
-from minio.error import S3Error
-import os, sys
-import tempfile
-import jsonschema
-import json
-from dateutil import parser
-
-from utils.json_utils import read_json_file
-from utils.psql_utils import PSQL_connect
-from utils.utils import generate_correlation_id
-
-def import_json_to_psql(file_path, correlation_id, connection, cursor):
+import os
+
+from utils.dedup_utils import EventDeduplicator
+from utils.json_utils import iter_json_file
+from utils.manifest_utils import skip_processed, record_processed, load_checkpoints, save_checkpoint
+from utils.minio_utils import get_minio_client, fetch_object, release_object, spool_max_size_from_context, TransferPool
+from utils.psql_utils import PSQL_connect, BulkLoader
+from utils.telemetry import Telemetry, get_telemetry
+from utils.trajectory_utils import TrajectoryCompressor
+from utils.utils import generate_correlation_id, get_conf
+
+VEHICLE_UPDATE_COLUMNS = ("vehicle_id", "latitude", "longitude", "location_time", "event_time", "organization_id", "correlation_id")
+VEHICLE_REGISTRATION_COLUMNS = ("vehicle_id", "event", "event_time", "organization_id", "correlation_id")
+OPERATING_PERIOD_COLUMNS = ("operating_period_id", "vehicle_id", "start", "finish", "event", "event_time", "organization_id", "correlation_id")
+
+DEFAULT_COPY_BATCH_SIZE = 10000
+DEFAULT_CHECKPOINT_EVENTS = 100000
+
+def source_stem(object_name):
+    """
+    Name of the source file an object comes from, without directory and extension.
+
+    The raw JSON copy "<date>/<name>.json" and the Parquet files ".../<name>.parquet" of the datalake
+    both come from the source object ".../<name>.json".
+
+    Args:
+    - object_name (str): The key of the object.
+
+    Returns:
+    - str: The base name of the key without its extension.
+    """
+    return os.path.splitext(os.path.basename(object_name))[0]
+
+def event_to_row(obj, correlation_id):
+    """
+    Map a JSON event to the table, columns and values it is loaded into.
+
+    Args:
+        obj (dict): The JSON event.
+        correlation_id (str): Unique ID to correlate this process with others.
+
+    Returns:
+        tuple: `(table, columns, row)`, or None if the event is not loaded into PostgreSQL.
+    """
+    on = obj.get("on")
+    event = obj.get("event")
+    if on == "vehicle" and event == "update":
+        vehicle_id = obj['data']['id']
+        latitude = obj['data']['location']['lat']
+        longitude = obj['data']['location']['lng']
+        location_time = obj['data']['location']['at']
+        event_time = obj['at']
+        organization_id = obj['organization_id']
+        
+        return "vehicle_update", VEHICLE_UPDATE_COLUMNS, \
+            (vehicle_id, latitude, longitude, location_time, event_time, organization_id, correlation_id)
+    elif on == "vehicle" and (event == "register" or event == "deregister"):
+        vehicle_id = obj['data']['id']
+        event_time = obj['at']
+        organization_id = obj['organization_id']
+        
+        return "vehicle_registration", VEHICLE_REGISTRATION_COLUMNS, \
+            (vehicle_id, event, event_time, organization_id, correlation_id)
+    elif on == "operating_period" and (event == "create" or event == "delete"):
+        operating_period_id = obj['data']['id']
+        start = obj['data']['start']
+        finish = obj['data']['finish']
+        event_time = obj['at']
+        organization_id = obj['organization_id']
+        
+        return "operating_period", OPERATING_PERIOD_COLUMNS, \
+            (operating_period_id, None, start, finish, event, event_time, organization_id, correlation_id)
+    return None
+
+def import_json_to_psql(file_path, correlation_id, connection, cursor, loader=None, skip_events=0, checkpoint=None, checkpoint_events=None):
     """
     Import JSON data to PostgreSQL database based on specified criteria.
 
+    Rows are buffered per target table and streamed with `COPY FROM STDIN` through a `BulkLoader`.
+    With `checkpoint`, the loader is flushed and `checkpoint` is called every `checkpoint_events`
+    events, so that a large file can be committed in chunks.
+
     Args:
-        file_path (str): Path to the JSON file to import.
+        file_path (str or file object): Path to the JSON file to import, or a binary file object.
         correlation_id (str): Unique ID to correlate this process with others.
         connection (psycopg2.extensions.connection): Connection to the PostgreSQL database.
         cursor (psycopg2.extensions.cursor): Cursor to the PostgreSQL database.
+        loader (BulkLoader): Optional. Loader shared across files. If not provided, a loader is created
+            for this file and flushed before returning.
+        skip_events (int): Optional. Number of leading events already loaded by a previous attempt.
+            They are parsed but not loaded again.
+        checkpoint (callable): Optional. Called with the number of events of the file loaded so far.
+        checkpoint_events (int): Optional. Number of events between two calls of `checkpoint`.
 
     Returns:
         None
     """
-    data = read_json_file(file_path)
+    data = get_telemetry().timed_iter(iter_json_file(file_path), "parse")
+    own_loader = loader is None
+    if own_loader:
+        loader = BulkLoader(cursor, batch_size=DEFAULT_COPY_BATCH_SIZE)
     
-    for obj in data:
-        on = obj.get("on")
-        event = obj.get("event")
-        if on == "vehicle" and event == "update":
-            vehicle_id = obj['data']['id']
-            latitude = obj['data']['location']['lat']
-            longitude = obj['data']['location']['lng']
-            location_time = obj['data']['location']['at']
-            event_time = obj['at']
-            organization_id = obj['organization_id']
-            
-            cursor.execute(f"""
-                INSERT INTO vehicle_update (vehicle_id, latitude, longitude, location_time, event_time, organization_id, correlation_id)
-                VALUES ('{vehicle_id}', {latitude}, {longitude}, '{location_time}', '{event_time}', '{organization_id}', '{correlation_id}');
-            """)
-        elif on == "vehicle" and (event == "register" or event == "deregister"):
-            vehicle_id = obj['data']['id']
-            event = obj['event']
-            event_time = obj['at']
-            organization_id = obj['organization_id']
-            
-            cursor.execute(f"""
-                INSERT INTO vehicle_registration (vehicle_id, event, event_time, organization_id, correlation_id)
-                VALUES ('{vehicle_id}', '{event}', '{event_time}', '{organization_id}', '{correlation_id}');
-            """)
-        elif on == "operating_period" and (event == "create" or event == "delete"):
-            operating_period_id = obj['data']['id']
-            start = obj['data']['start']
-            finish = obj['data']['finish']
-            event = obj['event']
-            event_time = obj['at']
-            organization_id = obj['organization_id']
-            
-            cursor.execute(f"""
-                INSERT INTO operating_period (operating_period_id, vehicle_id, start, finish, event, event_time, organization_id, correlation_id)
-                VALUES ('{operating_period_id}', NULL, '{start}', '{finish}', '{event}', '{event_time}', '{organization_id}', '{correlation_id}');
-            """)
+    for index, obj in enumerate(data):
+        if index < skip_events:
+            continue
+        mapped = event_to_row(obj, correlation_id)
+        if mapped:
+            loader.add(*mapped)
+        if checkpoint is not None and checkpoint_events and (index + 1) % checkpoint_events == 0:
+            loader.flush()
+            checkpoint(index + 1)
+    
+    if own_loader:
+        loader.flush()
+
+def import_parquet_to_psql(file_path, object_name, correlation_id, loader):
+    """
+    Import a Parquet file of the datalake to PostgreSQL.
+
+    The target table is the `event_type` partition of the object name. The columns are converted
+    to CSV by Arrow and copied as-is, without building a Python object per event.
+
+    Args:
+        file_path (str or file object): Path to the Parquet file, or a binary file object.
+        object_name (str): The datalake key of the file.
+        correlation_id (str): Unique ID to correlate this process with others.
+        loader (BulkLoader): Loader used to stream the rows.
+
+    Returns:
+        None
+    """
+    # pyarrow is only needed for the parquet datalake format
+    from utils.parquet_utils import parquet_event_type, parquet_to_csv
+
+    table = parquet_event_type(object_name)
+    with get_telemetry().stage("parse"):
+        columns, data, num_rows = parquet_to_csv(file_path, correlation_id)
+    loader.copy_csv(table, columns, data, num_rows)
 
 def fetch_and_import_to_psql(**context):
     """
     Fetches data files from a MinIO bucket and imports the contents into PostgreSQL.
 
+    Files are downloaded concurrently by a `TransferPool` while earlier files are imported. Files already
+    imported with the same ETag and size are skipped (see `skip_processed`), and so are the files of the
+    `fused_objects` pushed by fetch_and_validate_bucket, already imported by the fused ingestion (e.g. of
+    door2door_microbatch). When `datalake_format` in the
+    DAG run config is "parquet" or "both", the Parquet files of the datalake are imported instead of the JSON files.
+
+    Duplicate events, within the run or already loaded, are dropped (see `BulkLoader`). With a
+    `trajectory_tolerance` in the DAG run config, the vehicle trajectories of the JSON files are
+    simplified before they are loaded (see `TrajectoryCompressor`).
+
+    The transaction is committed after every file, together with its manifest entry. JSON files are
+    also committed every `checkpoint_events` events (from the DAG run config) with a checkpoint of the
+    events loaded so far (see `save_checkpoint`). When the task fails, its retry skips the committed
+    files and resumes each partially loaded file right after its last checkpoint.
+
     Args:
         **context: Context dictionary passed by Airflow.
 
@@ -76,33 +165,77 @@ def fetch_and_import_to_psql(**context):
     """
     correlation_id = generate_correlation_id(context['dag_run'].run_id)
     logging.info(f"Running fetch_and_import_to_psql for {correlation_id=}")
+    with Telemetry.from_context(context, correlation_id) as telemetry:
 
-    endpoint = os.environ.get("MINIO_ENDPOINT")
-    user = os.environ.get("MINIO_USER")
-    password = os.environ.get("MINIO_PASSWORD")
+        client = get_minio_client()
 
-    # create a MinIO client
-    client = Minio(
-        endpoint=endpoint, access_key=user, secret_key=password, secure=False
-    )
+        target_date_str = context['ti'].xcom_pull(task_ids='fetch_and_validate_bucket')
+        bucket_name = "datalake"
+        prefix = f"{target_date_str}/"
+        from_parquet = get_conf(context, "datalake_format", "json") in ("parquet", "both")
+        if from_parquet:
+            # pyarrow is only needed for the parquet datalake format
+            from utils.parquet_utils import parquet_prefix
+            prefix = parquet_prefix(target_date_str)
 
-    target_date_str = context['ti'].xcom_pull(task_ids='fetch_and_validate_bucket')
-    bucket_name = "datalake"
-    prefix = f"{target_date_str}/"
-    
-    # get list of all files in the bucket
-    result = list(client.list_objects(bucket_name, prefix=prefix, recursive=True))
-    
-    keys_to_download = [obj.object_name for obj in result]
+        # get list of all files in the bucket
+        with telemetry.stage("list"):
+            result = list(client.list_objects(bucket_name, prefix=prefix, recursive=True))
+        fused_objects = set(context['ti'].xcom_pull(task_ids='fetch_and_validate_bucket', key='fused_objects') or [])
+        if fused_objects:
+            logging.info(f"Leaving the {len(fused_objects)} files of the fused ingestion out of the import")
+            result = [obj for obj in result if source_stem(obj.object_name) not in fused_objects]
+
+        batch_size = int(get_conf(context, "copy_batch_size", DEFAULT_COPY_BATCH_SIZE))
+        checkpoint_events = int(get_conf(context, "checkpoint_events", DEFAULT_CHECKPOINT_EVENTS))
+        spool_max_size = spool_max_size_from_context(context)
+
+        # download the files concurrently and import each one as soon as it is available
+        with PSQL_connect.from_context(context) as (connection, cursor), TransferPool.from_context(context) as pool:
+            # skip the files already imported with the same ETag and size
+            objects_to_download = skip_processed(cursor, "import", bucket_name, result, context)
+            logging.info(f"{len(objects_to_download)} of {len(result)} objects are new or changed")
+            # resume the files a previous attempt left partially loaded
+            checkpoints = load_checkpoints(cursor, "import", bucket_name, objects_to_download, context)
+
+            loader = BulkLoader(
+                cursor,
+                batch_size=batch_size,
+                dedup=EventDeduplicator.from_context(context),
+                compressor=TrajectoryCompressor.from_context(context),
+            )
+
+            def download(obj):
+                with telemetry.stage("download"):
+                    return fetch_object(client, bucket_name, obj.object_name, spool_max_size)
+
+            for obj, source in pool.imap(download, objects_to_download, release=release_object):
+                telemetry.count("files")
+                telemetry.count("bytes", obj.size or 0)
+                skip_events = checkpoints.get(obj.object_name, 0)
+                if skip_events:
+                    logging.info(f"Resuming {obj.object_name} after {skip_events} committed events")
+
+                def checkpoint(events_committed):
+                    # the chunk's rows and its checkpoint are committed together
+                    save_checkpoint(cursor, "import", bucket_name, obj, events_committed, correlation_id)
+                    connection.commit()
+                    telemetry.count("checkpoints")
 
-    # loop, download and proceess each matching file
-    with PSQL_connect() as (connection, cursor):
-        for key in keys_to_download:
-            with tempfile.NamedTemporaryFile(suffix=".json", delete=True) as tmp_file:
                 try:
-                    client.fget_object(bucket_name, key, tmp_file.name)
-                except Exception as err:
-                    print(err)
-                    sys.exit(1)
-                
-                import_json_to_psql(tmp_file.name, correlation_id, connection, cursor)
\ No newline at end of file
+                    if from_parquet:
+                        import_parquet_to_psql(source, obj.object_name, correlation_id, loader)
+                    else:
+                        import_json_to_psql(
+                            source, correlation_id, connection, cursor, loader=loader,
+                            skip_events=skip_events, checkpoint=checkpoint, checkpoint_events=checkpoint_events,
+                        )
+                finally:
+                    release_object(source)
+                # the file's rows and its manifest entry go in the same transaction
+                loader.flush()
+                record_processed(cursor, "import", bucket_name, obj, True, correlation_id)
+                connection.commit()
+
+            loader.log_throughput()
+            pool.log_summary()
\ No newline at end of file
@@ -1,67 +1,124 @@
 import logging
+import time
 from minio import Minio
-from minio.error import S3Error
-import os, sys
-import tempfile
-import jsonschema
+import os
+from functools import lru_cache
 import json
 from dateutil import parser
 
-from utils.json_utils import read_json_file, validate_jsonschema
-from utils.utils import generate_correlation_id
+from utils.json_utils import iter_json_file
+from utils.schema_compiler import CompiledValidator
+from utils.manifest_utils import skip_processed, record_processed, fused_processed
+from utils.parallel_validation import validate_file_in_pool, validation_executor, DEFAULT_VALIDATION_CHUNK_SIZE
+from utils.minio_utils import get_minio_client, fetch_object, release_object, spool_max_size_from_context, TransferPool
+from utils.psql_utils import PSQL_connect
+from utils.telemetry import Telemetry, get_telemetry
+from utils.utils import generate_correlation_id, get_conf, resources_path
+from tasks.fetch_and_import_to_psql import event_to_row, source_stem
 
-VEHICLE_UPDATE_VALIDATOR = jsonschema.Draft7Validator(json.load(open("/opt/airflow/resources/jsonschemas/vehicle_update.json")))
-VEHICLE_REGISTRATION_VALIDATOR = jsonschema.Draft7Validator(json.load(open("/opt/airflow/resources/jsonschemas/vehicle_registration.json")))
-OPERATING_PERIOD_VALIDATOR = jsonschema.Draft7Validator(json.load(open("/opt/airflow/resources/jsonschemas/operating_period.json")))
+DEFAULT_SOURCE_PREFIX = "data/{date}"
+DATALAKE_FORMATS = ("json", "parquet", "both")
+
+@lru_cache(maxsize=None)
+def get_validator(schema_name):
+    """
+    Compiled validator of a schema of `resources/jsonschemas`, loaded on first use and cached for the process.
+    
+    Args:
+    - schema_name (str): The schema file name without extension, e.g. "vehicle_update".
+    
+    Returns:
+    - CompiledValidator: The validator.
+    """
+    with open(resources_path("jsonschemas", f"{schema_name}.json")) as f:
+        return CompiledValidator(json.load(f))
+
+def validate_event(obj):
+    """
+    Validate a single JSON object against the schema matching its `on` and `event` fields.
+    
+    Args:
+    - obj (dict): The JSON object to validate.
+    
+    Returns:
+    - bool: False if the object fails its schema, True otherwise (objects without a known schema are accepted).
+    """
+    on = obj.get("on")
+    event = obj.get("event")
+    if on == "vehicle" and event == "update":
+        return get_validator("vehicle_update").is_valid(obj)
+    elif on == "vehicle" and (event == "register" or event == "deregister"):
+        return get_validator("vehicle_registration").is_valid(obj)
+    elif on == "operating_period" and (event == "create" or event == "delete"):
+        return get_validator("operating_period").is_valid(obj)
+    return True
+
+def event_type(obj):
+    """
+    Name of the event type of a JSON object, used to label the telemetry counters.
+    
+    Args:
+    - obj (dict): The JSON object.
+    
+    Returns:
+    - str: `<on>_<event>`, e.g. "vehicle_update".
+    """
+    return f"{obj.get('on')}_{obj.get('event')}"
 
 def valid_file(file_path):
     """
     Validate the JSON schema of the given file against the appropriate schema based on the `on` and `event` fields.
     
+    The parse and validate times, the events per type and the invalid events are recorded in the task's telemetry.
+    
     Args:
-    - file_path (str): Path to the JSON file to validate.
+    - file_path (str or file object): Path to the JSON file to validate, or a binary file object.
     
     Returns:
     - bool: True if the schema is valid, False otherwise.
     """
-    data = read_json_file(file_path)
+    telemetry = get_telemetry()
+    data = telemetry.timed_iter(iter_json_file(file_path), "parse")
     res = True
+    validate_time = 0.0
+    events = {}
+    invalid_events = 0
     for obj in data:
-        on = obj.get("on")
-        event = obj.get("event")
-        if on == "vehicle" and event == "update":
-            if not validate_jsonschema(obj, validator=VEHICLE_UPDATE_VALIDATOR):
-                print(f"Invalid schema for {obj} in {file_path}")
-                res = False
-        elif on == "vehicle" and (event == "register" or event == "deregister"):
-            if not validate_jsonschema(obj, validator=VEHICLE_REGISTRATION_VALIDATOR):
-                print(f"Invalid schema for {obj} in {file_path}")
-                res = False
-        elif on == "operating_period" and (event == "create" or event == "delete"):
-            if not validate_jsonschema(obj, validator=OPERATING_PERIOD_VALIDATOR):
-                print(f"Invalid schema for {obj} in {file_path}")
-                res = False
+        started_at = time.perf_counter()
+        valid = validate_event(obj)
+        validate_time += time.perf_counter() - started_at
+        events[event_type(obj)] = events.get(event_type(obj), 0) + 1
+        if not valid:
+            logging.warning(f"Invalid schema for {obj} in {file_path}")
+            invalid_events += 1
+            res = False
+    
+    telemetry.add_time("validate", validate_time)
+    for type_, count in events.items():
+        telemetry.count("events", count, type=type_)
+    telemetry.count("invalid_events", invalid_events)
     return res
 
-def send_file_to_minio(file_path, endpoint, user, password, bucket, prefix, object_name=None):
+def send_file_to_minio(file_path, endpoint=None, user=None, password=None, bucket="datalake", prefix="", object_name=None, client=None):
     """
     Upload the given file to MinIO at the specified bucket and prefix with the given object name.
     
     Args:
-    - file_path (str): Path to the file to upload.
-    - endpoint (str): The endpoint URL of the MinIO server.
-    - user (str): The access key for the MinIO server.
-    - password (str): The secret key for the MinIO server.
-    - bucket (str): The name of the bucket to upload the file to.
+    - file_path (str or file object): Path to the file to upload, or a seekable binary file object (e.g. an in-memory buffer).
+    - endpoint (str): The endpoint URL of the MinIO server. Not needed when `client` is given.
+    - user (str): The access key for the MinIO server. Not needed when `client` is given.
+    - password (str): The secret key for the MinIO server. Not needed when `client` is given.
+    - bucket (str): The name of the bucket to upload the file to. Defaults to "datalake".
     - prefix (str): The prefix of the object key to use.
-    - object_name (str): Optional. The name of the object to use for the uploaded file. Defaults to the base name of the file at `file_path`.
+    - object_name (str): Optional. The name of the object to use for the uploaded file. Defaults to the base name of the file at `file_path`, and is required for file objects.
+    - client (Minio): Optional. An existing client to reuse. If given, `endpoint`, `user` and `password` are ignored.
     
     Returns:
-    - None
+    - bool: True if the file was uploaded, False otherwise.
     """
     
     # Set up MinIO client
-    minio_client = Minio(
+    minio_client = client or Minio(
         endpoint, access_key=user, secret_key=password, secure=False  # Disable SSL/TLS
     )
 
@@ -71,77 +128,222 @@ def send_file_to_minio(file_path, endpoint, user, password, bucket, prefix, obje
 
     # Upload the file to MinIO
     try:
-        with open(file_path, "rb") as file:
-            minio_client.put_object(
-                bucket, object_name, file, os.stat(file_path).st_size
-            )
-        print(f"{file_path} uploaded to MinIO with {object_name}")
+        if isinstance(file_path, str):
+            with open(file_path, "rb") as file:
+                minio_client.put_object(
+                    bucket, object_name, file, os.stat(file_path).st_size
+                )
+        else:
+            # stream the buffer back as-is, without going through disk
+            size = file_path.seek(0, os.SEEK_END)
+            file_path.seek(0)
+            minio_client.put_object(bucket, object_name, file_path, size)
+        logging.info(f"{file_path} uploaded to MinIO with {object_name}")
+        return True
     except Exception as e:
-        pass
-        print(f"Error uploading file {file_path} to MinIO: {e}")
+        logging.error(f"Error uploading file {file_path} to MinIO: {e}")
+        return False
 
-def fetch_and_validate_bucket(target_date, **context):
+def build_event_tables(file_path):
     """
-    Fetches all files from the "de-tech-assessment-2022" bucket that match the given `target_date` and validates their schemas. 
-    If a schema is valid, the corresponding file is uploaded to the "datalake" bucket on MinIO.
+    Parse a JSON file into one typed Arrow table per event type, for the Parquet datalake.
     
     Args:
-    - target_date (str or datetime.datetime): The target date to match files against. If a string, it must be in the format "%Y-%m-%d".
-    - **context: Additional context that can be passed to the function.
+    - file_path (str or file object): Path to the JSON file, or a binary file object (read from the start).
     
     Returns:
-    - str: The target date in the format "%Y-%m-%d".
+    - dict: `pyarrow.Table` per event type.
     """
+    # pyarrow is only needed for the parquet datalake format
+    from utils.parquet_utils import EventTableBuilder
     
-    correlation_id = generate_correlation_id(context['dag_run'].run_id)
-    logging.info(f"Running fetch_and_validate_bucket_data for {target_date=} and {correlation_id=}")
-    if type(target_date) is str:
-        target_date = parser.parse(target_date)
-    endpoint = os.environ.get("MINIO_ENDPOINT")
-    user = os.environ.get("MINIO_USER")
-    password = os.environ.get("MINIO_PASSWORD")
+    if not isinstance(file_path, str):
+        file_path.seek(0)
+    builder = EventTableBuilder()
+    for obj in iter_json_file(file_path):
+        mapped = event_to_row(obj, None)
+        if mapped:
+            builder.add(*mapped)
+    return builder.tables()
 
-    # create a MinIO client
-    client = Minio(
-        endpoint=endpoint, access_key=user, secret_key=password, secure=False
-    )
+def upload_to_datalake(file_path, basename, target_date_str, datalake_format, client, tables=None):
+    """
+    Upload a validated file to the "datalake" bucket as raw JSON, as Parquet files, or both.
+    
+    Args:
+    - file_path (str or file object): Path to the JSON file, or a binary file object.
+    - basename (str): Base name of the source object.
+    - target_date_str (str): The date in the format "%Y-%m-%d".
+    - datalake_format (str): One of "json", "parquet" or "both".
+    - client (Minio): The MinIO client.
+    - tables (dict): Optional. Tables already built from the file. Built with `build_event_tables` if not given.
+    
+    Returns:
+    - bool: True if every upload succeeded, False otherwise.
+    """
+    if datalake_format not in DATALAKE_FORMATS:
+        raise ValueError(f"Unknown datalake_format {datalake_format!r}, expected one of {DATALAKE_FORMATS}")
+    uploaded = True
+    if datalake_format in ("json", "both"):
+        uploaded = send_file_to_minio(
+            file_path=file_path,
+            bucket="datalake",
+            prefix=f"{target_date_str}/",
+            object_name=f"{target_date_str}/{basename}",
+            client=client
+        )
+    if datalake_format in ("parquet", "both"):
+        from utils.parquet_utils import upload_parquet_tables
+        
+        if tables is None:
+            tables = build_event_tables(file_path)
+        uploaded = upload_parquet_tables(client, tables, "datalake", target_date_str, basename) and uploaded
+    return uploaded
+
+def list_objects_for_date(client, bucket_name, target_date_str, prefix_template=DEFAULT_SOURCE_PREFIX):
+    """
+    List the objects in `bucket_name` whose basename starts with `target_date_str`.
+    
+    Only the keys under `prefix_template` (formatted with the date) are listed, so the cost of a run does
+    not grow with the history kept in the bucket. Use a template without `{date}`, e.g. "data/", to scan
+    the whole prefix.
+    
+    Args:
+    - client (Minio): The MinIO client.
+    - bucket_name (str): The bucket to list.
+    - target_date_str (str): The date in the format "%Y-%m-%d".
+    - prefix_template (str): Optional. Listing prefix, where `{date}` is replaced by `target_date_str`. Defaults to "data/{date}".
     
-    bucket_name = "de-tech-assessment-2022"
-    prefix = "data/"
+    Returns:
+    - list: The matching `minio.datatypes.Object` items.
+    """
+    prefix = prefix_template.format(date=target_date_str)
     
-    # get list of all files in the bucket
-    result = list(client.list_objects(bucket_name, prefix=prefix, recursive=True))
+    # get list of the files under the prefix
+    result = client.list_objects(bucket_name, prefix=prefix, recursive=True)
     
-    target_date_str = target_date.strftime("%Y-%m-%d")
     # filter files that match the given date
-    keys_to_download = [
-        obj.object_name
+    return [
+        obj
         for obj in result
         if os.path.basename(obj.object_name).startswith(
             target_date_str
         )
     ]
+
+def list_objects_for_dates(client, bucket_name, date_strs, prefix_template=DEFAULT_SOURCE_PREFIX):
+    """
+    List the objects of several dates in a single listing, grouped by the date their basename starts with.
+    
+    The listing prefix is `prefix_template` formatted with the longest common prefix of the dates (e.g.
+    "data/2019-06-" for the days of June 2019), so the bucket is listed once for a whole range.
+    
+    Args:
+    - client (Minio): The MinIO client.
+    - bucket_name (str): The bucket to list.
+    - date_strs (list): The dates in the format "%Y-%m-%d".
+    - prefix_template (str): Optional. Listing prefix, where `{date}` is replaced by the common prefix of the dates. Defaults to "data/{date}".
+    
+    Returns:
+    - dict: The matching `minio.datatypes.Object` items of each date, in the order of `date_strs`.
+    """
+    prefix = prefix_template.format(date=os.path.commonprefix(list(date_strs)))
+    by_date = {date_str: [] for date_str in date_strs}
+    
+    for obj in client.list_objects(bucket_name, prefix=prefix, recursive=True):
+        date_str = os.path.basename(obj.object_name)[:10]
+        if date_str in by_date:
+            by_date[date_str].append(obj)
+    return by_date
+
+def fetch_and_validate_bucket(target_date, **context):
+    """
+    Fetches all files from the "de-tech-assessment-2022" bucket that match the given `target_date` and validates their schemas. 
+    If a schema is valid, the corresponding file is uploaded to the "datalake" bucket on MinIO, as raw JSON
+    and/or as Parquet files partitioned by date and event type depending on `datalake_format` in the DAG run config.
     
-    # loop, download and proceess each matching file
-    for key in keys_to_download:
-        with tempfile.NamedTemporaryFile(suffix=".json", delete=True) as tmp_file:
+    Files are downloaded, validated and uploaded concurrently by a `TransferPool`. With `in_memory` set in the
+    DAG run config, objects are processed from memory instead of temporary files (see `fetch_object`).
+    Files already validated with the same ETag and size are skipped (see `skip_processed`), and so are
+    the files the fused ingestion already imported and uploaded; their names are pushed to XCom as
+    `fused_objects` so that fetch_and_import_to_psql does not import them again. With
+    `validation_workers` set in the DAG run config, validation runs in a process pool and large NDJSON
+    files are sharded by byte ranges across the processes (see `validate_file_in_pool`).
+    
+    Args:
+    - target_date (str or datetime.datetime): The target date to match files against. If a string, it must be in the format "%Y-%m-%d".
+    - **context: Additional context that can be passed to the function.
+    
+    Returns:
+    - str: The target date in the format "%Y-%m-%d".
+    """
+    
+    correlation_id = generate_correlation_id(context['dag_run'].run_id)
+    logging.info(f"Running fetch_and_validate_bucket_data for {target_date=} and {correlation_id=}")
+    with Telemetry.from_context(context, correlation_id) as telemetry:
+        if type(target_date) is str:
+            target_date = parser.parse(target_date)
+
+        client = get_minio_client()
+    
+        bucket_name = "de-tech-assessment-2022"
+        target_date_str = target_date.strftime("%Y-%m-%d")
+        prefix_template = get_conf(context, "source_prefix", DEFAULT_SOURCE_PREFIX)
+        with telemetry.stage("list"):
+            objects = list_objects_for_date(client, bucket_name, target_date_str, prefix_template)
+        spool_max_size = spool_max_size_from_context(context)
+        datalake_format = get_conf(context, "datalake_format", "json")
+    
+        validation_workers = int(get_conf(context, "validation_workers", 0))
+        validation_chunk_size = int(get_conf(context, "validation_chunk_size", DEFAULT_VALIDATION_CHUNK_SIZE))
+        executor = None
+        if validation_workers > 1:
+            # worker processes read the files from disk, so in-memory transfers are disabled
+            executor = validation_executor(validation_workers)
+            spool_max_size = None
+            logging.info(f"Validating with {validation_workers} processes and {validation_chunk_size=}")
+    
+        def process(obj):
+            with telemetry.stage("download"):
+                source = fetch_object(client, bucket_name, obj.object_name, spool_max_size)
+            telemetry.count("files")
+            telemetry.count("bytes", obj.size or 0)
             try:
-                client.fget_object(bucket_name, key, tmp_file.name)
-            except Exception as err:
-                print(err)
-                sys.exit(1)
-                
-            basename = os.path.basename(key)
+                basename = os.path.basename(obj.object_name)
             
-            if valid_file(tmp_file.name):
-                send_file_to_minio(
-                    file_path=tmp_file.name,
-                    endpoint=endpoint,
-                    user=user,
-                    password=password,
-                    bucket="datalake",
-                    prefix=f"{target_date_str}/",
-                    object_name=f"{target_date_str}/{basename}"
-                )
+                if executor:
+                    # the parse and validate times of the workers are added to the task's telemetry
+                    valid = validate_file_in_pool(executor, source, validate_event, valid_file, validation_chunk_size, event_type)
+                else:
+                    valid = valid_file(source)
+                if not valid:
+                    telemetry.count("invalid_files")
+                    return False
+                with telemetry.stage("upload"):
+                    uploaded = upload_to_datalake(source, basename, target_date_str, datalake_format, client)
+                # a failed upload is left out of the manifest so the next run retries it
+                return True if uploaded else None
+            finally:
+                release_object(source)
+    
+        with PSQL_connect.from_context(context) as (connection, cursor):
+            objects_to_download = skip_processed(cursor, "validate", bucket_name, objects, context)
+            logging.info(f"{len(objects_to_download)} of {len(objects)} objects are new or changed")
+            # the files ingested by the fused ingestion, e.g. of door2door_microbatch, are left out of the import
+            fused_objects = [source_stem(obj.object_name) for obj in fused_processed(cursor, bucket_name, objects, context)]
+            context['ti'].xcom_push(key="fused_objects", value=fused_objects)
+        
+            # download, validate and upload the matching files concurrently
+            try:
+                with TransferPool.from_context(context) as pool:
+                    for obj, valid in pool.imap(process, objects_to_download):
+                        if valid is not None:
+                            record_processed(cursor, "validate", bucket_name, obj, valid, correlation_id)
+                            # a retry skips the files recorded so far
+                            connection.commit()
+                    pool.log_summary()
+            finally:
+                if executor:
+                    executor.shutdown()
                 
-    return target_date_str
\ No newline at end of file
+        return target_date_str
\ No newline at end of file
@@ -0,0 +1,280 @@
+import logging
+import os
+import time
+from dateutil import parser
+
+from utils.dedup_utils import EventDeduplicator
+from utils.json_utils import iter_json_file
+from utils.manifest_utils import skip_processed, record_processed
+from utils.minio_utils import get_minio_client, fetch_object, release_object, spool_max_size_from_context, TransferPool
+from utils.psql_utils import PSQL_connect, BulkLoader
+from utils.telemetry import Telemetry, get_telemetry
+from utils.trajectory_utils import TrajectoryCompressor
+from utils.utils import generate_correlation_id, get_conf
+from tasks.fetch_and_validate_bucket import validate_event, event_type, valid_file, upload_to_datalake, list_objects_for_date, DEFAULT_SOURCE_PREFIX
+from tasks.fetch_and_import_to_psql import event_to_row, DEFAULT_COPY_BATCH_SIZE
+
+def validate_and_import_file(file_path, correlation_id, cursor, loader, builder=None):
+    """
+    Validate a JSON file and load its events into PostgreSQL in a single pass.
+    
+    The rows are loaded inside a savepoint as the file is read. If any object fails its schema
+    the savepoint is rolled back, so nothing from an invalid file is kept, and the loader forgets
+    the file's events (see `BulkLoader.rollback`).
+    
+    Args:
+    - file_path (str or file object): Path to the JSON file, or a binary file object.
+    - correlation_id (str): Unique ID to correlate this process with others.
+    - cursor (psycopg2.extensions.cursor): Cursor to the PostgreSQL database.
+    - loader (BulkLoader): Loader used to stream the rows.
+    - builder (EventTableBuilder): Optional. Also receives the rows, to write the Parquet datalake files without parsing the file again.
+    
+    Returns:
+    - bool: True if every object in the file is valid, False otherwise.
+    """
+    telemetry = get_telemetry()
+    cursor.execute("SAVEPOINT validate_and_import_file")
+    state = loader.savepoint()
+    res = True
+    validate_time = 0.0
+    events = {}
+    invalid_events = 0
+    for obj in telemetry.timed_iter(iter_json_file(file_path), "parse"):
+        started_at = time.perf_counter()
+        valid = validate_event(obj)
+        validate_time += time.perf_counter() - started_at
+        events[event_type(obj)] = events.get(event_type(obj), 0) + 1
+        if not valid:
+            logging.warning(f"Invalid schema for {obj} in {file_path}")
+            invalid_events += 1
+            res = False
+        elif res:
+            mapped = event_to_row(obj, correlation_id)
+            if mapped:
+                loader.add(*mapped)
+                if builder is not None:
+                    builder.add(*mapped)
+    
+    if res:
+        loader.flush()
+        loader.release()
+        cursor.execute("RELEASE SAVEPOINT validate_and_import_file")
+    else:
+        loader.rollback(state)
+        cursor.execute("ROLLBACK TO SAVEPOINT validate_and_import_file")
+    
+    telemetry.add_time("validate", validate_time)
+    for type_, count in events.items():
+        telemetry.count("events", count, type=type_)
+    telemetry.count("invalid_events", invalid_events)
+    return res
+
+def fetch_validate_and_import(target_date, **context):
+    """
+    Fused alternative to `fetch_and_validate_bucket` followed by `fetch_and_import_to_psql`.
+    
+    Fetches all files from the "de-tech-assessment-2022" bucket that match the given `target_date`, then
+    validates and imports them into PostgreSQL while they are parsed. Valid files are also uploaded to
+    the "datalake" bucket (as JSON and/or Parquet, see `datalake_format`), so each file is downloaded and parsed only once. Downloads and uploads run
+    concurrently in a `TransferPool` while files are imported. Files already imported with the same ETag and
+    size are skipped (see `skip_processed`).
+    
+    Args:
+    - target_date (str or datetime.datetime): The target date to match files against. If a string, it must be in the format "%Y-%m-%d".
+    - **context: Additional context that can be passed to the function.
+    
+    Returns:
+    - str: The target date in the format "%Y-%m-%d".
+    """
+    
+    correlation_id = generate_correlation_id(context['dag_run'].run_id)
+    logging.info(f"Running fetch_validate_and_import for {target_date=} and {correlation_id=}")
+    with Telemetry.from_context(context, correlation_id) as telemetry:
+        if type(target_date) is str:
+            target_date = parser.parse(target_date)
+
+        client = get_minio_client()
+    
+        bucket_name = "de-tech-assessment-2022"
+        target_date_str = target_date.strftime("%Y-%m-%d")
+        prefix_template = get_conf(context, "source_prefix", DEFAULT_SOURCE_PREFIX)
+        with telemetry.stage("list"):
+            objects = list_objects_for_date(client, bucket_name, target_date_str, prefix_template)
+        
+        ingest_objects(objects, bucket_name, target_date_str, correlation_id, telemetry, context)
+                
+        return target_date_str
+
+def objects_to_ingest(cursor, bucket_name, objects, context):
+    """
+    Filters out the objects already imported and uploaded to the datalake.
+    
+    The import and the datalake upload of a file are recorded in `ingestion_manifest` under two
+    stages, "fused" and "upload", so a file imported by a run whose upload failed is uploaded again
+    by the next one.
+    
+    Args:
+    - cursor (psycopg2.extensions.cursor): Cursor to the PostgreSQL database.
+    - bucket_name (str): The bucket of the objects.
+    - objects (list): The `minio.datatypes.Object` items listed.
+    - context (dict): The Airflow task context.
+    
+    Returns:
+    - tuple: The objects still to import or to upload, and the set of names of the ones to import.
+    """
+    to_import = {obj.object_name for obj in skip_processed(cursor, "fused", bucket_name, objects, context)}
+    to_upload = {obj.object_name for obj in skip_processed(cursor, "upload", bucket_name, objects, context)}
+    return [obj for obj in objects if obj.object_name in to_import or obj.object_name in to_upload], to_import
+
+def ingest_objects(objects, bucket_name, target_date_str, correlation_id, telemetry, context):
+    """
+    Download, validate and import bucket objects, and upload the valid ones to the datalake.
+    
+    Shared by `fetch_validate_and_import` and the mapped `ingest_object_batch` tasks. Objects already
+    imported with the same ETag and size are skipped, so a retried task does not load a file twice.
+    
+    Args:
+    - objects (list): The `minio.datatypes.Object` items to ingest.
+    - bucket_name (str): The bucket of the objects.
+    - target_date_str (str): The date in the format "%Y-%m-%d".
+    - correlation_id (str): Unique ID to correlate this process with others.
+    - telemetry (Telemetry): The telemetry of the task.
+    - context (dict): The Airflow task context.
+    
+    Returns:
+    - dict: Number of `files` ingested, and how many of them were `valid` and `invalid`.
+    """
+    return ingest_days([(target_date_str, correlation_id, objects)], bucket_name, telemetry, context)
+
+def ingest_days(days, bucket_name, telemetry, context):
+    """
+    Download, validate and import the bucket objects of one or more days, and upload the valid ones to the datalake.
+    
+    All the days share one database connection, one `TransferPool` and one `BulkLoader`, and the
+    downloads of a day overlap with the import of the previous one. The rows of each day are tagged
+    with the correlation ID of that day. Every file is committed with its manifest entry, so a
+    retry resumes after the last committed file. The datalake uploads run in the background and are
+    recorded under their own "upload" manifest stage once they succeed; if any fails, the task fails
+    after the other files are committed, and its retry validates and uploads the missing files again
+    without importing them twice (see `objects_to_ingest`). With a `trajectory_tolerance` in the DAG run config,
+    the vehicle trajectories are simplified before they are loaded, while the datalake receives the
+    raw files (see `TrajectoryCompressor`).
+    
+    Args:
+    - days (list): `(target_date_str, correlation_id, objects)` tuples, one per day.
+    - bucket_name (str): The bucket of the objects.
+    - telemetry (Telemetry): The telemetry of the task.
+    - context (dict): The Airflow task context.
+    
+    Returns:
+    - dict: Number of `files` ingested, and how many of them were `valid` and `invalid`.
+    """
+    client = get_minio_client()
+    batch_size = int(get_conf(context, "copy_batch_size", DEFAULT_COPY_BATCH_SIZE))
+    spool_max_size = spool_max_size_from_context(context)
+    datalake_format = get_conf(context, "datalake_format", "json")
+    to_parquet = datalake_format in ("parquet", "both")
+    if to_parquet:
+        # pyarrow is only needed for the parquet datalake format
+        from utils.parquet_utils import EventTableBuilder
+    
+    # uploads finished in the background, recorded in the manifest by the main thread
+    uploaded, failed_uploads = [], []
+    
+    def upload(item):
+        obj, target_date_str, correlation_id, source, builder = item
+        try:
+            basename = os.path.basename(obj.object_name)
+            with telemetry.stage("upload"):
+                tables = builder.tables() if builder is not None else None
+                if upload_to_datalake(source, basename, target_date_str, datalake_format, client, tables=tables):
+                    uploaded.append((obj, correlation_id))
+                else:
+                    failed_uploads.append(obj)
+        finally:
+            release_object(source)
+    
+    def record_uploads(cursor):
+        while uploaded:
+            obj, correlation_id = uploaded.pop()
+            record_processed(cursor, "upload", bucket_name, obj, True, correlation_id)
+    
+    results = {"files": 0, "valid": 0, "invalid": 0}
+    # download concurrently, validate and import each file, then upload valid files in the background
+    with PSQL_connect.from_context(context) as (connection, cursor), TransferPool.from_context(context) as pool:
+        # skip the files already imported and uploaded with the same ETag and size, in one lookup for all the days
+        objects = [obj for _, _, day_objects in days for obj in day_objects]
+        objects_to_download, to_import = objects_to_ingest(cursor, bucket_name, objects, context)
+        logging.info(
+            f"{len(objects_to_download)} of {len(objects)} objects are new, changed or not uploaded, "
+            f"{len(to_import)} of them to import"
+        )
+        
+        day_of_object = {
+            obj.object_name: (target_date_str, correlation_id)
+            for target_date_str, correlation_id, day_objects in days
+            for obj in day_objects
+        }
+        loader = BulkLoader(
+            cursor,
+            batch_size=batch_size,
+            dedup=EventDeduplicator.from_context(context),
+            compressor=TrajectoryCompressor.from_context(context),
+        )
+        
+        def download(obj):
+            with telemetry.stage("download"):
+                return fetch_object(client, bucket_name, obj.object_name, spool_max_size)
+        
+        for obj, source in pool.imap(download, objects_to_download, release=release_object):
+            target_date_str, correlation_id = day_of_object[obj.object_name]
+            if obj.object_name not in to_import:
+                # imported by an earlier run whose upload failed: only validate and upload it
+                try:
+                    valid = valid_file(source)
+                except BaseException:
+                    release_object(source)
+                    raise
+                if valid:
+                    pool.submit(upload, (obj, target_date_str, correlation_id, source, None))
+                else:
+                    record_processed(cursor, "upload", bucket_name, obj, False, correlation_id)
+                    release_object(source)
+                record_uploads(cursor)
+                connection.commit()
+                continue
+            
+            telemetry.count("files")
+            telemetry.count("bytes", obj.size or 0)
+            builder = EventTableBuilder() if to_parquet else None
+            try:
+                valid = validate_and_import_file(source, correlation_id, cursor, loader, builder)
+            except BaseException:
+                release_object(source)
+                raise
+            record_processed(cursor, "fused", bucket_name, obj, valid, correlation_id)
+            if not valid:
+                # nothing to upload
+                record_processed(cursor, "upload", bucket_name, obj, False, correlation_id)
+            record_uploads(cursor)
+            # commit the file with its manifest entry, so a retry skips it
+            connection.commit()
+            results["files"] += 1
+            if valid:
+                results["valid"] += 1
+                pool.submit(upload, (obj, target_date_str, correlation_id, source, builder))
+            else:
+                results["invalid"] += 1
+                telemetry.count("invalid_files")
+                release_object(source)
+        
+        pool.join()
+        record_uploads(cursor)
+        connection.commit()
+        if failed_uploads:
+            telemetry.count("failed_uploads", len(failed_uploads))
+            # the imports are committed, the retry only uploads the files left out of the "upload" stage
+            raise RuntimeError(f"{len(failed_uploads)} datalake uploads failed: {[obj.object_name for obj in failed_uploads]}")
+        loader.log_throughput()
+        pool.log_summary()
+    return results
\ No newline at end of file
@@ -0,0 +1,24 @@
+import logging
+
+from utils.utils import generate_correlation_id
+
+def gather_ingestion_results(**context):
+    """
+    Reduces the results of the mapped `ingest_object_batch` tasks once they have all finished.
+    
+    Args:
+    - **context: Additional context that can be passed to the function.
+    
+    Returns:
+    - dict: Total number of `files` ingested, and how many of them were `valid` and `invalid`.
+    """
+    correlation_id = generate_correlation_id(context['dag_run'].run_id)
+    logging.info(f"Running gather_ingestion_results for {correlation_id=}")
+    
+    totals = {"files": 0, "valid": 0, "invalid": 0}
+    results = context['ti'].xcom_pull(task_ids='ingest_object_batch') or []
+    for result in results:
+        for key in totals:
+            totals[key] += (result or {}).get(key, 0)
+    logging.info(f"{len(results)} batches ingested {totals['files']} files: {totals['valid']} valid, {totals['invalid']} invalid")
+    return totals
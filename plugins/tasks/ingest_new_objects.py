@@ -0,0 +1,69 @@
+import logging
+from datetime import datetime, timedelta, timezone
+
+from utils.manifest_utils import read_watermark, advance_watermark
+from utils.minio_utils import get_minio_client
+from utils.psql_utils import PSQL_connect
+from utils.telemetry import Telemetry
+from utils.utils import generate_correlation_id, get_conf
+from tasks.fetch_and_validate_bucket import list_objects_for_date, DEFAULT_SOURCE_PREFIX
+from tasks.fetch_validate_and_import import ingest_days, objects_to_ingest
+
+DEFAULT_LOOKBACK_DAYS = 1
+DEFAULT_GRACE_MINUTES = 15
+
+def ingest_new_objects(**context):
+    """
+    Ingests the source objects added since the previous micro-batch.
+    
+    The dates from `microbatch_lookback_days` (from the DAG run config, default 1) days ago to today are
+    listed, and only the objects modified at or after the watermark of the source, less `microbatch_grace`
+    minutes (default 15), are kept: an object can become visible in the listing after objects modified
+    later than it, and the grace period lets the next batch still pick it up. The objects already ingested
+    are then dropped by the manifest (see `objects_to_ingest`), and the others validated and imported in
+    a single pass like in `fetch_validate_and_import`. Once they are committed, the watermark moves to the newest
+    `last_modified` of the batch (see `advance_watermark`), so the next batch lists past them.
+    
+    Args:
+    - **context: Additional context that can be passed to the function.
+    
+    Returns:
+    - dict: The number of `files` ingested, how many of them were `valid` and `invalid`, and the
+      `oldest_last_modified` of the new objects (ISO format, None if there were none), for
+      `record_microbatch_latency`.
+    """
+    correlation_id = generate_correlation_id(context['dag_run'].run_id)
+    logging.info(f"Running ingest_new_objects for {correlation_id=}")
+    with Telemetry.from_context(context, correlation_id) as telemetry:
+        client = get_minio_client()
+        
+        bucket_name = "de-tech-assessment-2022"
+        prefix_template = get_conf(context, "source_prefix", DEFAULT_SOURCE_PREFIX)
+        with PSQL_connect.from_context(context) as (connection, cursor):
+            watermark = read_watermark(cursor, bucket_name, prefix_template)
+        logging.info(f"Watermark of {bucket_name}/{prefix_template}: {watermark}")
+        
+        lookback_days = int(get_conf(context, "microbatch_lookback_days", DEFAULT_LOOKBACK_DAYS))
+        grace = timedelta(minutes=float(get_conf(context, "microbatch_grace", DEFAULT_GRACE_MINUTES)))
+        today = datetime.now(timezone.utc)
+        dates = [(today - timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(lookback_days, -1, -1)]
+        days = []
+        with telemetry.stage("list"):
+            for date_str in dates:
+                objects = list_objects_for_date(client, bucket_name, date_str, prefix_template)
+                recent_objects = [obj for obj in objects if watermark is None or obj.last_modified >= watermark - grace]
+                days.append((date_str, correlation_id, recent_objects))
+        with PSQL_connect.from_context(context) as (connection, cursor):
+            new_objects, _ = objects_to_ingest(cursor, bucket_name, [obj for _, _, objects in days for obj in objects], context)
+        new_names = {obj.object_name for obj in new_objects}
+        days = [(date_str, correlation_id, [obj for obj in objects if obj.object_name in new_names]) for date_str, correlation_id, objects in days]
+        logging.info(f"{len(new_objects)} new objects modified since the watermark, less {grace}")
+        
+        results = ingest_days(days, bucket_name, telemetry, context)
+        
+        oldest_last_modified = None
+        if new_objects:
+            with PSQL_connect.from_context(context) as (connection, cursor):
+                advance_watermark(cursor, bucket_name, prefix_template, max(obj.last_modified for obj in new_objects), correlation_id)
+            oldest_last_modified = min(obj.last_modified for obj in new_objects).isoformat()
+        return {**results, "oldest_last_modified": oldest_last_modified}
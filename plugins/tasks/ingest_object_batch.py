@@ -0,0 +1,32 @@
+import logging
+from minio.datatypes import Object
+
+from utils.telemetry import Telemetry
+from utils.utils import generate_correlation_id
+from tasks.fetch_validate_and_import import ingest_objects
+
+def ingest_object_batch(target_date, objects, **context):
+    """
+    Validates and imports one batch of source objects, and uploads the valid ones to the datalake.
+    
+    This is the mapped task of the "mapped" ingestion mode: one instance runs per batch returned by
+    `list_source_objects`, spread over the Airflow workers. Each file goes through the same single
+    pass as in `fetch_validate_and_import`.
+    
+    Args:
+    - target_date (str): The target date in the format "%Y-%m-%d".
+    - objects (list): The objects of the batch, as dicts of `object_name`, `etag` and `size`.
+    - **context: Additional context that can be passed to the function.
+    
+    Returns:
+    - dict: Number of `files` ingested, and how many of them were `valid` and `invalid`.
+    """
+    correlation_id = generate_correlation_id(context['dag_run'].run_id)
+    logging.info(f"Running ingest_object_batch for {target_date=}, {len(objects)} objects and {correlation_id=}")
+    with Telemetry.from_context(context, correlation_id) as telemetry:
+        bucket_name = "de-tech-assessment-2022"
+        batch = [
+            Object(bucket_name, item["object_name"], etag=item["etag"], size=item["size"])
+            for item in objects
+        ]
+        return ingest_objects(batch, bucket_name, target_date, correlation_id, telemetry, context)
@@ -0,0 +1,53 @@
+import logging
+from dateutil import parser
+
+from utils.minio_utils import get_minio_client
+from utils.psql_utils import PSQL_connect
+from utils.telemetry import Telemetry
+from utils.utils import generate_correlation_id, get_conf
+from tasks.fetch_and_validate_bucket import list_objects_for_date, DEFAULT_SOURCE_PREFIX
+from tasks.fetch_validate_and_import import objects_to_ingest
+
+DEFAULT_MAPPED_BATCH_SIZE = 10
+
+def list_source_objects(target_date, **context):
+    """
+    Lists the source objects of `target_date` once and splits them into batches for the mapped
+    `ingest_object_batch` tasks.
+    
+    Objects already imported and uploaded with the same ETag and size are left out (see `objects_to_ingest`). The
+    number of objects per batch is `batch_size` in the DAG run config. At least one batch is
+    returned, so the downstream tasks always run.
+    
+    Args:
+    - target_date (str or datetime.datetime): The target date to match files against. If a string, it must be in the format "%Y-%m-%d".
+    - **context: Additional context that can be passed to the function.
+    
+    Returns:
+    - list: One dict per batch, the keyword arguments of `ingest_object_batch`: the `target_date` and
+      the `objects` as dicts of `object_name`, `etag` and `size`.
+    """
+    correlation_id = generate_correlation_id(context['dag_run'].run_id)
+    logging.info(f"Running list_source_objects for {target_date=} and {correlation_id=}")
+    with Telemetry.from_context(context, correlation_id) as telemetry:
+        if type(target_date) is str:
+            target_date = parser.parse(target_date)
+        
+        bucket_name = "de-tech-assessment-2022"
+        target_date_str = target_date.strftime("%Y-%m-%d")
+        prefix_template = get_conf(context, "source_prefix", DEFAULT_SOURCE_PREFIX)
+        with telemetry.stage("list"):
+            objects = list_objects_for_date(get_minio_client(), bucket_name, target_date_str, prefix_template)
+        
+        with PSQL_connect.from_context(context) as (connection, cursor):
+            objects, _ = objects_to_ingest(cursor, bucket_name, objects, context)
+        telemetry.count("files", len(objects))
+        
+        batch_size = max(int(get_conf(context, "batch_size", DEFAULT_MAPPED_BATCH_SIZE)), 1)
+        items = [{"object_name": obj.object_name, "etag": obj.etag, "size": obj.size} for obj in objects]
+        batches = [
+            {"target_date": target_date_str, "objects": items[i:i + batch_size]}
+            for i in range(0, len(items), batch_size)
+        ] or [{"target_date": target_date_str, "objects": []}]
+        logging.info(f"{len(items)} objects to ingest in {len(batches)} batches of up to {batch_size}")
+        return batches
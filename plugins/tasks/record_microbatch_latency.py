@@ -0,0 +1,34 @@
+import logging
+from datetime import datetime, timezone
+from dateutil import parser
+
+from utils.telemetry import Telemetry
+from utils.utils import generate_correlation_id
+
+def record_microbatch_latency(**context):
+    """
+    Records the latency of a micro-batch once its operating periods and metrics are computed.
+    
+    The latency is the time from the upload of the oldest new object of the batch (its `last_modified`,
+    returned by `ingest_new_objects`) to now, so it covers the wait for the next batch and every stage
+    of the batch. It is published as the `batch_latency_seconds` gauge of the task's telemetry.
+    
+    Args:
+    - **context: Additional context that can be passed to the function.
+    
+    Returns:
+    - float: The latency in seconds, or None if the batch had no new objects.
+    """
+    correlation_id = generate_correlation_id(context['dag_run'].run_id)
+    logging.info(f"Running record_microbatch_latency for {correlation_id=}")
+    with Telemetry.from_context(context, correlation_id) as telemetry:
+        batch = context['ti'].xcom_pull(task_ids='ingest_new_objects') or {}
+        telemetry.gauge("batch_files", batch.get("files", 0))
+        if not batch.get("oldest_last_modified"):
+            logging.info("No new objects in this batch")
+            return None
+        
+        latency = (datetime.now(timezone.utc) - parser.isoparse(batch["oldest_last_modified"])).total_seconds()
+        telemetry.gauge("batch_latency_seconds", latency)
+        logging.info(f"Batch of {batch['files']} files processed {latency:.1f}s after the oldest one was uploaded")
+        return latency
@@ -0,0 +1,256 @@
+import logging
+
+from utils.psql_utils import PSQL_connect
+from utils.telemetry import Telemetry
+from utils.utils import generate_correlation_id, run_correlation_ids
+
+# The rollups are updated from the run's delta: only the buckets (vehicle and hour, vehicle and day,
+# operating period, organization and day) holding one of the run's rows are recomputed, each from all
+# the rows of the bucket whatever run loaded them. A rerun, or a run adding rows to a bucket of an
+# earlier run (e.g. a micro-batch), so leaves the rollups equal to a full recomputation. The segment of
+# an earlier update recomputed because it now follows one of the run's updates (see NEXT_SEGMENTS_QUERY)
+# is in a bucket holding one of the run's updates, or is the first update after the end of one.
+
+# Recomputes the hours of each vehicle holding one of the run's updates, and the hour of the update
+# following each of them. The distance of a segment counts in the hour of the update that ends it.
+VEHICLE_ACTIVITY_HOURLY_QUERY = """
+    WITH run_hours AS (
+        SELECT DISTINCT vehicle_id, date_trunc('hour', location_time, 'UTC') AS hour
+        FROM vehicle_update
+        WHERE correlation_id = ANY(%(correlation_ids)s)
+    ),
+    touched AS (
+        SELECT vehicle_id, hour FROM run_hours
+        UNION
+        SELECT r.vehicle_id, date_trunc('hour', n.location_time, 'UTC')
+        FROM
+            run_hours r
+            CROSS JOIN LATERAL (
+                SELECT location_time
+                FROM vehicle_update n
+                WHERE n.vehicle_id = r.vehicle_id AND n.location_time >= r.hour + interval '1 hour'
+                ORDER BY n.location_time
+                LIMIT 1
+            ) n
+    )
+    INSERT INTO vehicle_activity_hourly (organization_id, vehicle_id, hour, updates, distance, correlation_id)
+    SELECT
+        u.organization_id,
+        t.vehicle_id,
+        t.hour,
+        count(*) AS updates,
+        coalesce(sum(s.distance), 0) AS distance,
+        %(correlation_id)s
+    FROM
+        touched t
+        JOIN vehicle_update u
+            ON u.vehicle_id = t.vehicle_id AND u.location_time >= t.hour AND u.location_time < t.hour + interval '1 hour'
+        LEFT JOIN vehicle_update_segment s ON s.update_uid = u.uid
+    GROUP BY
+        u.organization_id, t.vehicle_id, t.hour
+    ON CONFLICT (vehicle_id, hour, organization_id) DO UPDATE SET
+        updates = EXCLUDED.updates,
+        distance = EXCLUDED.distance,
+        correlation_id = EXCLUDED.correlation_id;
+"""
+
+# Recomputes the days of each vehicle holding one of the run's updates, and the day of the update
+# following each of them, from the hourly rollup
+VEHICLE_ACTIVITY_DAILY_QUERY = """
+    WITH run_days AS (
+        SELECT DISTINCT vehicle_id, (location_time AT TIME ZONE 'UTC')::date AS day
+        FROM vehicle_update
+        WHERE correlation_id = ANY(%(correlation_ids)s)
+    ),
+    touched AS (
+        SELECT vehicle_id, day FROM run_days
+        UNION
+        SELECT r.vehicle_id, (n.location_time AT TIME ZONE 'UTC')::date
+        FROM
+            run_days r
+            CROSS JOIN LATERAL (
+                SELECT location_time
+                FROM vehicle_update n
+                WHERE n.vehicle_id = r.vehicle_id AND n.location_time >= (r.day + 1)::timestamp AT TIME ZONE 'UTC'
+                ORDER BY n.location_time
+                LIMIT 1
+            ) n
+    )
+    INSERT INTO vehicle_activity_daily (organization_id, day, vehicle_id, updates, distance, active_hours, correlation_id)
+    SELECT
+        h.organization_id,
+        t.day,
+        t.vehicle_id,
+        sum(h.updates) AS updates,
+        sum(h.distance) AS distance,
+        count(*) AS active_hours,
+        %(correlation_id)s
+    FROM
+        touched t
+        JOIN vehicle_activity_hourly h
+            ON h.vehicle_id = t.vehicle_id
+            AND h.hour >= t.day::timestamp AT TIME ZONE 'UTC'
+            AND h.hour < (t.day + 1)::timestamp AT TIME ZONE 'UTC'
+    GROUP BY
+        h.organization_id, t.day, t.vehicle_id
+    ON CONFLICT (organization_id, day, vehicle_id) DO UPDATE SET
+        updates = EXCLUDED.updates,
+        distance = EXCLUDED.distance,
+        active_hours = EXCLUDED.active_hours,
+        correlation_id = EXCLUDED.correlation_id
+    RETURNING organization_id, day;
+"""
+
+# Recomputes the run's vehicle operating periods, and the earlier ones that the run's updates, or the
+# update following them, fall in
+OPERATING_PERIOD_UTILISATION_QUERY = """
+    WITH run_updates AS (
+        SELECT vehicle_id, min(location_time) AS first_time, max(location_time) AS last_update_time
+        FROM vehicle_update
+        WHERE correlation_id = ANY(%(correlation_ids)s)
+        GROUP BY vehicle_id
+    ),
+    run_spans AS (
+        SELECT r.vehicle_id, r.first_time, coalesce(n.location_time, r.last_update_time) AS last_time
+        FROM
+            run_updates r
+            LEFT JOIN LATERAL (
+                SELECT location_time
+                FROM vehicle_update n
+                WHERE n.vehicle_id = r.vehicle_id AND n.location_time > r.last_update_time
+                ORDER BY n.location_time
+                LIMIT 1
+            ) n ON true
+    ),
+    touched AS (
+        SELECT operating_period_id
+        FROM operating_period
+        WHERE correlation_id = ANY(%(correlation_ids)s) AND vehicle_id IS NOT NULL
+        UNION
+        SELECT o.operating_period_id
+        FROM
+            run_spans r
+            JOIN operating_period o
+                ON o.vehicle_id = r.vehicle_id AND o.start <= r.last_time AND o.finish >= r.first_time
+    )
+    INSERT INTO operating_period_utilisation (
+        operating_period_id, organization_id, vehicle_id, day, start, finish,
+        operating_seconds, distance_travelled, updates, correlation_id
+    )
+    SELECT
+        o.operating_period_id,
+        o.organization_id,
+        o.vehicle_id,
+        (o.start AT TIME ZONE 'UTC')::date AS day,
+        o.start,
+        o.finish,
+        extract(epoch FROM o.finish - o.start) AS operating_seconds,
+        m.distance_travelled,
+        u.updates,
+        o.correlation_id
+    FROM
+        touched t
+        JOIN operating_period o ON o.operating_period_id = t.operating_period_id
+        LEFT JOIN operating_period_metrics m ON m.operating_period = o.operating_period_id
+        CROSS JOIN LATERAL (
+            SELECT count(*) AS updates
+            FROM vehicle_update u
+            WHERE u.vehicle_id = o.vehicle_id AND u.location_time BETWEEN o.start AND o.finish
+        ) u
+    ON CONFLICT (operating_period_id) DO UPDATE SET
+        organization_id = EXCLUDED.organization_id,
+        day = EXCLUDED.day,
+        start = EXCLUDED.start,
+        finish = EXCLUDED.finish,
+        operating_seconds = EXCLUDED.operating_seconds,
+        distance_travelled = EXCLUDED.distance_travelled,
+        updates = EXCLUDED.updates,
+        correlation_id = EXCLUDED.correlation_id
+    RETURNING organization_id, day;
+"""
+
+# Recomputes the days of each organization returned by the two queries above
+ORGANIZATION_ACTIVITY_DAILY_QUERY = """
+    INSERT INTO organization_activity_daily (
+        organization_id, day, active_vehicles, updates, distance, operating_periods, operating_seconds, correlation_id
+    )
+    SELECT
+        t.organization_id,
+        t.day,
+        v.active_vehicles,
+        coalesce(v.updates, 0),
+        coalesce(v.distance, 0),
+        p.operating_periods,
+        coalesce(p.operating_seconds, 0),
+        %(correlation_id)s
+    FROM
+        unnest(%(organization_ids)s::text[], %(days)s::date[]) AS t (organization_id, day)
+        CROSS JOIN LATERAL (
+            SELECT count(*) AS active_vehicles, sum(updates) AS updates, sum(distance) AS distance
+            FROM vehicle_activity_daily d
+            WHERE d.organization_id = t.organization_id AND d.day = t.day
+        ) v
+        CROSS JOIN LATERAL (
+            SELECT count(*) AS operating_periods, sum(operating_seconds) AS operating_seconds
+            FROM operating_period_utilisation p
+            WHERE p.organization_id = t.organization_id AND p.day = t.day
+        ) p
+    ON CONFLICT (organization_id, day) DO UPDATE SET
+        active_vehicles = EXCLUDED.active_vehicles,
+        updates = EXCLUDED.updates,
+        distance = EXCLUDED.distance,
+        operating_periods = EXCLUDED.operating_periods,
+        operating_seconds = EXCLUDED.operating_seconds,
+        correlation_id = EXCLUDED.correlation_id;
+"""
+
+
+def update_rollups(**context):
+    """
+    Updates the rollup tables queried by BI dashboards from the run's rows.
+
+    The rollups are `vehicle_activity_hourly` and `vehicle_activity_daily` (updates and distance per
+    vehicle and UTC hour or day), `operating_period_utilisation` (duration, distance and updates per
+    vehicle operating period) and `organization_activity_daily` (active vehicles, distance and time in
+    operation per organization and UTC day). Instead of recomputing them from scratch, only the buckets
+    holding one of the run's rows are recomputed, so the work grows with the run rather than with the
+    history. `benchmarks/check_rollup_consistency.py` compares them with a full recomputation.
+
+    The distances come from `vehicle_update_segment`, stored by calculate_operating_periods_metrics
+    with either metrics engine.
+
+    Args:
+    - **context: Additional context that can be passed to the function.
+
+    Returns:
+    - None
+    """
+    correlation_id = generate_correlation_id(context['dag_run'].run_id)
+    logging.info(f"Running update_rollups for {correlation_id=}")
+
+    params = {
+        "correlation_id": correlation_id,
+        "correlation_ids": run_correlation_ids(context),
+    }
+
+    with Telemetry.from_context(context, correlation_id) as telemetry, PSQL_connect.from_context(context) as (connect, cursor):
+        with telemetry.stage("compute"):
+            cursor.execute(VEHICLE_ACTIVITY_HOURLY_QUERY, params)
+            telemetry.count("vehicle_hours", cursor.rowcount)
+
+            cursor.execute(VEHICLE_ACTIVITY_DAILY_QUERY, params)
+            telemetry.count("vehicle_days", cursor.rowcount)
+            organization_days = set(cursor.fetchall())
+
+            cursor.execute(OPERATING_PERIOD_UTILISATION_QUERY, params)
+            telemetry.count("operating_periods", cursor.rowcount)
+            organization_days.update(cursor.fetchall())
+
+            cursor.execute(ORGANIZATION_ACTIVITY_DAILY_QUERY, {
+                **params,
+                "organization_ids": [organization_id for organization_id, _ in organization_days],
+                "days": [day for _, day in organization_days],
+            })
+            telemetry.count("organization_days", cursor.rowcount)
+
+        logging.info(f"Updated the rollups of {len(organization_days)} organization days")
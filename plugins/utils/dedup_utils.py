@@ -0,0 +1,103 @@
+import hashlib
+
+from utils.utils import get_conf
+
+# Columns identifying an event, backed by a unique index on each table. Redelivered events and
+# overlapping files repeat these values and are loaded once.
+EVENT_KEYS = {
+    "vehicle_update": ("vehicle_id", "location_time", "latitude", "longitude"),
+    "vehicle_registration": ("vehicle_id", "event", "event_time"),
+    "operating_period": ("operating_period_id", "event"),
+}
+
+DEFAULT_DEDUP_MAX_KEYS = 500000
+
+
+class EventDeduplicator:
+    """
+    Drops events already seen in the run before they are sent to the database.
+
+    The keys of `EVENT_KEYS` are kept as 128-bit digests in two generations of at most
+    `max_keys / 2` digests each: when the current generation is full, the previous one is
+    dropped. The memory use is bounded whatever the size of the run, and recent keys, where
+    redeliveries and overlapping files concentrate, are remembered. Duplicates of older keys
+    are still dropped by the unique indexes when the rows are loaded (see `BulkLoader`).
+
+    The keys added since `savepoint` can be forgotten with `rollback`, for rows that are
+    discarded before being committed.
+
+    Args:
+        max_keys (int): Maximum number of digests kept. Default is 500000 (about 50 MB).
+
+    Example:
+        dedup = EventDeduplicator(max_keys=100000)
+        if not dedup.seen("vehicle_update", columns, row):
+            ...
+    """
+
+    def __init__(self, max_keys=DEFAULT_DEDUP_MAX_KEYS):
+        self.generation_size = max(1, int(max_keys) // 2)
+        self.current = set()
+        self.previous = set()
+        self.key_indexes = {}
+        self.journal = None
+
+    @classmethod
+    def from_context(cls, context):
+        """
+        Creates a deduplicator sized from the `dedup_max_keys` value of the DAG run config.
+
+        Args:
+            context (dict): The context dictionary provided by Airflow.
+
+        Returns:
+            EventDeduplicator or None: The new deduplicator, or None when `dedup_max_keys` is 0,
+            in which case only the unique indexes drop duplicates.
+        """
+        max_keys = int(get_conf(context, "dedup_max_keys", DEFAULT_DEDUP_MAX_KEYS))
+        return cls(max_keys) if max_keys > 0 else None
+
+    def seen(self, table, columns, row):
+        """
+        Checks whether an event was already seen, remembering it otherwise.
+
+        Args:
+            table (str): Name of the target table.
+            columns (tuple): Column names matching the values in `row`.
+            row (tuple): The values of the event.
+
+        Returns:
+            bool: True if the event is a duplicate. Always False for tables without an event key.
+        """
+        indexes = self.key_indexes.get((table, columns))
+        if indexes is None:
+            key_columns = EVENT_KEYS.get(table, ())
+            indexes = tuple(columns.index(column) for column in key_columns if column in columns)
+            self.key_indexes[(table, columns)] = indexes
+        if not indexes:
+            return False
+        
+        digest = hashlib.blake2b(repr((table,) + tuple(row[i] for i in indexes)).encode(), digest_size=16).digest()
+        if digest in self.current or digest in self.previous:
+            return True
+        if len(self.current) >= self.generation_size:
+            self.previous, self.current = self.current, set()
+        self.current.add(digest)
+        if self.journal is not None:
+            self.journal.append(digest)
+        return False
+
+    def savepoint(self):
+        """Starts recording the keys added, so that `rollback` can forget them."""
+        self.journal = []
+
+    def rollback(self):
+        """Forgets the keys added since `savepoint`."""
+        for digest in self.journal or ():
+            self.current.discard(digest)
+            self.previous.discard(digest)
+        self.journal = None
+
+    def release(self):
+        """Keeps the keys added since `savepoint` and stops recording."""
+        self.journal = None
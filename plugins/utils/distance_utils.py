@@ -0,0 +1,83 @@
+import numpy as np
+
+# Mean Earth radius (IUGG), in meters
+EARTH_RADIUS = 6371008.8
+
+# Maximum relative difference between the haversine distance on the mean-radius sphere and the
+# WGS84 spheroid distance computed by PostGIS for geography values. On short segments the sphere is
+# at most ~0.56% off (north-south near the equator), less at mid latitudes.
+DISTANCE_TOLERANCE = 0.006
+
+
+def haversine(longitude1, latitude1, longitude2, latitude2):
+    """
+    Great-circle distance between two arrays of points, in meters.
+
+    Args:
+        longitude1, latitude1 (numpy.ndarray): Coordinates of the first points, in degrees.
+        longitude2, latitude2 (numpy.ndarray): Coordinates of the second points, in degrees.
+
+    Returns:
+        numpy.ndarray: The distances. NaN where a coordinate is NaN.
+    """
+    longitude1, latitude1, longitude2, latitude2 = map(np.radians, (longitude1, latitude1, longitude2, latitude2))
+    a = (
+        np.sin((latitude2 - latitude1) / 2) ** 2
+        + np.cos(latitude1) * np.cos(latitude2) * np.sin((longitude2 - longitude1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def segment_distances(vehicles, longitudes, latitudes):
+    """
+    Distance from each point to the previous point of the same vehicle.
+
+    Args:
+        vehicles (numpy.ndarray): Vehicle codes, the points being sorted by vehicle and time.
+        longitudes, latitudes (numpy.ndarray): Coordinates of the points, in degrees.
+
+    Returns:
+        numpy.ndarray: The distances. NaN for the first point of each vehicle.
+    """
+    distances = np.full(len(vehicles), np.nan)
+    if len(vehicles) > 1:
+        distances[1:] = haversine(longitudes[:-1], latitudes[:-1], longitudes[1:], latitudes[1:])
+        distances[1:][vehicles[1:] != vehicles[:-1]] = np.nan
+    return distances
+
+
+def period_sums(vehicles, times, distances, period_vehicles, period_starts, period_finishes):
+    """
+    Sums the segment distances of each period.
+
+    A segment belongs to a period when its vehicle matches and its time is between the start and
+    the finish of the period, both included. The lookup is a binary search over the cumulative
+    sum of the distances, so the cost is O((n + p) log(n + p)) for n segments and p periods.
+
+    Args:
+        vehicles (numpy.ndarray): Vehicle codes of the segments.
+        times (numpy.ndarray): Times of the segments, as int64 or float.
+        distances (numpy.ndarray): Distances of the segments, NaN for the unknown ones.
+        period_vehicles (numpy.ndarray): Vehicle codes of the periods.
+        period_starts, period_finishes (numpy.ndarray): Bounds of the periods, same unit as `times`.
+
+    Returns:
+        tuple: The sum of the known distances of each period and how many were known.
+    """
+    # Rank the times so that (vehicle, time) fits a single int64 key
+    ranks = np.unique(np.concatenate([times, period_starts, period_finishes]))
+    width = len(ranks) + 1
+    keys = vehicles.astype(np.int64) * width + np.searchsorted(ranks, times)
+    starts = period_vehicles.astype(np.int64) * width + np.searchsorted(ranks, period_starts)
+    finishes = period_vehicles.astype(np.int64) * width + np.searchsorted(ranks, period_finishes)
+
+    order = np.argsort(keys, kind="stable")
+    keys, distances = keys[order], distances[order]
+
+    known = ~np.isnan(distances)
+    cumulative_distance = np.concatenate([[0.0], np.cumsum(np.where(known, distances, 0.0))])
+    cumulative_known = np.concatenate([[0], np.cumsum(known)])
+
+    low = np.searchsorted(keys, starts, side="left")
+    high = np.searchsorted(keys, finishes, side="right")
+    return cumulative_distance[high] - cumulative_distance[low], cumulative_known[high] - cumulative_known[low]
@@ -1,13 +1,130 @@
+import io
 import json
-from typing import List
+from typing import BinaryIO, Iterator, List, TextIO, Union
 import logging
 import jsonschema
 
 
+READ_CHUNK_SIZE = 1 << 16
+
+
+def iter_json_stream(stream: TextIO) -> Iterator[dict]:
+    """
+    Lazily yields the JSON objects contained in a text stream.
+
+    The layout is detected from the first line: if it holds a complete JSON document the
+    stream is read line by line as newline-delimited JSON, otherwise an incremental decoder
+    walks arrays, single objects and concatenated (optionally comma-separated) objects
+    without ever holding more than one object plus a read chunk in memory.
+
+    Args:
+        stream (TextIO): An open text stream positioned at the start of the data.
+
+    Yields:
+        dict: The next JSON object from the stream.
+
+    Raises:
+        json.JSONDecodeError: If the stream is not valid JSON.
+    """
+    
+    first_line = stream.readline()
+    while first_line and not first_line.strip():
+        first_line = stream.readline()
+    if not first_line:
+        return
+
+    head = first_line.lstrip()
+    if not head.startswith("["):
+        try:
+            first_obj = json.loads(first_line)
+        except json.JSONDecodeError:
+            first_obj = None
+        if first_obj is not None:
+            # Newline-delimited JSON: one document per line
+            yield first_obj
+            for line in stream:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+    yield from _iter_json_decoder(first_line, stream)
+
+
+def _iter_json_decoder(buffer: str, stream: TextIO) -> Iterator[dict]:
+    """
+    Incrementally decodes top-level JSON values from `buffer` followed by the rest of `stream`.
+
+    Top-level array brackets and commas are treated as separators, so the elements of an
+    array are yielded one by one.
+    """
+    
+    decoder = json.JSONDecoder()
+    pos = 0
+    eof = False
+    read_size = READ_CHUNK_SIZE
+    while True:
+        # skip separators between top-level values
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,[]":
+            pos += 1
+        if pos >= len(buffer):
+            if eof:
+                return
+            buffer = stream.read(read_size)
+            pos = 0
+            eof = not buffer
+            continue
+        try:
+            obj, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # the value may be cut by the chunk boundary: read more and retry
+            chunk = stream.read(read_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            read_size *= 2
+            continue
+        yield obj
+        pos = end
+        read_size = READ_CHUNK_SIZE
+
+
+def iter_json_file(file_path: Union[str, BinaryIO]) -> Iterator[dict]:
+    """
+    Lazily yields the JSON objects of a file.
+
+    Args:
+        file_path (Union[str, BinaryIO]): Path to the JSON file to read, or a binary file object
+            (e.g. an in-memory buffer) positioned at the start of the data. File objects are left open.
+
+    Yields:
+        dict: The next JSON object from the file.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+        json.JSONDecodeError: If the file is not valid JSON.
+    """
+    
+    if isinstance(file_path, str):
+        with open(file_path, "r") as f:
+            yield from iter_json_stream(f)
+        return
+
+    f = io.TextIOWrapper(file_path, encoding="utf-8")
+    try:
+        yield from iter_json_stream(f)
+    finally:
+        # hand the buffer back to the caller instead of closing it with the wrapper
+        f.detach()
+
+
 def read_json_file(file_path: str) -> List[dict]:
     """
     Reads a JSON file and returns a list of JSON objects.
 
+    Prefer `iter_json_file` for large files, as this materialises every object in memory.
+
     Args:
         file_path (str): Path to the JSON file to read.
 
@@ -19,26 +136,7 @@ def read_json_file(file_path: str) -> List[dict]:
         json.JSONDecodeError: If the file is not valid JSON.
     """
     
-    with open(file_path, "r") as f:
-        file_contents = f.read()
-
-    # Check if the file contains a single JSON object
-    try:
-        single_json = json.loads(file_contents)
-        return [single_json]
-    except json.JSONDecodeError:
-        pass
-
-    # Check if the file contains an array of JSON objects
-    try:
-        array_json = json.loads(f"[{file_contents}]")
-        return array_json
-    except json.JSONDecodeError:
-        pass
-
-    # Otherwise, assume that the file contains multiple JSON objects with no array or comma separation
-    lines = file_contents.strip().split("\n")
-    return [json.loads(line) for line in lines]
+    return list(iter_json_file(file_path))
 
 
 def validate_jsonschema(instance, schema=None, validator=None):
@@ -79,4 +177,4 @@ def validate_jsonschema(instance, schema=None, validator=None):
         jsonschema.exceptions.ValidationError,
         jsonschema.exceptions.SchemaError,
     ) as e:
-        return False
+        return False
\ No newline at end of file
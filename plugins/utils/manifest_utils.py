@@ -0,0 +1,224 @@
+from utils.utils import get_conf
+
+# The fused ingestion, of the daily DAG or of door2door_microbatch, validates, imports and uploads a
+# file in one pass and records it under these two stages
+FUSED_STAGES = ("fused", "upload")
+
+
+def skip_processed(cursor, stage, bucket, objects, context=None):
+    """
+    Filters out the objects already processed by `stage` with the same ETag and size.
+
+    The `ingestion_manifest` table is looked up only for the given object names, so the
+    cost depends on the number of listed objects and not on the size of the manifest.
+    Setting `full_refresh` in the DAG run config disables the filter. For the "validate"
+    stage of the split ingestion, the objects done by the fused ingestion are filtered
+    out too (see `fused_processed`).
+
+    Args:
+        cursor (psycopg2.extensions.cursor): Cursor to the PostgreSQL database.
+        stage (str): Name of the processing stage, e.g. "validate" or "import".
+        bucket (str): The bucket the objects were listed from.
+        objects (list): `minio.datatypes.Object` items from `list_objects`.
+        context (dict): Optional. The context dictionary provided by Airflow.
+
+    Returns:
+        list: The objects that are new or changed since they were processed.
+    """
+    if not objects or (context and get_conf(context, "full_refresh", False)):
+        return list(objects)
+    cursor.execute(
+        """
+        SELECT object_name, etag, size
+        FROM ingestion_manifest
+        WHERE stage = %s AND bucket = %s AND object_name = ANY(%s)
+        """,
+        (stage, bucket, [obj.object_name for obj in objects]),
+    )
+    processed = {object_name: (etag, size) for object_name, etag, size in cursor.fetchall()}
+    if stage == "validate":
+        processed.update((obj.object_name, (obj.etag, obj.size)) for obj in fused_processed(cursor, bucket, objects))
+    return [obj for obj in objects if processed.get(obj.object_name) != (obj.etag, obj.size)]
+
+
+def fused_processed(cursor, bucket, objects, context=None):
+    """
+    Returns the objects the fused ingestion already imported and uploaded to the datalake with the
+    same ETag and size, i.e. the ones with matching entries for both `FUSED_STAGES`.
+
+    Setting `full_refresh` in the DAG run config returns none of them.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): Cursor to the PostgreSQL database.
+        bucket (str): The bucket the objects were listed from.
+        objects (list): `minio.datatypes.Object` items from `list_objects`.
+        context (dict): Optional. The context dictionary provided by Airflow.
+
+    Returns:
+        list: The objects done by the fused ingestion.
+    """
+    if not objects or (context and get_conf(context, "full_refresh", False)):
+        return []
+    cursor.execute(
+        """
+        SELECT stage, object_name, etag, size
+        FROM ingestion_manifest
+        WHERE stage = ANY(%s) AND bucket = %s AND object_name = ANY(%s)
+        """,
+        (list(FUSED_STAGES), bucket, [obj.object_name for obj in objects]),
+    )
+    processed = {(stage, object_name): (etag, size) for stage, object_name, etag, size in cursor.fetchall()}
+    return [
+        obj for obj in objects
+        if all(processed.get((stage, obj.object_name)) == (obj.etag, obj.size) for stage in FUSED_STAGES)
+    ]
+
+
+def record_processed(cursor, stage, bucket, obj, valid, correlation_id):
+    """
+    Records in `ingestion_manifest` that `stage` processed an object, and drops its checkpoint
+    (see `save_checkpoint`).
+
+    Args:
+        cursor (psycopg2.extensions.cursor): Cursor to the PostgreSQL database.
+        stage (str): Name of the processing stage.
+        bucket (str): The bucket of the object.
+        obj (minio.datatypes.Object): The processed object.
+        valid (bool): Whether the object passed the stage.
+        correlation_id (str): Unique ID to correlate this process with others.
+
+    Returns:
+        None
+    """
+    cursor.execute(
+        """
+        INSERT INTO ingestion_manifest (stage, bucket, object_name, etag, size, valid, correlation_id)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (stage, bucket, object_name) DO UPDATE SET
+            etag = EXCLUDED.etag,
+            size = EXCLUDED.size,
+            valid = EXCLUDED.valid,
+            correlation_id = EXCLUDED.correlation_id,
+            processed_at = now()
+        """,
+        (stage, bucket, obj.object_name, obj.etag, obj.size, valid, correlation_id),
+    )
+    cursor.execute(
+        "DELETE FROM ingestion_checkpoint WHERE stage = %s AND bucket = %s AND object_name = %s",
+        (stage, bucket, obj.object_name),
+    )
+
+
+def load_checkpoints(cursor, stage, bucket, objects, context=None):
+    """
+    Looks up how many events of each object `stage` already committed before a previous attempt failed.
+
+    Only checkpoints saved for the same ETag and size are returned, so a changed object is loaded
+    from the start. Setting `full_refresh` in the DAG run config ignores the checkpoints.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): Cursor to the PostgreSQL database.
+        stage (str): Name of the processing stage, e.g. "import".
+        bucket (str): The bucket the objects were listed from.
+        objects (list): `minio.datatypes.Object` items from `list_objects`.
+        context (dict): Optional. The context dictionary provided by Airflow.
+
+    Returns:
+        dict: Number of committed events per object name, for the objects with a checkpoint.
+    """
+    if not objects or (context and get_conf(context, "full_refresh", False)):
+        return {}
+    cursor.execute(
+        """
+        SELECT object_name, etag, size, events_committed
+        FROM ingestion_checkpoint
+        WHERE stage = %s AND bucket = %s AND object_name = ANY(%s)
+        """,
+        (stage, bucket, [obj.object_name for obj in objects]),
+    )
+    saved = {object_name: (etag, size, events) for object_name, etag, size, events in cursor.fetchall()}
+    return {
+        obj.object_name: saved[obj.object_name][2]
+        for obj in objects
+        if obj.object_name in saved and saved[obj.object_name][:2] == (obj.etag, obj.size)
+    }
+
+
+def save_checkpoint(cursor, stage, bucket, obj, events_committed, correlation_id):
+    """
+    Records that the first `events_committed` events of an object are loaded.
+
+    Call it in the transaction that loads those events, so that the rows and the checkpoint are
+    committed together and a retry resumes right after them.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): Cursor to the PostgreSQL database.
+        stage (str): Name of the processing stage.
+        bucket (str): The bucket of the object.
+        obj (minio.datatypes.Object): The object being loaded.
+        events_committed (int): Number of events of the object loaded so far, in file order.
+        correlation_id (str): Unique ID to correlate this process with others.
+
+    Returns:
+        None
+    """
+    cursor.execute(
+        """
+        INSERT INTO ingestion_checkpoint (stage, bucket, object_name, etag, size, events_committed, correlation_id)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (stage, bucket, object_name) DO UPDATE SET
+            etag = EXCLUDED.etag,
+            size = EXCLUDED.size,
+            events_committed = EXCLUDED.events_committed,
+            correlation_id = EXCLUDED.correlation_id,
+            updated_at = now()
+        """,
+        (stage, bucket, obj.object_name, obj.etag, obj.size, events_committed, correlation_id),
+    )
+
+
+def read_watermark(cursor, bucket, prefix):
+    """
+    Reads the watermark of a source: the newest `last_modified` of the objects ingested from it.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): Cursor to the PostgreSQL database.
+        bucket (str): The bucket of the source.
+        prefix (str): The prefix of the source in the bucket.
+
+    Returns:
+        datetime.datetime or None: The watermark, or None if nothing was ingested from the source yet.
+    """
+    cursor.execute(
+        "SELECT last_modified FROM ingestion_watermark WHERE bucket = %s AND prefix = %s",
+        (bucket, prefix),
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def advance_watermark(cursor, bucket, prefix, last_modified, correlation_id):
+    """
+    Moves the watermark of a source forward to `last_modified`. It never moves back.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): Cursor to the PostgreSQL database.
+        bucket (str): The bucket of the source.
+        prefix (str): The prefix of the source in the bucket.
+        last_modified (datetime.datetime): The newest `last_modified` of the objects just ingested.
+        correlation_id (str): Unique ID to correlate this process with others.
+
+    Returns:
+        None
+    """
+    cursor.execute(
+        """
+        INSERT INTO ingestion_watermark (bucket, prefix, last_modified, correlation_id)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (bucket, prefix) DO UPDATE SET
+            last_modified = GREATEST(ingestion_watermark.last_modified, EXCLUDED.last_modified),
+            correlation_id = EXCLUDED.correlation_id,
+            updated_at = now()
+        """,
+        (bucket, prefix, last_modified, correlation_id),
+    )
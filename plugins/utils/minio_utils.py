@@ -0,0 +1,285 @@
+import io
+import os
+import time
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from minio import Minio
+
+from utils.utils import get_conf
+
+DEFAULT_TRANSFER_WORKERS = 4
+DEFAULT_SPOOL_MAX_SIZE = 64 * 1024 * 1024
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_minio_client():
+    """
+    Returns the MinIO client shared by every task and thread of this process.
+
+    The client is created on first use from the `MINIO_ENDPOINT`, `MINIO_USER` and
+    `MINIO_PASSWORD` environment variables. `Minio` clients are thread safe, so the
+    same instance (and its connection pool) is reused for every transfer.
+
+    Returns:
+        Minio: The shared client.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Minio(
+                endpoint=os.environ.get("MINIO_ENDPOINT"),
+                access_key=os.environ.get("MINIO_USER"),
+                secret_key=os.environ.get("MINIO_PASSWORD"),
+                secure=False,
+            )
+        return _client
+
+
+def download_to_tempfile(client, bucket_name, key, suffix=".json"):
+    """
+    Downloads an object to a new temporary file.
+
+    The caller owns the file and must remove it once done. Download errors are logged and
+    re-raised, so the task fails and its retry resumes from the last checkpoint.
+
+    Args:
+        client (Minio): The MinIO client.
+        bucket_name (str): The bucket to download from.
+        key (str): The object name.
+        suffix (str): Suffix of the temporary file name.
+
+    Returns:
+        str: Path to the downloaded file.
+    """
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        client.fget_object(bucket_name, key, path)
+    except Exception as err:
+        os.remove(path)
+        logging.error(f"Error downloading {key} from {bucket_name}: {err}")
+        raise
+    return path
+
+
+def fetch_object(client, bucket_name, key, spool_max_size=None):
+    """
+    Fetches an object either to a temporary file or straight into memory.
+
+    Without `spool_max_size` the object is downloaded with `download_to_tempfile` and its path
+    is returned. Otherwise the `get_object` response is streamed into an in-memory buffer, or
+    into an anonymous temporary file when the object is larger than `spool_max_size` bytes.
+    Download errors are logged and re-raised.
+
+    Args:
+        client (Minio): The MinIO client.
+        bucket_name (str): The bucket to download from.
+        key (str): The object name.
+        spool_max_size (int): Optional. Largest object size, in bytes, kept in memory.
+
+    Returns:
+        str or file object: The path to the downloaded file, or a binary file object positioned at
+            the start of the data. Pass it to `release_object` when done.
+    """
+    if spool_max_size is None:
+        return download_to_tempfile(client, bucket_name, key)
+
+    response = None
+    try:
+        response = client.get_object(bucket_name, key)
+        size = int(response.headers.get("Content-Length") or 0)
+        buffer = io.BytesIO() if size <= spool_max_size else tempfile.TemporaryFile()
+        for chunk in response.stream(STREAM_CHUNK_SIZE):
+            buffer.write(chunk)
+    except Exception as err:
+        logging.error(f"Error downloading {key} from {bucket_name}: {err}")
+        raise
+    finally:
+        if response is not None:
+            response.close()
+            response.release_conn()
+    buffer.seek(0)
+    return buffer
+
+
+def release_object(source):
+    """
+    Frees what `fetch_object` returned: removes the temporary file or closes the buffer.
+
+    Args:
+        source (str or file object): The value returned by `fetch_object`.
+
+    Returns:
+        None
+    """
+    if isinstance(source, str):
+        os.remove(source)
+    else:
+        source.close()
+
+
+def spool_max_size_from_context(context):
+    """
+    Reads the in-memory transfer settings from the DAG run config.
+
+    Args:
+        context (dict): The context dictionary provided by Airflow.
+
+    Returns:
+        int or None: The `spool_max_size` to pass to `fetch_object` when `in_memory` is enabled, None otherwise.
+    """
+    if not get_conf(context, "in_memory", False):
+        return None
+    return int(get_conf(context, "spool_max_size", DEFAULT_SPOOL_MAX_SIZE))
+
+
+class TransferPool:
+    """
+    A bounded thread pool that overlaps object transfers and their processing.
+
+    At most `max_pending` jobs are in flight at once: `imap` only submits a new job when a
+    previous one has been consumed, which keeps the number of downloaded-but-unprocessed
+    files (and their disk/memory usage) bounded. The duration of every job is recorded and
+    can be logged with `log_summary`.
+
+    Args:
+        max_workers (int): Number of worker threads. Default is 4.
+        max_pending (int): Maximum number of submitted jobs not yet consumed. Defaults to twice `max_workers`.
+
+    Example:
+        with TransferPool(max_workers=8) as pool:
+            for key, path in pool.imap(lambda key: download_to_tempfile(client, bucket, key), keys, release=os.remove):
+                ...
+            pool.log_summary()
+    """
+
+    def __init__(self, max_workers=DEFAULT_TRANSFER_WORKERS, max_pending=None):
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(1, int(max_pending or 2 * self.max_workers))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.background = []
+        self.timings = []
+        self.started_at = time.perf_counter()
+
+    @classmethod
+    def from_context(cls, context):
+        """
+        Creates a pool sized from the `transfer_workers` and `transfer_max_pending` values of the DAG run config.
+
+        Args:
+            context (dict): The context dictionary provided by Airflow.
+
+        Returns:
+            TransferPool: The new pool.
+        """
+        return cls(
+            max_workers=get_conf(context, "transfer_workers", DEFAULT_TRANSFER_WORKERS),
+            max_pending=get_conf(context, "transfer_max_pending"),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.executor.shutdown(wait=True)
+        return False
+
+    def _timed(self, fn, item):
+        started = time.perf_counter()
+        result = fn(item)
+        elapsed = time.perf_counter() - started
+        self.timings.append((item, elapsed))
+        logging.info(f"Transferred {item} in {elapsed:.3f}s")
+        return result
+
+    def imap(self, fn, items, release=None):
+        """
+        Applies `fn` to every item in the pool, yielding results as they complete.
+
+        When the consumer stops early, e.g. because it raised, the jobs not started yet are cancelled,
+        and the results of the others are passed to `release` once they complete, so that nothing they
+        downloaded is left behind.
+
+        Args:
+            fn (callable): Function called with a single item.
+            items (iterable): The items to process.
+            release (callable): Optional. Function called with every result that is not yielded, e.g. `release_object`.
+
+        Yields:
+            tuple: `(item, result)` in completion order. An exception raised by `fn` is re-raised here.
+        """
+        items = iter(items)
+        pending = {}
+        try:
+            while True:
+                while len(pending) < self.max_pending:
+                    item = next(items, StopIteration)
+                    if item is StopIteration:
+                        break
+                    pending[self.executor.submit(self._timed, fn, item)] = item
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    yield item, future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+            for future, item in pending.items():
+                if future.cancelled() or release is None or future.exception() is not None:
+                    continue
+                try:
+                    release(future.result())
+                except Exception:
+                    logging.exception(f"Could not release the result of {item}")
+
+    def submit(self, fn, item):
+        """
+        Runs `fn(item)` in the background, e.g. an upload that nothing else waits on.
+
+        Waits for a background job to finish first when `max_pending` of them are already running.
+
+        Args:
+            fn (callable): Function called with a single item.
+            item: The item to process.
+
+        Returns:
+            None
+        """
+        self.background = [future for future in self.background if not future.done()]
+        if len(self.background) >= self.max_pending:
+            wait(self.background, return_when=FIRST_COMPLETED)
+        self.background.append(self.executor.submit(self._timed, fn, item))
+
+    def join(self):
+        """
+        Waits for every background job, re-raising the first exception raised by one.
+
+        Returns:
+            None
+        """
+        for future in self.background:
+            future.result()
+        self.background = []
+
+    def log_summary(self):
+        """
+        Logs the number of jobs, the summed job time and the wall time since the pool was created.
+
+        Returns:
+            None
+        """
+        wall_time = time.perf_counter() - self.started_at
+        busy_time = sum(elapsed for _, elapsed in self.timings)
+        slowest = max(self.timings, key=lambda timing: timing[1], default=(None, 0.0))
+        logging.info(
+            f"TransferPool ran {len(self.timings)} jobs with {self.max_workers} workers: "
+            f"{busy_time:.2f}s of work in {wall_time:.2f}s wall time, slowest {slowest[0]} ({slowest[1]:.3f}s)"
+        )
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.telemetry import collect_telemetry, get_telemetry
+
+DEFAULT_VALIDATION_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def validation_executor(max_workers):
+    """
+    Creates the process pool of `validate_file_in_pool`.
+
+    The workers are started by a forkserver, or spawned where it is not available, instead of being
+    forked from the task: the task runs `TransferPool` threads, and a process forked while another
+    thread holds a lock (e.g. of `logging` or of a connection pool) can deadlock.
+
+    Args:
+        max_workers (int): Number of worker processes.
+
+    Returns:
+        ProcessPoolExecutor: The process pool.
+    """
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(start_method))
+
+
+def is_ndjson(file_path):
+    """
+    Checks whether a file is newline-delimited JSON, using the same rule as `iter_json_stream`:
+    the first non-blank line holds a complete JSON document that is not an array.
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        bool: True if the file can be split on line boundaries.
+    """
+    with open(file_path, "rb") as f:
+        for line in f:
+            if line.strip():
+                if line.lstrip().startswith(b"["):
+                    return False
+                try:
+                    json.loads(line)
+                except ValueError:
+                    return False
+                return True
+    return False
+
+
+def ndjson_byte_ranges(file_path, chunk_size=DEFAULT_VALIDATION_CHUNK_SIZE):
+    """
+    Splits a newline-delimited JSON file into byte ranges of about `chunk_size` bytes
+    that start and end on line boundaries.
+
+    Args:
+        file_path (str): Path to the file.
+        chunk_size (int): Target size of each range in bytes.
+
+    Returns:
+        list: `(start, end)` offsets covering the whole file.
+    """
+    size = os.path.getsize(file_path)
+    ranges = []
+    start = 0
+    with open(file_path, "rb") as f:
+        while start < size:
+            f.seek(min(start + chunk_size, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def iter_byte_range(file_path, start, end):
+    """
+    Yields the newline-delimited JSON objects between two byte offsets of a file.
+
+    Args:
+        file_path (str): Path to the file.
+        start (int): Offset of the first line of the range.
+        end (int): Offset right after the last line of the range.
+
+    Yields:
+        dict: The objects.
+    """
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                yield json.loads(line)
+
+
+def validate_byte_range(validate, file_path, start, end, event_type=None):
+    """
+    Validates the newline-delimited JSON objects between two byte offsets of a file.
+
+    Like `valid_file`, the parse and validate times, the events per type and the invalid events are
+    recorded in the telemetry returned by `get_telemetry`; run through `collect_telemetry`, they are
+    returned to the parent process.
+
+    Args:
+        validate (callable): Function returning False for an invalid object. Must be picklable.
+        file_path (str): Path to the file.
+        start (int): Offset of the first line of the range.
+        end (int): Offset right after the last line of the range.
+        event_type (callable): Optional. Function returning the type of an object, to count the events per type. Must be picklable.
+
+    Returns:
+        bool: True if every object in the range is valid, False otherwise.
+    """
+    telemetry = get_telemetry()
+    res = True
+    validate_time = 0.0
+    events = {}
+    invalid_events = 0
+    for obj in telemetry.timed_iter(iter_byte_range(file_path, start, end), "parse"):
+        started_at = time.perf_counter()
+        valid = validate(obj)
+        validate_time += time.perf_counter() - started_at
+        if event_type is not None:
+            events[event_type(obj)] = events.get(event_type(obj), 0) + 1
+        if not valid:
+            logging.warning(f"Invalid schema for {obj} in {file_path}")
+            invalid_events += 1
+            res = False
+
+    telemetry.add_time("validate", validate_time)
+    for type_, count in events.items():
+        telemetry.count("events", count, type=type_)
+    telemetry.count("invalid_events", invalid_events)
+    return res
+
+
+def validate_file_in_pool(executor, file_path, validate, valid_file, chunk_size=DEFAULT_VALIDATION_CHUNK_SIZE, event_type=None):
+    """
+    Validates a file in a process pool.
+
+    Newline-delimited JSON files larger than `chunk_size` are sharded into byte ranges that are
+    validated by different workers. Other files are validated whole by `valid_file` in one worker.
+    As with `valid_file`, a single invalid object makes the whole file invalid. The metrics recorded
+    by the workers are added to the task's telemetry (see `collect_telemetry`).
+
+    Args:
+        executor (ProcessPoolExecutor): The process pool, see `validation_executor`.
+        file_path (str): Path to the file. In-memory buffers cannot be shared with the workers.
+        validate (callable): Per-object validation function. Must be picklable.
+        valid_file (callable): Whole-file validation function. Must be picklable.
+        chunk_size (int): Target size of each byte range.
+        event_type (callable): Optional. Function returning the type of an object, for the events per type of the sharded files. Must be picklable.
+
+    Returns:
+        bool: True if every object in the file is valid, False otherwise.
+    """
+    telemetry = get_telemetry()
+    if os.path.getsize(file_path) > chunk_size and is_ndjson(file_path):
+        futures = [
+            executor.submit(collect_telemetry, validate_byte_range, validate, file_path, start, end, event_type)
+            for start, end in ndjson_byte_ranges(file_path, chunk_size)
+        ]
+    else:
+        futures = [executor.submit(collect_telemetry, valid_file, file_path)]
+    # wait for every range so all invalid objects are reported
+    results = []
+    for future in futures:
+        valid, state = future.result()
+        telemetry.merge(state)
+        results.append(valid)
+    return all(results)
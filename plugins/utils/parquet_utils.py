@@ -0,0 +1,183 @@
+import io
+import os
+import logging
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+PARQUET_PREFIX = "parquet"
+PARQUET_COMPRESSION = "zstd"
+
+# Column types of the datalake files, one file per event type. The names match the PostgreSQL tables.
+PARQUET_SCHEMAS = {
+    "vehicle_update": pa.schema([
+        ("vehicle_id", pa.string()),
+        ("latitude", pa.float64()),
+        ("longitude", pa.float64()),
+        ("location_time", pa.timestamp("us", tz="UTC")),
+        ("event_time", pa.timestamp("us", tz="UTC")),
+        ("organization_id", pa.string()),
+    ]),
+    "vehicle_registration": pa.schema([
+        ("vehicle_id", pa.string()),
+        ("event", pa.string()),
+        ("event_time", pa.timestamp("us", tz="UTC")),
+        ("organization_id", pa.string()),
+    ]),
+    "operating_period": pa.schema([
+        ("operating_period_id", pa.string()),
+        ("vehicle_id", pa.string()),
+        ("start", pa.timestamp("us", tz="UTC")),
+        ("finish", pa.timestamp("us", tz="UTC")),
+        ("event", pa.string()),
+        ("event_time", pa.timestamp("us", tz="UTC")),
+        ("organization_id", pa.string()),
+    ]),
+}
+
+
+def parquet_prefix(target_date_str):
+    """
+    Returns the datalake prefix holding the Parquet files of a date.
+
+    Args:
+        target_date_str (str): The date in the format "%Y-%m-%d".
+
+    Returns:
+        str: The prefix, partitioned as `parquet/date=<date>/`.
+    """
+    return f"{PARQUET_PREFIX}/date={target_date_str}/"
+
+
+def parquet_object_name(target_date_str, event_type, basename):
+    """
+    Returns the datalake key of the Parquet file holding the `event_type` events of a source file.
+
+    Args:
+        target_date_str (str): The date in the format "%Y-%m-%d".
+        event_type (str): One of the `PARQUET_SCHEMAS` keys.
+        basename (str): Base name of the source JSON file.
+
+    Returns:
+        str: The key, partitioned as `parquet/date=<date>/event_type=<event_type>/<name>.parquet`.
+    """
+    stem = os.path.splitext(basename)[0]
+    return f"{parquet_prefix(target_date_str)}event_type={event_type}/{stem}.parquet"
+
+
+class EventTableBuilder:
+    """
+    Collects mapped event rows and turns them into one typed Arrow table per event type.
+
+    Rows are added with the `(table, columns, row)` tuples produced by `event_to_row`, so the
+    same mapping feeds PostgreSQL and the datalake. Columns not in `PARQUET_SCHEMAS` (the
+    run's `correlation_id`) are dropped.
+
+    Example:
+        builder = EventTableBuilder()
+        for obj in iter_json_file(path):
+            mapped = event_to_row(obj, correlation_id)
+            if mapped:
+                builder.add(*mapped)
+        tables = builder.tables()
+    """
+
+    def __init__(self):
+        self.columns = {}
+
+    def add(self, table, columns, row):
+        """
+        Buffers a mapped row.
+
+        Args:
+            table (str): The event type, one of the `PARQUET_SCHEMAS` keys.
+            columns (tuple): Column names matching the values in `row`.
+            row (tuple): The values.
+
+        Returns:
+            None
+        """
+        buffers = self.columns.get(table)
+        if buffers is None:
+            buffers = self.columns[table] = {name: [] for name in columns}
+        for name, value in zip(columns, row):
+            buffers[name].append(value)
+
+    def tables(self):
+        """
+        Builds the typed tables. Timestamps are parsed from their ISO 8601 strings.
+
+        Returns:
+            dict: `pyarrow.Table` per event type that received rows.
+        """
+        tables = {}
+        for event_type, buffers in self.columns.items():
+            schema = PARQUET_SCHEMAS[event_type]
+            raw = pa.table({field.name: pa.array(buffers[field.name]) for field in schema})
+            tables[event_type] = raw.cast(schema)
+        return tables
+
+
+def upload_parquet_tables(client, tables, bucket, target_date_str, basename):
+    """
+    Writes each table as a compressed Parquet file and uploads it to the datalake.
+
+    Args:
+        client (Minio): The MinIO client.
+        tables (dict): `pyarrow.Table` per event type, as returned by `EventTableBuilder.tables`.
+        bucket (str): The bucket to upload to.
+        target_date_str (str): The date in the format "%Y-%m-%d".
+        basename (str): Base name of the source JSON file.
+
+    Returns:
+        bool: True if every file was uploaded, False otherwise.
+    """
+    for event_type, table in tables.items():
+        object_name = parquet_object_name(target_date_str, event_type, basename)
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer, compression=PARQUET_COMPRESSION)
+        size = buffer.tell()
+        buffer.seek(0)
+        try:
+            client.put_object(bucket, object_name, buffer, size)
+            logging.info(f"{table.num_rows} {event_type} events uploaded to MinIO with {object_name}")
+        except Exception as e:
+            logging.error(f"Error uploading {object_name} to MinIO: {e}")
+            return False
+    return True
+
+
+def parquet_event_type(object_name):
+    """
+    Reads the event type from the `event_type=` partition of a datalake key.
+
+    Args:
+        object_name (str): The datalake key.
+
+    Returns:
+        str: The event type, or None if the key has no such partition.
+    """
+    for part in object_name.split("/"):
+        if part.startswith("event_type="):
+            return part[len("event_type="):]
+    return None
+
+
+def parquet_to_csv(source, correlation_id):
+    """
+    Converts a datalake Parquet file to CSV rows ready for `COPY ... FROM STDIN WITH (FORMAT csv)`.
+
+    Args:
+        source (str or file object): Path to the Parquet file, or a binary file object.
+        correlation_id (str): Value of the `correlation_id` column appended to every row.
+
+    Returns:
+        tuple: `(columns, buffer, num_rows)` where `buffer` is a binary file object holding the CSV rows.
+    """
+    table = pq.read_table(source)
+    table = table.append_column("correlation_id", pa.array([correlation_id] * table.num_rows, pa.string()))
+    buffer = io.BytesIO()
+    pa_csv.write_csv(table, buffer, pa_csv.WriteOptions(include_header=False))
+    buffer.seek(0)
+    return tuple(table.column_names), buffer, table.num_rows
@@ -1,40 +1,483 @@
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 import os
+import io
+import re
+import csv
+import time
+import logging
+import threading
 from contextlib import ContextDecorator
 
+from utils.dedup_utils import EVENT_KEYS
+from utils.telemetry import get_telemetry
+from utils.utils import get_conf
+
+DEFAULT_POOL_MAX_SIZE = 4
+DEFAULT_SERVER_CURSOR_ITERSIZE = 10000
+# Number of statements, slowest first, kept in the XCom summary of a task
+STATEMENT_SUMMARY_SIZE = 20
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def statement_label(query):
+    """
+    Short label grouping the executions of a statement in the summaries.
+
+    Args:
+        query (str or bytes): The SQL statement.
+
+    Returns:
+        str: The statement with collapsed whitespace, truncated to 80 characters.
+    """
+    if isinstance(query, bytes):
+        query = query.decode(errors="replace")
+    return re.sub(r"\s+", " ", str(query)).strip()[:80]
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """
+    Cursor recording the duration and row count of every statement on its connection.
+
+    Fetches from server-side (named) cursors are added to the statement that declared them,
+    so streamed reads are accounted for too.
+    """
+
+    def _record(self, query, started_at):
+        self._statement = {
+            "statement": statement_label(query),
+            "seconds": time.perf_counter() - started_at,
+            "rows": max(self.rowcount, 0),
+        }
+        self.connection.statements.append(self._statement)
+
+    def _timed_fetch(self, fetch, *args, single=False):
+        started_at = time.perf_counter()
+        rows = fetch(*args)
+        statement = getattr(self, "_statement", None)
+        if statement is not None:
+            statement["seconds"] += time.perf_counter() - started_at
+            if self.name is not None:
+                statement["rows"] += (rows is not None) if single else len(rows)
+        return rows
+
+    def execute(self, query, vars=None):
+        started_at = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._record(query, started_at)
+
+    def executemany(self, query, vars_list):
+        started_at = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._record(query, started_at)
+
+    def copy_expert(self, sql, file, size=8192):
+        started_at = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            self._record(sql, started_at)
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone, single=True)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """
+    Connection whose cursors are `InstrumentedCursor`s, collecting their statements in `statements`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = InstrumentedCursor
+        self.statements = []
+
+    def server_cursor(self, name, itersize=DEFAULT_SERVER_CURSOR_ITERSIZE):
+        """
+        Opens a server-side (named) cursor, which streams the result of a query in batches of
+        `itersize` rows instead of loading it whole in memory.
+
+        Args:
+            name (str): Name of the cursor, unique within the transaction.
+            itersize (int): Number of rows fetched per round trip when iterating.
+
+        Returns:
+            InstrumentedCursor: The named cursor.
+        """
+        cursor = self.cursor(name=name)
+        cursor.itersize = itersize
+        return cursor
+
+    def statement_summary(self, limit=STATEMENT_SUMMARY_SIZE):
+        """
+        Aggregates the recorded statements by label, slowest first.
+
+        Args:
+            limit (int): Maximum number of statements returned.
+
+        Returns:
+            list: Dicts with the `statement` label, number of `calls`, total `seconds` and `rows`.
+        """
+        summary = {}
+        for statement in self.statements:
+            entry = summary.setdefault(statement["statement"], {"statement": statement["statement"], "calls": 0, "seconds": 0.0, "rows": 0})
+            entry["calls"] += 1
+            entry["seconds"] += statement["seconds"]
+            entry["rows"] += statement["rows"]
+        entries = sorted(summary.values(), key=lambda entry: entry["seconds"], reverse=True)[:limit]
+        for entry in entries:
+            entry["seconds"] = round(entry["seconds"], 6)
+        return entries
+
+
+def get_connection_pool(connection_string=None):
+    """
+    Returns the connection pool of this process for a connection string.
+
+    The pool is created on first use, with up to `PSQL_POOL_MAX_SIZE` (environment variable,
+    default 4) connections. The connection string defaults to the `PSQL_CONNECTION_STRING`
+    environment variable, read at call time. Pools inherited from a parent process are not
+    reused, as their connections belong to the parent.
+
+    Args:
+        connection_string (str): Connection string to connect to the database.
+
+    Returns:
+        psycopg2.pool.ThreadedConnectionPool: The pool.
+    """
+    if connection_string is None:
+        connection_string = os.environ.get("PSQL_CONNECTION_STRING")
+    key = (os.getpid(), connection_string)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = psycopg2.pool.ThreadedConnectionPool(
+                1,
+                int(os.environ.get("PSQL_POOL_MAX_SIZE", DEFAULT_POOL_MAX_SIZE)),
+                connection_string,
+                connection_factory=InstrumentedConnection,
+            )
+        return _pools[key]
+
 
 class PSQL_connect(ContextDecorator):
     """
-    A context manager that creates a connection to a PostgreSQL database.
+    A context manager that borrows a connection to a PostgreSQL database from the process' pool.
+
+    Every statement run on the connection is timed, see `InstrumentedCursor`. On exit, the
+    slowest statements are logged and, when a task context is given, pushed to XCom under the
+    `db_statements` key.
 
     Args:
         connection_string (str): Connection string to connect to the database. 
                                  If not provided, it defaults to the value of the 
                                  'PSQL_CONNECTION_STRING' environment variable.
-        commit (bool): Whether to commit changes automatically on exit. Default is True.
+        commit (bool): Whether to commit changes automatically on exit. Default is True. A block that
+                       raises is always rolled back.
+        statement_timeout (int): Maximum duration of each statement in milliseconds. Default is no limit.
+        context (dict): The Airflow task context, to push the statement summary to XCom.
 
     Example:
-        with PSQL_connect() as (connection, cursor):
+        with PSQL_connect.from_context(context) as (connection, cursor):
             cursor.execute('SELECT * FROM table_name')
             results = cursor.fetchall()
             ...
     """
     
-    def __init__(
-        self, connection_string=os.environ.get("PSQL_CONNECTION_STRING"), commit=True
-    ):
-        self.connection = psycopg2.connect(connection_string)
+    def __init__(self, connection_string=None, commit=True, statement_timeout=None, context=None):
+        self.pool = get_connection_pool(connection_string)
+        self.connection = self.pool.getconn()
         if self.connection.status != psycopg2.extensions.STATUS_READY:
+            self.pool.putconn(self.connection, close=True)
             raise Exception("Connection to the database is not working.")
+        self.connection.statements = []
         self.cursor = self.connection.cursor()
+        if statement_timeout:
+            self.cursor.execute("SET statement_timeout = %s", (int(statement_timeout),))
+        else:
+            self.cursor.execute("RESET statement_timeout")
         self.commit = commit
+        self.context = context
+
+    @classmethod
+    def from_context(cls, context, **kwargs):
+        """
+        Builds the context manager for a task, reading `statement_timeout` from the DAG run conf.
+
+        Args:
+            context (dict): The Airflow task context.
+            **kwargs: Other arguments of `PSQL_connect`.
+
+        Returns:
+            PSQL_connect: The context manager.
+        """
+        kwargs.setdefault("statement_timeout", get_conf(context, "statement_timeout"))
+        return cls(context=context, **kwargs)
 
     def __enter__(self):
         return self.connection, self.cursor
 
-    def __exit__(self, *exc):
-        if self.commit:
-            self.connection.commit()
-        self.cursor.close()
-        self.connection.close()
+    def __exit__(self, exc_type, exc_value, traceback):
+        broken = False
+        try:
+            # a failed block is rolled back, so that only the work committed by the block itself
+            # (e.g. with its checkpoints) survives and the retry resumes from there
+            if self.commit and exc_type is None:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        except psycopg2.Error:
+            broken = True
+            raise
+        finally:
+            self.cursor.close()
+            self.log_statements()
+            self.pool.putconn(self.connection, close=broken or bool(self.connection.closed))
         return False
+
+    def log_statements(self):
+        """
+        Logs the slowest statements of the connection and pushes them to XCom.
+
+        Returns:
+            None
+        """
+        summary = self.connection.statement_summary()
+        total = sum(statement["seconds"] for statement in self.connection.statements)
+        logging.info(f"{len(self.connection.statements)} statements took {total:.3f}s in the database")
+        for entry in summary:
+            logging.info(f"  {entry['seconds']:.3f}s {entry['calls']} calls {entry['rows']} rows: {entry['statement']}")
+        if self.context is not None and "ti" in self.context:
+            self.context["ti"].xcom_push(key="db_statements", value=summary)
+
+
+class BulkLoader:
+    """
+    Buffers rows per target table and streams them to PostgreSQL with `COPY ... FROM STDIN`.
+
+    Values are serialised with the `csv` module, so quotes, commas and newlines inside
+    the data cannot break the load. `None` is written as an unquoted empty field, which
+    COPY reads as NULL. The time spent in `COPY` is added to the "load" stage of the task's
+    telemetry, and `log_throughput` records the rows loaded per table.
+
+    Tables with an event key (see `utils.dedup_utils.EVENT_KEYS`) have a unique index on it, so
+    their rows are copied into a temporary staging table and inserted with `ON CONFLICT DO NOTHING`:
+    events already loaded, by this run or an earlier one, are dropped. With `dedup`, events seen
+    earlier in the run are dropped before they are buffered. `log_throughput` reports both counts
+    of duplicates.
+
+    With `compressor`, the `vehicle_update` rows are handed to it instead, and only the points it
+    keeps are loaded when the loader flushes (see `utils.trajectory_utils.TrajectoryCompressor`).
+
+    Args:
+        cursor (psycopg2.extensions.cursor): Cursor to the PostgreSQL database.
+        batch_size (int): Number of buffered rows per table that triggers a flush. Default is 10000.
+        dedup (EventDeduplicator): Optional. In-memory deduplication of the events of the run.
+        compressor (TrajectoryCompressor): Optional. Simplification of the vehicle trajectories.
+
+    Example:
+        loader = BulkLoader(cursor, batch_size=5000)
+        loader.add("vehicle_registration", ("vehicle_id", "event"), ("abc", "register"))
+        loader.flush()
+        loader.log_throughput()
+    """
+
+    def __init__(self, cursor, batch_size=10000, dedup=None, compressor=None):
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.dedup = dedup
+        self.compressor = compressor
+        self.buffers = {}
+        self.rows_loaded = {}
+        self.duplicates = {}
+        self.started_at = time.perf_counter()
+
+    def add(self, table, columns, row):
+        """
+        Buffer a row for `table`, flushing the table's buffer once it reaches `batch_size`.
+
+        Args:
+            table (str): Name of the target table.
+            columns (tuple): Column names matching the values in `row`.
+            row (tuple): The values to load.
+
+        Returns:
+            None
+        """
+        key = (table, tuple(columns))
+        if self.dedup is not None and self.dedup.seen(table, key[1], row):
+            self._count_duplicates(table, "memory", 1)
+            return
+        if self.compressor is not None and table == self.compressor.table:
+            if self.compressor.add(key[1], row) >= self.compressor.max_points:
+                self._drain_compressor()
+            return
+        buffer = self.buffers.setdefault(key, [])
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            self._copy(key)
+
+    def flush(self):
+        """
+        Copy every buffered row to the database.
+
+        Returns:
+            None
+        """
+        if self.compressor is not None:
+            self._drain_compressor()
+        for key in list(self.buffers):
+            self._copy(key)
+
+    def discard(self):
+        """
+        Drop every buffered row without loading it.
+
+        Returns:
+            None
+        """
+        self.buffers.clear()
+        if self.compressor is not None:
+            self.compressor.discard()
+
+    def savepoint(self):
+        """
+        Mark the current state, to be restored with `rollback` when the database transaction is
+        rolled back to a savepoint taken at the same time.
+
+        Returns:
+            tuple: The state of the loader.
+        """
+        if self.dedup is not None:
+            self.dedup.savepoint()
+        compressor_state = self.compressor.savepoint() if self.compressor is not None else None
+        return dict(self.rows_loaded), dict(self.duplicates), compressor_state
+
+    def release(self):
+        """
+        Keep everything added since `savepoint`.
+
+        Returns:
+            None
+        """
+        if self.dedup is not None:
+            self.dedup.release()
+
+    def rollback(self, state):
+        """
+        Drop the buffered rows and forget the rows and events counted since `savepoint`.
+
+        Args:
+            state (tuple): The state returned by `savepoint`.
+
+        Returns:
+            None
+        """
+        self.discard()
+        self.rows_loaded, self.duplicates, compressor_state = state
+        if self.dedup is not None:
+            self.dedup.rollback()
+        if self.compressor is not None:
+            self.compressor.rollback(compressor_state)
+
+    def copy_csv(self, table, columns, data, num_rows):
+        """
+        Stream rows that are already serialised as CSV, e.g. converted from a columnar file.
+
+        Args:
+            table (str): Name of the target table.
+            columns (tuple): Column names in the order of the CSV fields.
+            data (file object): Text or binary file object holding the CSV rows, without a header.
+            num_rows (int): Number of rows in `data`, for the throughput report.
+
+        Returns:
+            None
+        """
+        with get_telemetry().stage("load"):
+            self._copy_expert(table, columns, data, num_rows)
+
+    def _copy_expert(self, table, columns, data, num_rows):
+        if table not in EVENT_KEYS:
+            self.cursor.copy_expert(
+                f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", data
+            )
+            self.rows_loaded[table] = self.rows_loaded.get(table, 0) + num_rows
+            return
+        
+        # the staging table has the columns of the table without their constraints and defaults, and
+        # is dropped with the transaction, so it never outlives a rollback
+        staging = f"{table}_staging"
+        column_list = ", ".join(columns)
+        self.cursor.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {staging} ON COMMIT DROP AS SELECT * FROM {table} WITH NO DATA"
+        )
+        self.cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)", data)
+        self.cursor.execute(
+            f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging} ON CONFLICT DO NOTHING"
+        )
+        inserted = self.cursor.rowcount
+        self.cursor.execute(f"TRUNCATE {staging}")
+        self.rows_loaded[table] = self.rows_loaded.get(table, 0) + inserted
+        self._count_duplicates(table, "database", num_rows - inserted)
+
+    def _count_duplicates(self, table, source, count):
+        if count:
+            key = (table, source)
+            self.duplicates[key] = self.duplicates.get(key, 0) + count
+
+    def _drain_compressor(self):
+        with get_telemetry().stage("compress"):
+            drained = self.compressor.drain()
+        for columns, rows in drained:
+            key = (self.compressor.table, columns)
+            self.buffers.setdefault(key, []).extend(rows)
+            if len(self.buffers[key]) >= self.batch_size:
+                self._copy(key)
+
+    def _copy(self, key):
+        rows = self.buffers.pop(key, None)
+        if not rows:
+            return
+        table, columns = key
+        with get_telemetry().stage("load"):
+            data = io.StringIO()
+            writer = csv.writer(data)
+            writer.writerows(rows)
+            data.seek(0)
+            self._copy_expert(table, columns, data, len(rows))
+
+    def log_throughput(self):
+        """
+        Log the number of rows loaded per table, the overall rows/sec since the loader was created and
+        the number of duplicate events dropped.
+
+        Returns:
+            None
+        """
+        elapsed = time.perf_counter() - self.started_at
+        total = sum(self.rows_loaded.values())
+        telemetry = get_telemetry()
+        for table, rows in self.rows_loaded.items():
+            telemetry.count("rows_loaded", rows, table=table)
+        for (table, source), count in self.duplicates.items():
+            telemetry.count("duplicates", count, table=table, source=source)
+        rate = total / elapsed if elapsed > 0 else 0.0
+        logging.info(
+            f"BulkLoader loaded {total} rows in {elapsed:.2f}s ({rate:.0f} rows/sec): {self.rows_loaded}"
+        )
+        if self.duplicates:
+            logging.info(f"BulkLoader dropped {sum(self.duplicates.values())} duplicate events: {self.duplicates}")
+        if self.compressor is not None:
+            self.compressor.log_summary()
\ No newline at end of file
@@ -0,0 +1,146 @@
+import numbers
+from typing import Callable, Iterable, List
+
+import jsonschema
+
+# Keywords the compiler turns into Python code. Annotation keywords are accepted and ignored,
+# as the reference validator does.
+COMPILED_KEYWORDS = {"type", "properties", "required"}
+IGNORED_KEYWORDS = {"$schema", "$id", "id", "title", "description", "$comment", "examples", "default"}
+
+# Type checks mirroring jsonschema's Draft 7 type checker
+TYPE_CHECKS = {
+    "string": "isinstance({v}, str)",
+    "object": "isinstance({v}, dict)",
+    "array": "isinstance({v}, list)",
+    "boolean": "isinstance({v}, bool)",
+    "null": "{v} is None",
+    "number": "(isinstance({v}, _Number) and not isinstance({v}, bool))",
+    "integer": "((isinstance({v}, int) and not isinstance({v}, bool)) or (isinstance({v}, float) and {v}.is_integer()))",
+}
+
+_MISSING = object()
+
+
+class UnsupportedSchema(Exception):
+    """
+    Raised when a schema uses a keyword the compiler cannot translate.
+    """
+
+
+class CompiledValidator:
+    """
+    A JSON schema validator compiled into a specialised Python function.
+
+    The schema is translated once into straight-line `isinstance`/membership checks, which
+    gives the same verdict as `jsonschema.Draft7Validator(schema).is_valid` for the supported
+    keywords (`type`, `properties`, `required`) without walking the schema per object.
+    Schemas using any other keyword fall back to `jsonschema.Draft7Validator`.
+
+    Args:
+        schema (dict): The JSON schema.
+
+    Attributes:
+        is_valid (Callable[[object], bool]): Returns True if an object conforms to the schema.
+        source (str): The generated Python source, or None when falling back to jsonschema.
+
+    Example:
+        validator = CompiledValidator(json.load(open("vehicle_update.json")))
+        validator.is_valid(obj)
+        validator.validate_batch(objs)
+    """
+
+    def __init__(self, schema: dict):
+        self.schema = schema
+        try:
+            self.source = _compile_function(schema)
+        except UnsupportedSchema:
+            self.source = None
+            self.is_valid = jsonschema.Draft7Validator(schema).is_valid
+        else:
+            namespace = {"_Number": numbers.Number, "_MISSING": _MISSING}
+            exec(compile(self.source, "<compiled jsonschema>", "exec"), namespace)
+            self.is_valid = namespace["check"]
+
+    @property
+    def compiled(self) -> bool:
+        """
+        bool: False if the schema fell back to `jsonschema.Draft7Validator`.
+        """
+        return self.source is not None
+
+    def validate_batch(self, instances: Iterable) -> List[bool]:
+        """
+        Validates many objects at once.
+
+        Args:
+            instances (Iterable): The objects to validate.
+
+        Returns:
+            List[bool]: The verdict for each object, in order.
+        """
+        return list(map(self.is_valid, instances))
+
+
+def _compile_function(schema: dict) -> str:
+    lines = ["def check(v0):"]
+    _compile_node(schema, "v0", 0, lines, "    ")
+    lines.append("    return True")
+    return "\n".join(lines) + "\n"
+
+
+def _compile_node(schema, var: str, depth: int, lines: list, indent: str):
+    if schema is True or schema == {}:
+        return
+    if not isinstance(schema, dict):
+        raise UnsupportedSchema(f"Unsupported schema {schema!r}")
+    unsupported = set(schema) - COMPILED_KEYWORDS - IGNORED_KEYWORDS
+    if unsupported:
+        raise UnsupportedSchema(f"Unsupported keywords {sorted(unsupported)}")
+
+    if "type" in schema:
+        types = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+        if any(t not in TYPE_CHECKS for t in types):
+            raise UnsupportedSchema(f"Unsupported type {schema['type']!r}")
+        condition = " or ".join(TYPE_CHECKS[t].format(v=var) for t in types)
+        lines.append(f"{indent}if not ({condition}):")
+        lines.append(f"{indent}    return False")
+
+    # `required` and `properties` only apply to objects
+    required = schema.get("required", [])
+    properties = schema.get("properties", {})
+    if not required and not properties:
+        return
+    if schema.get("type") != "object":
+        lines.append(f"{indent}if isinstance({var}, dict):")
+        indent += "    "
+        lines.append(f"{indent}pass")
+    for name in required:
+        lines.append(f"{indent}if {name!r} not in {var}:")
+        lines.append(f"{indent}    return False")
+    for i, (name, subschema) in enumerate(properties.items()):
+        if subschema is True or subschema == {}:
+            continue
+        child = f"v{depth + 1}_{i}"
+        if name in required:
+            # presence was checked above
+            lines.append(f"{indent}{child} = {var}[{name!r}]")
+            _compile_node(subschema, child, depth + 1, lines, indent)
+        else:
+            lines.append(f"{indent}{child} = {var}.get({name!r}, _MISSING)")
+            lines.append(f"{indent}if {child} is not _MISSING:")
+            lines.append(f"{indent}    pass")
+            _compile_node(subschema, child, depth + 1, lines, indent + "    ")
+
+
+def compile_schema(schema: dict) -> Callable[[object], bool]:
+    """
+    Compiles a JSON schema and returns its `is_valid` check.
+
+    Args:
+        schema (dict): The JSON schema.
+
+    Returns:
+        Callable[[object], bool]: Function returning True if an object conforms to the schema.
+    """
+    return CompiledValidator(schema).is_valid
@@ -0,0 +1,422 @@
+import os
+import re
+import time
+import socket
+import logging
+import resource
+import tempfile
+import threading
+from contextlib import contextmanager
+
+METRIC_PREFIX = "door2door"
+DEFAULT_STATSD_PORT = 8125
+
+_current = None
+
+
+class Telemetry:
+    """
+    Collects the stage timers, counters and peak memory of a task run and publishes them.
+
+    Stage timers add up the time spent in each stage. Stages run by several threads at once (e.g.
+    downloads in a `TransferPool`) add up the time of every thread, so they measure busy time
+    rather than wall time. Counters can carry labels, e.g. the event type. Gauges hold the last value
+    set, e.g. a latency.
+
+    On exit, the metrics are logged, pushed to XCom under the `telemetry` key and, depending on
+    the environment:
+
+    - written as a Prometheus textfile `door2door_<dag>_<task>[_<map_index>].prom` in
+      `TELEMETRY_TEXTFILE_DIR`, to be picked up by the node exporter's textfile collector;
+    - sent to the StatsD server at `STATSD_HOST` (and `STATSD_PORT`, default 8125) over UDP, under
+      `door2door.<dag>.<task>[.<map_index>]`.
+
+    The DAG and the map index of a mapped task are part of the file name and of the labels, so the
+    instances of a task in different DAGs, or mapped over a batch, do not overwrite each other.
+
+    While the context is active, the instance is also returned by `get_telemetry`, so helpers
+    deep in the call stack can record metrics without passing it around.
+
+    Args:
+        task_id (str): Name of the task, used as a label.
+        correlation_id (str): Correlation ID of the run, included in the XCom summary.
+        context (dict): Optional. The Airflow task context, to push the summary to XCom.
+        dag_id (str): Optional. Name of the DAG, used as a label.
+        map_index (int): Optional. Index of a mapped task instance, -1 (the default) if the task is not mapped.
+
+    Example:
+        with Telemetry.from_context(context, correlation_id) as telemetry:
+            with telemetry.stage("download"):
+                ...
+            telemetry.count("events", 10, type="vehicle_update")
+    """
+
+    def __init__(self, task_id, correlation_id=None, context=None, dag_id="unknown", map_index=-1):
+        self.task_id = task_id
+        self.dag_id = dag_id
+        self.map_index = map_index
+        self.correlation_id = correlation_id
+        self.context = context
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+        self.started_at = time.perf_counter()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_context(cls, context, correlation_id=None):
+        """
+        Builds the telemetry of the running task.
+
+        Args:
+            context (dict): The Airflow task context.
+            correlation_id (str): Correlation ID of the run.
+
+        Returns:
+            Telemetry: The telemetry, named after the DAG id, the task id and the map index.
+        """
+        task_instance = context.get("ti")
+        if task_instance is None:
+            return cls("unknown", correlation_id, context)
+        map_index = getattr(task_instance, "map_index", -1)
+        return cls(task_instance.task_id, correlation_id, context, task_instance.dag_id, -1 if map_index is None else map_index)
+
+    def __enter__(self):
+        global _current
+        _current = self
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        global _current
+        _current = None
+        self.publish(failed=exc_type is not None)
+        return False
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times a block of code and adds the time to the `name` stage.
+
+        Args:
+            name (str): Name of the stage, e.g. "download".
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started_at)
+
+    def add_time(self, name, seconds):
+        """
+        Adds time measured by the caller to a stage, e.g. accumulated over a loop.
+
+        Args:
+            name (str): Name of the stage.
+            seconds (float): Time to add.
+        """
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def timed_iter(self, iterable, name):
+        """
+        Yields the items of `iterable`, adding the time spent producing them to the `name` stage,
+        e.g. to time the parsing of a file apart from what is done with each event.
+
+        Args:
+            iterable (iterable): The items.
+            name (str): Name of the stage.
+        """
+        iterator = iter(iterable)
+        elapsed = 0.0
+        try:
+            while True:
+                started_at = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - started_at
+                yield item
+        finally:
+            self.add_time(name, elapsed)
+
+    def count(self, name, value=1, **labels):
+        """
+        Increments a counter.
+
+        Args:
+            name (str): Name of the counter, e.g. "files".
+            value (int): Amount to add.
+            **labels: Labels of the counter, e.g. type="vehicle_update".
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        """
+        Sets a gauge.
+
+        Args:
+            name (str): Name of the gauge, e.g. "batch_latency_seconds".
+            value (float): The value.
+            **labels: Labels of the gauge.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def instance(self):
+        """
+        Identifies the task instance the metrics describe.
+
+        Returns:
+            tuple: `(label, value)` pairs of the `dag` and the `task`, and the `map_index` of a mapped task.
+        """
+        labels = (("dag", self.dag_id), ("task", self.task_id))
+        if self.map_index >= 0:
+            labels += (("map_index", self.map_index),)
+        return labels
+
+    def state(self):
+        """
+        Returns the stage timers and counters, to be added to another instance with `merge`, e.g. the
+        metrics recorded in a worker process.
+
+        Returns:
+            tuple: The `stages` and `counters` dicts.
+        """
+        with self.lock:
+            return dict(self.stages), dict(self.counters)
+
+    def merge(self, state):
+        """
+        Adds the stage timers and counters of another instance.
+
+        Args:
+            state (tuple): The state returned by `state`.
+        """
+        stages, counters = state
+        with self.lock:
+            for name, seconds in stages.items():
+                self.stages[name] = self.stages.get(name, 0.0) + seconds
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def summary(self):
+        """
+        Returns the metrics as a JSON-serializable dict.
+
+        Returns:
+            dict: `stages` in seconds, `counters` and `gauges` keyed by name and labels, `peak_memory_bytes`
+            of the process and of its children, and the `elapsed` time of the task.
+        """
+        with self.lock:
+            stages = {name: round(seconds, 6) for name, seconds in self.stages.items()}
+            counters = {_counter_key(name, labels): value for (name, labels), value in self.counters.items()}
+            gauges = {_counter_key(name, labels): value for (name, labels), value in self.gauges.items()}
+        return {
+            "dag_id": self.dag_id,
+            "task_id": self.task_id,
+            "map_index": self.map_index,
+            "correlation_id": self.correlation_id,
+            "elapsed": round(time.perf_counter() - self.started_at, 6),
+            "stages": stages,
+            "counters": counters,
+            "gauges": gauges,
+            "peak_memory_bytes": peak_memory(resource.RUSAGE_SELF),
+            "peak_children_memory_bytes": peak_memory(resource.RUSAGE_CHILDREN),
+        }
+
+    def publish(self, failed=False):
+        """
+        Logs the metrics and publishes them to XCom, the Prometheus textfile and StatsD.
+
+        Publishing errors are logged and never fail the task.
+
+        Args:
+            failed (bool): Whether the task failed, reported as a metric.
+        """
+        summary = self.summary()
+        summary["failed"] = failed
+        logging.info(f"Telemetry of {self.task_id}: {summary}")
+
+        if self.context is not None and "ti" in self.context:
+            try:
+                self.context["ti"].xcom_push(key="telemetry", value=summary)
+            except Exception as e:
+                logging.warning(f"Could not push the telemetry to XCom: {e}")
+
+        textfile_dir = os.environ.get("TELEMETRY_TEXTFILE_DIR")
+        if textfile_dir:
+            try:
+                write_textfile(textfile_dir, self.instance(), prometheus_lines(self, summary))
+            except OSError as e:
+                logging.warning(f"Could not write the telemetry textfile in {textfile_dir}: {e}")
+
+        statsd_host = os.environ.get("STATSD_HOST")
+        if statsd_host:
+            try:
+                send_statsd(statsd_host, int(os.environ.get("STATSD_PORT", DEFAULT_STATSD_PORT)), statsd_lines(self, summary))
+            except OSError as e:
+                logging.warning(f"Could not send the telemetry to StatsD at {statsd_host}: {e}")
+
+
+def get_telemetry():
+    """
+    Returns the telemetry of the running task, or a detached instance that is never published
+    (e.g. in validation worker processes or outside a task).
+
+    Returns:
+        Telemetry: The telemetry.
+    """
+    return _current if _current is not None else Telemetry("detached")
+
+
+def collect_telemetry(fn, *args):
+    """
+    Calls `fn(*args)` with a telemetry returned by `get_telemetry` that is never published, e.g. in a
+    worker process, and returns what it recorded with the result.
+
+    Args:
+        fn (callable): The function. Must be picklable to be submitted to a process pool.
+        *args: Its arguments.
+
+    Returns:
+        tuple: The result of `fn`, and the `Telemetry.state` to `merge` into the task's telemetry.
+    """
+    global _current
+    telemetry = Telemetry("worker")
+    previous, _current = _current, telemetry
+    try:
+        result = fn(*args)
+    finally:
+        _current = previous
+    return result, telemetry.state()
+
+
+def peak_memory(who):
+    """Peak resident set size in bytes, as reported by `getrusage` (in KiB on Linux)."""
+    return resource.getrusage(who).ru_maxrss * 1024
+
+
+def _counter_key(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{key}={value}" for key, value in labels) + "}"
+
+
+def _metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", f"{METRIC_PREFIX}_{name}")
+
+
+def _prometheus_labels(labels):
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def prometheus_lines(telemetry, summary):
+    """
+    Formats the metrics in the Prometheus text exposition format.
+
+    Every value describes the last run of the task, so all metrics are gauges.
+
+    Args:
+        telemetry (Telemetry): The telemetry.
+        summary (dict): Its summary.
+
+    Returns:
+        list: The lines of the textfile.
+    """
+    task = tuple((key, str(value)) for key, value in telemetry.instance())
+    lines = []
+
+    def gauge(name, samples):
+        metric = _metric_name(name)
+        lines.append(f"# TYPE {metric} gauge")
+        for labels, value in samples:
+            lines.append(f"{metric}{_prometheus_labels(task + labels)} {value}")
+
+    gauge("stage_seconds", [((("stage", name),), seconds) for name, seconds in sorted(summary["stages"].items())])
+    with telemetry.lock:
+        samples = sorted(telemetry.counters.items()) + sorted(telemetry.gauges.items())
+    by_name = {}
+    for (name, labels), value in samples:
+        by_name.setdefault(name, []).append((labels, value))
+    for name, samples in by_name.items():
+        gauge(name, samples)
+    gauge("elapsed_seconds", [((), summary["elapsed"])])
+    gauge("peak_memory_bytes", [((), summary["peak_memory_bytes"])])
+    gauge("peak_children_memory_bytes", [((), summary["peak_children_memory_bytes"])])
+    gauge("failed", [((), int(summary.get("failed", False)))])
+    gauge("last_run_timestamp_seconds", [((), int(time.time()))])
+    return lines
+
+
+def write_textfile(directory, instance, lines):
+    """
+    Atomically replaces the Prometheus textfile of a task instance, so the collector never reads a partial file.
+
+    Args:
+        directory (str): The textfile collector directory.
+        instance (tuple): The `(label, value)` pairs of the task instance, see `Telemetry.instance`.
+        lines (list): The lines to write.
+    """
+    name = "_".join(str(value) for _, value in instance)
+    path = os.path.join(directory, re.sub(r"[^a-zA-Z0-9_.-]", "_", f"{METRIC_PREFIX}_{name}") + ".prom")
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".prom.tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except OSError:
+        os.remove(tmp_path)
+        raise
+
+
+def statsd_lines(telemetry, summary):
+    """
+    Formats the metrics as StatsD datagrams: stages as timers in milliseconds, counters as
+    counts, gauges and memory as gauges. The metrics are prefixed with the DAG, the task and the
+    map index of a mapped task, and labels are appended to the metric name.
+
+    Args:
+        telemetry (Telemetry): The telemetry.
+        summary (dict): Its summary.
+
+    Returns:
+        list: The datagrams.
+    """
+    prefix = ".".join([METRIC_PREFIX] + [re.sub(r"[^a-zA-Z0-9_-]", "_", str(value)) for _, value in telemetry.instance()])
+    lines = [f"{prefix}.stage.{name}:{seconds * 1000:.3f}|ms" for name, seconds in summary["stages"].items()]
+    with telemetry.lock:
+        counters = list(telemetry.counters.items())
+        gauges = list(telemetry.gauges.items())
+    for (name, labels), value in counters:
+        suffix = "".join(f".{value_}" for _, value_ in labels)
+        lines.append(f"{prefix}.{name}{suffix}:{value}|c")
+    for (name, labels), value in gauges:
+        suffix = "".join(f".{value_}" for _, value_ in labels)
+        lines.append(f"{prefix}.{name}{suffix}:{value}|g")
+    lines.append(f"{prefix}.elapsed:{summary['elapsed'] * 1000:.3f}|ms")
+    lines.append(f"{prefix}.peak_memory_bytes:{summary['peak_memory_bytes']}|g")
+    return lines
+
+
+def send_statsd(host, port, lines):
+    """
+    Sends StatsD datagrams over UDP, one metric per datagram.
+
+    Args:
+        host (str): StatsD host.
+        port (int): StatsD port.
+        lines (list): The datagrams.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for line in lines:
+            sock.sendto(line.encode(), (host, port))
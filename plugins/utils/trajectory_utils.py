@@ -0,0 +1,314 @@
+import logging
+import warnings
+from datetime import timezone
+from operator import itemgetter
+
+import numpy as np
+
+from utils.distance_utils import EARTH_RADIUS, segment_distances
+from utils.telemetry import get_telemetry
+from utils.utils import get_conf
+
+# Number of buffered points that triggers a simplification before the end of a file
+DEFAULT_TRAJECTORY_MAX_POINTS = 200000
+
+
+def project(longitudes, latitudes, reference_latitudes):
+    """
+    Equirectangular projection of points to meters, accurate over the few kilometers of a trajectory.
+
+    Args:
+        longitudes, latitudes (numpy.ndarray): Coordinates of the points, in degrees.
+        reference_latitudes (numpy.ndarray): Latitude of each point's trajectory, in degrees, where the
+            scale of the projection is exact.
+
+    Returns:
+        tuple: The x and y coordinates of the points, in meters.
+    """
+    x = EARTH_RADIUS * np.radians(longitudes) * np.cos(np.radians(reference_latitudes))
+    y = EARTH_RADIUS * np.radians(latitudes)
+    return x, y
+
+
+def point_segment_distances(x, y, x1, y1, x2, y2):
+    """
+    Distance from each point to a segment, in the unit of the coordinates.
+
+    Args:
+        x, y (numpy.ndarray): Coordinates of the points.
+        x1, y1, x2, y2 (numpy.ndarray): Coordinates of the ends of each point's segment.
+
+    Returns:
+        numpy.ndarray: The distances.
+    """
+    dx, dy = x2 - x1, y2 - y1
+    px, py = x - x1, y - y1
+    length2 = dx * dx + dy * dy
+    # position of the projection along the segment, clamped to its ends
+    t = np.clip((px * dx + py * dy) / np.where(length2 > 0, length2, 1.0), 0.0, 1.0)
+    return np.hypot(px - t * dx, py - t * dy)
+
+
+def parse_location_times(values):
+    """
+    Parses ISO 8601 location times to UTC, as PostgreSQL does when it loads them.
+
+    The source times are mostly UTC strings ending with "Z", which numpy parses at once. Otherwise, e.g.
+    with a +hh:mm offset that numpy would only warn about, every time is parsed with dateutil and converted
+    to UTC; a time without an offset is taken as UTC.
+
+    Args:
+        values (iterable): The location times, as strings.
+
+    Returns:
+        numpy.ndarray: The times as `datetime64[us]`.
+
+    Raises:
+        ValueError: A value is not an ISO 8601 time.
+    """
+    values = list(values)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            return np.array([value.rstrip("Z") for value in values], dtype="datetime64[us]")
+    except (ValueError, UserWarning):
+        pass
+    # dateutil is only needed for the times numpy does not parse
+    from dateutil import parser
+
+    times = []
+    for value in values:
+        time = parser.isoparse(value)
+        if time.tzinfo is not None:
+            time = time.astimezone(timezone.utc).replace(tzinfo=None)
+        times.append(time)
+    return np.array(times, dtype="datetime64[us]")
+
+
+def simplify_trajectories(starts, ends, x, y, tolerance):
+    """
+    Douglas-Peucker simplification of many trajectories at once.
+
+    Instead of recursing into one segment at a time, every open segment of every trajectory is split
+    in the same pass: the distances of all their inner points are computed in one vectorized call,
+    and each segment whose farthest point is more than `tolerance` away is split there. The number of
+    passes is the depth of the recursion, about log2 of the trajectory length for GPS traces. The
+    points kept are the ones of the recursive algorithm.
+
+    Args:
+        starts, ends (numpy.ndarray): Index of the first and last point of each trajectory, the points
+            being sorted by trajectory and time.
+        x, y (numpy.ndarray): Projected coordinates of the points (see `project`).
+        tolerance (float): Maximum distance between a dropped point and the simplified trajectory, in the
+            unit of the coordinates.
+
+    Returns:
+        numpy.ndarray: Boolean mask of the points kept. The ends of each trajectory are always kept.
+    """
+    keep = np.zeros(len(x), dtype=bool)
+    keep[starts] = True
+    keep[ends] = True
+    segment_starts, segment_ends = np.asarray(starts), np.asarray(ends)
+    while True:
+        open_segments = segment_ends - segment_starts > 1
+        segment_starts, segment_ends = segment_starts[open_segments], segment_ends[open_segments]
+        if not len(segment_starts):
+            break
+
+        # the inner points of every segment, laid out segment after segment
+        lengths = segment_ends - segment_starts - 1
+        offsets = np.cumsum(lengths) - lengths
+        segment = np.repeat(np.arange(len(lengths)), lengths)
+        points = segment_starts[segment] + 1 + np.arange(lengths.sum()) - offsets[segment]
+        first, last = segment_starts[segment], segment_ends[segment]
+        distances = point_segment_distances(x[points], y[points], x[first], y[first], x[last], y[last])
+
+        maxima = np.maximum.reduceat(distances, offsets)
+        split = maxima > tolerance
+        if not split.any():
+            break
+        # the first point of each segment at its maximum distance, like the recursive algorithm
+        at_maximum = np.flatnonzero(distances == maxima[segment])
+        _, first_at_maximum = np.unique(segment[at_maximum], return_index=True)
+        farthest = points[at_maximum[first_at_maximum]][split]
+
+        keep[farthest] = True
+        segment_starts, segment_ends = (
+            np.concatenate([segment_starts[split], farthest]),
+            np.concatenate([farthest, segment_ends[split]]),
+        )
+    return keep
+
+
+class TrajectoryCompressor:
+    """
+    Simplifies the trajectory of each vehicle before its updates are loaded into `vehicle_update`.
+
+    `BulkLoader` hands the `vehicle_update` rows to the compressor instead of buffering them, and
+    drains it when it flushes: the rows are sorted by vehicle and location time, each vehicle's
+    trajectory is simplified with `simplify_trajectories`, and only the points kept are loaded. Every
+    point dropped is within `tolerance` meters of the segment between the points kept around it.
+    The first and last update of each vehicle in a drain are kept, so trajectories stay connected across
+    files and checkpoints. The source files, and so the raw stream, are kept in the datalake.
+
+    The compressor also measures the distance travelled over the raw and the kept points, i.e. the
+    sum of the segments that `calculate_operating_periods_metrics` adds up, and `log_summary`
+    reports the compression ratio and the relative distance error.
+
+    Args:
+        tolerance (float): Maximum distance from a dropped point to the simplified trajectory, in meters.
+        max_points (int): Number of buffered points that triggers a drain. Default is 200000.
+
+    Example:
+        compressor = TrajectoryCompressor(tolerance=5)
+        loader = BulkLoader(cursor, compressor=compressor)
+    """
+
+    table = "vehicle_update"
+
+    def __init__(self, tolerance, max_points=DEFAULT_TRAJECTORY_MAX_POINTS):
+        self.tolerance = float(tolerance)
+        self.max_points = max_points
+        self.buffers = {}
+        self.buffered = 0
+        self.points = 0
+        self.points_kept = 0
+        self.raw_distance = 0.0
+        self.kept_distance = 0.0
+
+    @classmethod
+    def from_context(cls, context):
+        """
+        Creates a compressor from the `trajectory_tolerance` value of the DAG run config.
+
+        Args:
+            context (dict): The context dictionary provided by Airflow.
+
+        Returns:
+            TrajectoryCompressor or None: The new compressor, or None when `trajectory_tolerance` is 0
+            (the default), in which case every update is loaded.
+        """
+        tolerance = float(get_conf(context, "trajectory_tolerance", 0))
+        return cls(tolerance) if tolerance > 0 else None
+
+    def add(self, columns, row):
+        """
+        Buffer a `vehicle_update` row.
+
+        Args:
+            columns (tuple): Column names matching the values in `row`.
+            row (tuple): The values of the update.
+
+        Returns:
+            int: The number of rows buffered.
+        """
+        self.buffers.setdefault(tuple(columns), []).append(row)
+        self.buffered += 1
+        return self.buffered
+
+    def drain(self):
+        """
+        Simplify the buffered trajectories and empty the buffer.
+
+        Returns:
+            list: `(columns, rows)` pairs of the rows kept, sorted by vehicle and location time. The
+            rows whose location times do not parse (see `parse_location_times`) are all kept, unsorted.
+        """
+        drained = [(columns, self._simplify(columns, rows)) for columns, rows in self.buffers.items()]
+        self.discard()
+        return drained
+
+    def discard(self):
+        """
+        Drop the buffered rows.
+
+        Returns:
+            None
+        """
+        self.buffers.clear()
+        self.buffered = 0
+
+    def savepoint(self):
+        """
+        Mark the current statistics, to be restored with `rollback` when the rows drained since are
+        rolled back.
+
+        Returns:
+            tuple: The state of the compressor.
+        """
+        return self.points, self.points_kept, self.raw_distance, self.kept_distance
+
+    def rollback(self, state):
+        """
+        Drop the buffered rows and restore the statistics returned by `savepoint`.
+
+        Args:
+            state (tuple): The state returned by `savepoint`.
+
+        Returns:
+            None
+        """
+        self.discard()
+        self.points, self.points_kept, self.raw_distance, self.kept_distance = state
+
+    def _simplify(self, columns, rows):
+        def column(name):
+            return map(itemgetter(columns.index(name)), rows)
+
+        vehicle_ids = list(column("vehicle_id"))
+        codes = {vehicle_id: code for code, vehicle_id in enumerate(dict.fromkeys(vehicle_ids))}
+        vehicles = np.fromiter(map(codes.__getitem__, vehicle_ids), np.int64, len(rows))
+        # the source times are ISO 8601 strings whose fractional seconds vary in precision, so they do
+        # not sort as strings. The updates of a vehicle mostly come in time order, so they are only sorted
+        # by time when they do not.
+        try:
+            times = parse_location_times(column("location_time"))
+        except (TypeError, ValueError) as error:
+            logging.warning(
+                f"Loading {len(rows)} vehicle updates without simplifying them, a location time does not parse: {error}"
+            )
+            self.points += len(rows)
+            self.points_kept += len(rows)
+            return rows
+        order = np.argsort(vehicles, kind="stable")
+        vehicles, times = vehicles[order], times[order]
+        if np.any((times[1:] < times[:-1]) & (vehicles[1:] == vehicles[:-1])):
+            by_time = np.lexsort((times, vehicles))
+            order, vehicles = order[by_time], vehicles[by_time]
+        longitudes = np.fromiter(column("longitude"), np.float64, len(rows))[order]
+        latitudes = np.fromiter(column("latitude"), np.float64, len(rows))[order]
+
+        starts = np.flatnonzero(np.concatenate([[True], vehicles[1:] != vehicles[:-1]]))
+        ends = np.concatenate([starts[1:] - 1, [len(rows) - 1]])
+        reference_latitudes = np.repeat(latitudes[starts], ends - starts + 1)
+        x, y = project(longitudes, latitudes, reference_latitudes)
+        keep = simplify_trajectories(starts, ends, x, y, self.tolerance)
+
+        self.points += len(rows)
+        self.points_kept += int(keep.sum())
+        self.raw_distance += float(np.nansum(segment_distances(vehicles, longitudes, latitudes)))
+        self.kept_distance += float(np.nansum(segment_distances(vehicles[keep], longitudes[keep], latitudes[keep])))
+        return list(map(rows.__getitem__, order[keep].tolist()))
+
+    def log_summary(self):
+        """
+        Log the points kept and record them in the task's telemetry, with the `trajectory_compression_ratio`
+        (raw points per point kept) and `trajectory_distance_error` (relative difference between the
+        distance travelled over the raw and the kept points) gauges.
+
+        Returns:
+            None
+        """
+        if not self.points:
+            return
+        ratio = self.points / self.points_kept
+        error = (self.raw_distance - self.kept_distance) / self.raw_distance if self.raw_distance else 0.0
+        telemetry = get_telemetry()
+        telemetry.count("trajectory_points", self.points)
+        telemetry.count("trajectory_points_kept", self.points_kept)
+        telemetry.gauge("trajectory_compression_ratio", ratio)
+        telemetry.gauge("trajectory_distance_error", error)
+        logging.info(
+            f"TrajectoryCompressor kept {self.points_kept} of {self.points} vehicle updates ({ratio:.1f}x) within "
+            f"{self.tolerance:g}m, the distance travelled is {error:.3%} shorter than over the raw points"
+        )
@@ -1,5 +1,10 @@
+import os
 import uuid
 import hashlib
+import importlib
+from datetime import datetime, time, timedelta, timezone
+
+DEFAULT_RESOURCES_PATH = "/opt/airflow/resources"
 
 def generate_correlation_id(run_id : str):
     """
@@ -17,4 +22,208 @@ def generate_correlation_id(run_id : str):
         of the provided `run_id`.
     """
     
-    return hashlib.md5(run_id.encode()).hexdigest()
\ No newline at end of file
+    return hashlib.md5(run_id.encode()).hexdigest()
+
+def get_conf(context, key, default=None):
+    """
+    Reads a value from the DAG run configuration.
+
+    Parameters:
+    -----------
+    context : dict
+        The context dictionary provided by Airflow.
+    key : str
+        The configuration key to read.
+    default : any
+        The value returned when the key is missing or the run has no configuration.
+
+    Returns:
+    --------
+    any
+        The configured value, or `default`.
+    """
+    
+    dag_run = context.get('dag_run')
+    conf = getattr(dag_run, 'conf', None) or {}
+    value = conf.get(key)
+    return default if value is None else value
+
+def backfill_dates(context):
+    """
+    Reads the date range of a backfill run from the `start_date` and `end_date` values of the
+    DAG run configuration.
+
+    Parameters:
+    -----------
+    context : dict
+        The context dictionary provided by Airflow.
+
+    Returns:
+    --------
+    list or None
+        The dates of the range, both ends included, in the format "%Y-%m-%d", or None when the
+        run is not a backfill.
+    """
+    
+    start_date = get_conf(context, 'start_date')
+    end_date = get_conf(context, 'end_date')
+    if start_date is None and end_date is None:
+        return None
+    if start_date is None or end_date is None:
+        raise ValueError(f"Backfill needs both start_date and end_date, got {start_date=} and {end_date=}")
+    
+    # dateutil is only needed by the tasks, not when the DAG files are parsed
+    from dateutil import parser
+
+    start_date = parser.parse(str(start_date)).date()
+    end_date = parser.parse(str(end_date)).date()
+    if end_date < start_date:
+        raise ValueError(f"Backfill end_date {end_date} is before start_date {start_date}")
+    return [(start_date + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range((end_date - start_date).days + 1)]
+
+def day_correlation_id(run_id : str, date_str : str):
+    """
+    Generates the correlation ID of one day of a backfill run, so that the rows of each day are
+    tagged apart even though the days are processed together.
+
+    Parameters:
+    -----------
+    run_id : str
+        The ID of the current run.
+    date_str : str
+        The day, in the format "%Y-%m-%d".
+
+    Returns:
+    --------
+    str
+        The generated correlation ID.
+    """
+    
+    return generate_correlation_id(f"{run_id}:{date_str}")
+
+def run_correlation_ids(context):
+    """
+    Lists the correlation IDs of the rows a run loaded: one per day for a backfill run (see
+    `backfill_dates`), otherwise the single correlation ID of the run.
+
+    Parameters:
+    -----------
+    context : dict
+        The context dictionary provided by Airflow.
+
+    Returns:
+    --------
+    list
+        The correlation IDs.
+    """
+    
+    run_id = context['dag_run'].run_id
+    dates = backfill_dates(context)
+    if dates is None:
+        return [generate_correlation_id(run_id)]
+    return [day_correlation_id(run_id, date_str) for date_str in dates]
+
+def run_time_range(context, target_date=None, lookback_days=0):
+    """
+    Bounds the location times of the rows a run loaded from the run's dates: every day of a backfill
+    run (see `backfill_dates`), otherwise `target_date` and the `lookback_days` days before it (see
+    `day_time_range`).
+
+    Parameters:
+    -----------
+    context : dict
+        The context dictionary provided by Airflow.
+    target_date : str or datetime.datetime
+        The date of the run, in the format "%Y-%m-%d" if a string. Ignored by a backfill run.
+    lookback_days : int
+        Number of days before the first date the run also loaded, e.g. listed by a micro-batch.
+
+    Returns:
+    --------
+    tuple
+        The (start, end) UTC datetimes of the range, end excluded, or (None, None) when the run has
+        no date.
+    """
+    
+    dates = backfill_dates(context)
+    if dates is None:
+        if target_date is None:
+            return None, None
+        dates = [target_date]
+    # dateutil is only needed by the tasks, not when the DAG files are parsed
+    from dateutil import parser
+
+    days = [parser.parse(str(date)).date() for date in dates]
+    return day_time_range(min(days) - timedelta(days=int(lookback_days)), max(days))
+
+def day_time_range(first_day, last_day):
+    """
+    Bounds the location times of the events of a range of days. Events close to midnight may fall on
+    the neighbouring days, so, like the partitions created by ensure_table_creation, the range starts
+    the day before `first_day` and ends with the day after `last_day`.
+
+    Parameters:
+    -----------
+    first_day : datetime.date
+        The first day of the range.
+    last_day : datetime.date
+        The last day of the range, included.
+
+    Returns:
+    --------
+    tuple
+        The (start, end) UTC datetimes of the range, end excluded.
+    """
+    
+    start = datetime.combine(first_day - timedelta(days=1), time.min, timezone.utc)
+    end = datetime.combine(last_day + timedelta(days=2), time.min, timezone.utc)
+    return start, end
+
+def resources_path(*parts):
+    """
+    Builds the path of a file in the resources directory (JSON schemas, SQL tables and migrations).
+
+    The directory is read from the `DOOR2DOOR_RESOURCES_PATH` environment variable at call time,
+    and defaults to "/opt/airflow/resources", where docker-compose mounts the repository's `resources/`.
+
+    Parameters:
+    -----------
+    *parts : str
+        Path components below the resources directory.
+
+    Returns:
+    --------
+    str
+        The path.
+    """
+    return os.path.join(os.environ.get("DOOR2DOOR_RESOURCES_PATH", DEFAULT_RESOURCES_PATH), *parts)
+
+def lazy_callable(module_name : str, function_name : str = None):
+    """
+    Wraps a task callable so that its module is imported when the task runs, not when the DAG file is parsed.
+
+    The scheduler parses the DAG files in a loop, so they only import Airflow and this module. The task
+    modules and their dependencies (MinIO, jsonschema, psycopg2, ...) are imported by the worker, once
+    per process.
+
+    Parameters:
+    -----------
+    module_name : str
+        The module of the callable, e.g. "tasks.fetch_and_validate_bucket".
+    function_name : str
+        The name of the callable in the module. Defaults to the last component of `module_name`.
+
+    Returns:
+    --------
+    function
+        A function taking any arguments, so Airflow passes it the whole context, and calling the
+        task callable with them.
+    """
+    function_name = function_name or module_name.rsplit(".", 1)[-1]
+
+    def call(*args, **kwargs):
+        return getattr(importlib.import_module(module_name), function_name)(*args, **kwargs)
+
+    call.__name__ = call.__qualname__ = function_name
+    call.__module__ = module_name
+    return call
\ No newline at end of file
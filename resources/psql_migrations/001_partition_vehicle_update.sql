@@ -0,0 +1,11 @@
+-- vehicle_update used to be a plain table. Move it out of the way so that psql_tables/vehicle_update.sql
+-- creates the partitioned table, then migrate_unpartitioned_vehicle_update() copies the rows over.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass('vehicle_update') AND relkind = 'r') THEN
+        ALTER TABLE vehicle_update RENAME TO vehicle_update_unpartitioned;
+        ALTER INDEX IF EXISTS vehicle_update_pkey RENAME TO vehicle_update_unpartitioned_pkey;
+        ALTER SEQUENCE IF EXISTS vehicle_update_uid_seq RENAME TO vehicle_update_unpartitioned_uid_seq;
+    END IF;
+END;
+$$;
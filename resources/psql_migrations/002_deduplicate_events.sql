@@ -0,0 +1,51 @@
+-- psql_tables adds unique indexes on the event keys of vehicle_update and vehicle_registration. Until they
+-- exist, remove the duplicates loaded before, keeping the first row of each key, and the segments computed
+-- from the removed updates. vehicle_update_unpartitioned is the table renamed by 001, not copied yet.
+DO $$
+BEGIN
+    IF to_regclass('vehicle_update_event_key_idx') IS NULL THEN
+        IF to_regclass('vehicle_update') IS NOT NULL AND to_regclass('vehicle_update_segment') IS NOT NULL THEN
+            WITH removed AS (
+                DELETE FROM vehicle_update d
+                USING vehicle_update k
+                WHERE
+                    d.vehicle_id = k.vehicle_id
+                    AND d.location_time = k.location_time
+                    AND d.latitude = k.latitude
+                    AND d.longitude = k.longitude
+                    AND d.uid > k.uid
+                RETURNING d.uid
+            )
+            DELETE FROM vehicle_update_segment WHERE update_uid IN (SELECT uid FROM removed);
+        ELSIF to_regclass('vehicle_update') IS NOT NULL THEN
+            DELETE FROM vehicle_update d
+            USING vehicle_update k
+            WHERE
+                d.vehicle_id = k.vehicle_id
+                AND d.location_time = k.location_time
+                AND d.latitude = k.latitude
+                AND d.longitude = k.longitude
+                AND d.uid > k.uid;
+        END IF;
+        IF to_regclass('vehicle_update_unpartitioned') IS NOT NULL THEN
+            DELETE FROM vehicle_update_unpartitioned d
+            USING vehicle_update_unpartitioned k
+            WHERE
+                d.vehicle_id = k.vehicle_id
+                AND d.location_time = k.location_time
+                AND d.latitude = k.latitude
+                AND d.longitude = k.longitude
+                AND d.uid > k.uid;
+        END IF;
+    END IF;
+    IF to_regclass('vehicle_registration_event_key_idx') IS NULL AND to_regclass('vehicle_registration') IS NOT NULL THEN
+        DELETE FROM vehicle_registration d
+        USING vehicle_registration k
+        WHERE
+            d.vehicle_id = k.vehicle_id
+            AND d.event = k.event
+            AND d.event_time = k.event_time
+            AND d.uid > k.uid;
+    END IF;
+END;
+$$;
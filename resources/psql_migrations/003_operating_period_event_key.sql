@@ -0,0 +1,3 @@
+-- operating_period_id used to be unique on its own, which dropped the delete event of a created period.
+-- psql_tables/operating_period.sql keys the events on (operating_period_id, event) instead.
+ALTER TABLE IF EXISTS operating_period DROP CONSTRAINT IF EXISTS operating_period_operating_period_id_key;
@@ -0,0 +1,11 @@
+CREATE TABLE IF NOT EXISTS ingestion_manifest (
+    stage TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    object_name TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    size BIGINT NOT NULL,
+    valid BOOLEAN NOT NULL,
+    correlation_id TEXT NOT NULL,
+    processed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    PRIMARY KEY (stage, bucket, object_name)
+);
\ No newline at end of file
@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS ingestion_watermark (
+    bucket TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    last_modified TIMESTAMP WITH TIME ZONE NOT NULL,
+    correlation_id TEXT NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    PRIMARY KEY (bucket, prefix)
+);
\ No newline at end of file
@@ -1,6 +1,6 @@
 CREATE TABLE IF NOT EXISTS operating_period (
     uid SERIAL PRIMARY KEY,
-    operating_period_id TEXT NOT NULL UNIQUE,
+    operating_period_id TEXT NOT NULL,
     vehicle_id TEXT,
     start TIMESTAMP WITH TIME ZONE NOT NULL,
     finish TIMESTAMP WITH TIME ZONE NOT NULL,
@@ -8,4 +8,9 @@ CREATE TABLE IF NOT EXISTS operating_period (
     event_time TIMESTAMP WITH TIME ZONE NOT NULL,
     organization_id VARCHAR(50) NOT NULL,
     correlation_id TEXT NOT NULL
-);
\ No newline at end of file
+);
+
+CREATE INDEX IF NOT EXISTS operating_period_correlation_idx ON operating_period (correlation_id);
+CREATE INDEX IF NOT EXISTS operating_period_vehicle_start_idx ON operating_period (vehicle_id, start);
+-- A redelivered event is loaded once, while the create and delete events of a period are both kept (see BulkLoader)
+CREATE UNIQUE INDEX IF NOT EXISTS operating_period_event_key_idx ON operating_period (operating_period_id, event);
\ No newline at end of file
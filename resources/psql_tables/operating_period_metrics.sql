@@ -3,4 +3,6 @@ CREATE TABLE IF NOT EXISTS operating_period_metrics (
     time_elapsed INTERVAL,
     distance_travelled FLOAT,
     correlation_id TEXT NOT NULL
-);
\ No newline at end of file
+);
+
+CREATE INDEX IF NOT EXISTS operating_period_metrics_correlation_idx ON operating_period_metrics (correlation_id);
\ No newline at end of file
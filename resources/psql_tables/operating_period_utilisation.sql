@@ -0,0 +1,15 @@
+-- Rollup of operating_period and operating_period_metrics per vehicle operating period, maintained by update_rollups
+CREATE TABLE IF NOT EXISTS operating_period_utilisation (
+    operating_period_id TEXT PRIMARY KEY,
+    organization_id VARCHAR(50) NOT NULL,
+    vehicle_id TEXT NOT NULL,
+    day DATE NOT NULL,
+    start TIMESTAMP WITH TIME ZONE NOT NULL,
+    finish TIMESTAMP WITH TIME ZONE NOT NULL,
+    operating_seconds DOUBLE PRECISION NOT NULL,
+    distance_travelled DOUBLE PRECISION,
+    updates BIGINT NOT NULL,
+    correlation_id TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS operating_period_utilisation_organization_day_idx ON operating_period_utilisation (organization_id, day);
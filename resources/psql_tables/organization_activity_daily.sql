@@ -0,0 +1,12 @@
+-- Rollup of vehicle_activity_daily and operating_period_utilisation per organization and UTC day, maintained by update_rollups
+CREATE TABLE IF NOT EXISTS organization_activity_daily (
+    organization_id VARCHAR(50) NOT NULL,
+    day DATE NOT NULL,
+    active_vehicles INTEGER NOT NULL,
+    updates BIGINT NOT NULL,
+    distance DOUBLE PRECISION NOT NULL,
+    operating_periods INTEGER NOT NULL,
+    operating_seconds DOUBLE PRECISION NOT NULL,
+    correlation_id TEXT NOT NULL,
+    PRIMARY KEY (organization_id, day)
+);
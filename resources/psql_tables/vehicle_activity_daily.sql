@@ -0,0 +1,13 @@
+-- Rollup of vehicle_activity_hourly per vehicle and UTC day, maintained by update_rollups
+CREATE TABLE IF NOT EXISTS vehicle_activity_daily (
+    organization_id VARCHAR(50) NOT NULL,
+    day DATE NOT NULL,
+    vehicle_id TEXT NOT NULL,
+    updates BIGINT NOT NULL,
+    distance DOUBLE PRECISION NOT NULL,
+    active_hours INTEGER NOT NULL,
+    correlation_id TEXT NOT NULL,
+    PRIMARY KEY (organization_id, day, vehicle_id)
+);
+
+CREATE INDEX IF NOT EXISTS vehicle_activity_daily_vehicle_day_idx ON vehicle_activity_daily (vehicle_id, day);
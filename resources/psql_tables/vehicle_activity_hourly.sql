@@ -0,0 +1,13 @@
+-- Rollup of vehicle_update and vehicle_update_segment per vehicle and UTC hour, maintained by update_rollups.
+-- The distance of a segment counts in the hour of the update that ends it.
+CREATE TABLE IF NOT EXISTS vehicle_activity_hourly (
+    organization_id VARCHAR(50) NOT NULL,
+    vehicle_id TEXT NOT NULL,
+    hour TIMESTAMP WITH TIME ZONE NOT NULL,
+    updates BIGINT NOT NULL,
+    distance DOUBLE PRECISION NOT NULL,
+    correlation_id TEXT NOT NULL,
+    PRIMARY KEY (vehicle_id, hour, organization_id)
+);
+
+CREATE INDEX IF NOT EXISTS vehicle_activity_hourly_organization_hour_idx ON vehicle_activity_hourly (organization_id, hour);
@@ -5,4 +5,9 @@ CREATE TABLE IF NOT EXISTS vehicle_registration (
     event_time TIMESTAMP WITH TIME ZONE NOT NULL,
     organization_id VARCHAR(50) NOT NULL,
     correlation_id TEXT NOT NULL
-);
\ No newline at end of file
+);
+
+CREATE INDEX IF NOT EXISTS vehicle_registration_correlation_idx ON vehicle_registration (correlation_id);
+CREATE INDEX IF NOT EXISTS vehicle_registration_vehicle_time_idx ON vehicle_registration (vehicle_id, event_time);
+-- A redelivered registration is loaded once (see BulkLoader)
+CREATE UNIQUE INDEX IF NOT EXISTS vehicle_registration_event_key_idx ON vehicle_registration (vehicle_id, event, event_time);
\ No newline at end of file
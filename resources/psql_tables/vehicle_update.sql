@@ -1,10 +1,71 @@
 CREATE TABLE IF NOT EXISTS vehicle_update (
-    uid SERIAL PRIMARY KEY,
+    uid BIGSERIAL,
     vehicle_id TEXT NOT NULL,
     latitude NUMERIC(10,6) NOT NULL,
     longitude NUMERIC(10,6) NOT NULL,
     location_time TIMESTAMP WITH TIME ZONE NOT NULL,
     event_time TIMESTAMP WITH TIME ZONE NOT NULL,
     organization_id VARCHAR(50) NOT NULL,
-    correlation_id TEXT NOT NULL
-);
\ No newline at end of file
+    correlation_id TEXT NOT NULL,
+    PRIMARY KEY (uid, location_time)
+) PARTITION BY RANGE (location_time);
+
+-- Rows outside the daily partitions land here until split_vehicle_update_default() moves them
+CREATE TABLE IF NOT EXISTS vehicle_update_default PARTITION OF vehicle_update DEFAULT;
+
+CREATE INDEX IF NOT EXISTS vehicle_update_correlation_vehicle_time_idx ON vehicle_update (correlation_id, vehicle_id, location_time);
+CREATE INDEX IF NOT EXISTS vehicle_update_vehicle_time_idx ON vehicle_update (vehicle_id, location_time);
+-- A redelivered update is loaded once (see BulkLoader)
+CREATE UNIQUE INDEX IF NOT EXISTS vehicle_update_event_key_idx ON vehicle_update (vehicle_id, location_time, latitude, longitude);
+
+-- Creates the partition of vehicle_update holding one UTC day, moving that day's rows out of the default partition
+CREATE OR REPLACE FUNCTION ensure_vehicle_update_partition(day DATE) RETURNS void AS $$
+DECLARE
+    partition_name TEXT := 'vehicle_update_' || to_char(day, 'YYYYMMDD');
+    lower_bound TIMESTAMP WITH TIME ZONE := day::timestamp AT TIME ZONE 'UTC';
+    upper_bound TIMESTAMP WITH TIME ZONE := (day + 1)::timestamp AT TIME ZONE 'UTC';
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('vehicle_update_partitions'));
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE vehicle_update INCLUDING DEFAULTS)', partition_name);
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM vehicle_update_default WHERE location_time >= %L AND location_time < %L RETURNING *) '
+        'INSERT INTO %I SELECT * FROM moved',
+        lower_bound, upper_bound, partition_name
+    );
+    EXECUTE format(
+        'ALTER TABLE vehicle_update ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        partition_name, lower_bound, upper_bound
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Gives every day still stored in the default partition its own partition
+CREATE OR REPLACE FUNCTION split_vehicle_update_default() RETURNS void AS $$
+DECLARE
+    day DATE;
+BEGIN
+    FOR day IN
+        SELECT DISTINCT (location_time AT TIME ZONE 'UTC')::date FROM vehicle_update_default
+    LOOP
+        PERFORM ensure_vehicle_update_partition(day);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Second step of psql_migrations/001_partition_vehicle_update.sql: copies the rows of the former
+-- unpartitioned table into the partitioned one
+CREATE OR REPLACE FUNCTION migrate_unpartitioned_vehicle_update() RETURNS void AS $$
+BEGIN
+    IF to_regclass('vehicle_update_unpartitioned') IS NULL THEN
+        RETURN;
+    END IF;
+    INSERT INTO vehicle_update (uid, vehicle_id, latitude, longitude, location_time, event_time, organization_id, correlation_id)
+    SELECT uid, vehicle_id, latitude, longitude, location_time, event_time, organization_id, correlation_id
+    FROM vehicle_update_unpartitioned;
+    PERFORM setval(pg_get_serial_sequence('vehicle_update', 'uid'), COALESCE((SELECT max(uid) FROM vehicle_update), 0) + 1, false);
+    DROP TABLE vehicle_update_unpartitioned;
+END;
+$$ LANGUAGE plpgsql;
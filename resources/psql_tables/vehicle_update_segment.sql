@@ -0,0 +1,10 @@
+CREATE TABLE IF NOT EXISTS vehicle_update_segment (
+    update_uid BIGINT PRIMARY KEY,
+    vehicle_id TEXT NOT NULL,
+    location_time TIMESTAMP WITH TIME ZONE NOT NULL,
+    distance DOUBLE PRECISION,
+    correlation_id TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS vehicle_update_segment_correlation_vehicle_time_idx ON vehicle_update_segment (correlation_id, vehicle_id, location_time);
+CREATE INDEX IF NOT EXISTS vehicle_update_segment_vehicle_time_idx ON vehicle_update_segment (vehicle_id, location_time);